@@ -0,0 +1,217 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from generator import ConsoleUtility
+import scheduler
+
+""" Benchmark suite
+
+Measures rows/sec and MB/sec of the generator per field type, per output
+sink and per worker count, writes the results to JSON and compares them with
+a baseline run, failing when throughput drops more than the threshold.
+
+$ python bench.py --rows=200000 --output=bench.json
+$ python bench.py --rows=200000 --baseline=bench.json --threshold=0.1
+"""
+
+FIELD_TYPES = {
+    'timestamp': 'timestamp:',
+    'str_rand': 'str:rand',
+    'str_list': "str:['client', 'partner', 'government']",
+    'int_rand': 'int:rand(1, 1000)',
+    'constant': "str:'constant'",
+    'float_rand': 'float:rand(0, 1000)',
+    'float_normal': 'float:normal(100, 15)',
+    'bool': 'bool:0.3',
+    'date': 'date:rand(2020-01-01, 2024-12-31)',
+    'datetime': 'datetime:rand(2020-01-01, 2024-12-31)',
+    'str_weighted': "str:{'client': 0.7, 'partner': 0.2, 'government': 0.1}",
+    'int_zipf': 'int:zipf(1.2, 100000)',
+    'nullable': 'int:rand(1, 1000)|nullable(0.1)',
+    'nested': {'name': "str:['a', 'b', 'c']", 'age': 'int:rand(1, 90)'},
+    'array': ['int:rand(1, 1000)', 0, 5],
+    'int_unique': 'int:unique',
+    'str_rand_pool': 'str:rand(pool=100000)',
+    'timestamp_pool': 'timestamp:rand(pool=100000)',
+}
+
+DEFAULT_SCHEMA = {"date": "timestamp:", "name": "str:rand", "type": "str:['client', 'partner', 'government']",
+                  "age": "int:rand(1, 200)"}
+
+# name, format, compression, streamed
+SINKS = [
+    ('jsonl', 'jsonl', 'none', False),
+    ('jsonl_gzip', 'jsonl', 'gzip', False),
+    ('jsonl_zstd', 'jsonl', 'zstd', False),
+    ('csv', 'csv', 'none', False),
+    ('parquet', 'parquet', 'none', False),
+    ('arrow', 'arrow', 'none', False),
+    ('fixed', 'fixed', 'none', False),
+    ('stream', 'jsonl', 'none', True),
+]
+
+# Optional modules required by sinks
+SINK_REQUIREMENTS = {'jsonl_zstd': 'zstandard', 'parquet': 'pyarrow', 'arrow': 'pyarrow'}
+
+
+def is_available(module: str):
+    """ Returning true or false if optional module can be imported """
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+def directory_size(path: str):
+    """ Returning size of all files in directory """
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def measure(name: str, group: str, rows: int, run, repeat: int = 3):
+    """ Running benchmark case `repeat` times and returning the best result """
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as path:
+            start = time.perf_counter()
+            run(path)
+            seconds = time.perf_counter() - start
+            size = directory_size(path)
+        if best is None or seconds < best[0]:
+            best = (seconds, size)
+    seconds, size = best
+    return {'name': name, 'group': group, 'rows': rows, 'seconds': seconds, 'bytes': size,
+            'rows_per_sec': rows / seconds, 'mb_per_sec': size / seconds / 1024 / 1024}
+
+
+def make_cli(path: str, schema: dict, rows: int, engine: str = 'python', file_count: int = 1, **options):
+    """ Returning ConsoleUtility writing to path """
+    cli = ConsoleUtility(path=path, file_count=file_count, file_name='bench', file_prefix='count',
+                         data_schema=schema, data_lines=rows, clear_path='False', multiprocessing=1, engine=engine,
+                         seed=0, **options)
+    cli.get_schema_plan()
+    return cli
+
+
+def bench_field_types(rows: int, engines: list, repeat: int):
+    """ Benchmarking every field type alone """
+    results = []
+    for engine in engines:
+        for type_name, spec in FIELD_TYPES.items():
+            def run(path, spec=spec, engine=engine):
+                make_cli(path, {'value': spec}, rows, engine).generate_jsonl_loop()
+            results.append(measure('field/{}/{}'.format(type_name, engine), 'field', rows, run, repeat))
+    return results
+
+
+def bench_sinks(rows: int, engines: list, repeat: int):
+    """ Benchmarking output formats, compressions and streaming """
+    results = []
+    for engine in engines:
+        for name, output_format, compression, streamed in SINKS:
+            if name in SINK_REQUIREMENTS and not is_available(SINK_REQUIREMENTS[name]):
+                logging.info('Skipping sink {}, {} is not installed'.format(name, SINK_REQUIREMENTS[name]))
+                continue
+
+            def run(path, output_format=output_format, compression=compression, streamed=streamed, engine=engine):
+                cli = make_cli(path, DEFAULT_SCHEMA, rows, engine, output_format=output_format,
+                               compression=compression)
+                if streamed:
+                    cli.stream(os.path.join(path, 'stream.jsonl'), rows)
+                else:
+                    cli.generate_jsonl_loop()
+            results.append(measure('sink/{}/{}'.format(name, engine), 'sink', rows, run, repeat))
+    return results
+
+
+def bench_workers(rows: int, workers: list, engines: list, repeat: int):
+    """ Benchmarking the process pool with the same total rows split into files """
+    results = []
+    files = max(workers)
+    for engine in engines:
+        for count in workers:
+            def run(path, count=count, engine=engine):
+                cli = make_cli(path, DEFAULT_SCHEMA, rows // files, engine, file_count=files)
+                if count == 1:
+                    cli.generate_jsonl_loop()
+                else:
+                    scheduler.run(cli, count)
+            results.append(measure('workers/{}/{}'.format(count, engine), 'workers', rows // files * files, run,
+                                   repeat))
+    return results
+
+
+def run_benchmarks(rows: int, workers: list, engines: list, repeat: int = 3, groups: list = None):
+    """ Running selected benchmark groups and returning the report """
+    groups = groups or ['field', 'sink', 'workers']
+    results = []
+    if 'field' in groups:
+        results += bench_field_types(rows, engines, repeat)
+    if 'sink' in groups:
+        results += bench_sinks(rows, engines, repeat)
+    if 'workers' in groups:
+        results += bench_workers(rows, workers, engines, repeat)
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'rows': rows, 'results': results}
+
+
+def compare(report: dict, baseline: dict, threshold: float):
+    """ Returning list of (name, baseline, current) rows/sec for cases slower than baseline by threshold """
+    previous = {result['name']: result for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        if result['name'] in previous:
+            expected = previous[result['name']]['rows_per_sec']
+            if result['rows_per_sec'] < expected * (1 - threshold):
+                regressions.append((result['name'], expected, result['rows_per_sec']))
+    return regressions
+
+
+def main():
+    """ Set up argparse to handle benchmark arguments """
+    parser = argparse.ArgumentParser(prog='Console Utility benchmark',
+                                     description='Throughput benchmarks of the data generator.')
+    parser.add_argument('--rows', help='Rows generated by each case', type=int, default=100000)
+    parser.add_argument('--workers', help='Comma separated worker counts', type=str, default='1,2,4')
+    parser.add_argument('--engines', help='Comma separated engines', type=str, default='python')
+    parser.add_argument('--groups', help='Comma separated groups: field, sink, workers', type=str,
+                        default='field,sink,workers')
+    parser.add_argument('--repeat', help='Runs of every case, the best one is reported', type=int, default=3)
+    parser.add_argument('--output', help='Path of the JSON results file', type=str)
+    parser.add_argument('--baseline', help='Path of a previous JSON results file to compare with', type=str)
+    parser.add_argument('--threshold', help='Allowed relative rows/sec drop against the baseline', type=float,
+                        default=0.1)
+    logging.basicConfig(level=logging.WARNING)
+    args = parser.parse_args()
+
+    workers = [int(count) for count in args.workers.split(',')]
+    engines = args.engines.split(',')
+    if 'numpy' in engines and not is_available('numpy'):
+        logging.error('Error: NumPy engine requires numpy to be installed')
+        sys.exit(1)
+    report = run_benchmarks(args.rows, workers, engines, args.repeat, args.groups.split(','))
+    for result in report['results']:
+        print('{:<32} {:>12.0f} rows/s {:>9.2f} MB/s'.format(result['name'], result['rows_per_sec'],
+                                                             result['mb_per_sec']))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, args.threshold)
+        for name, expected, current in regressions:
+            print('Regression {}: {:.0f} -> {:.0f} rows/s'.format(name, expected, current))
+        if regressions:
+            sys.exit(1)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
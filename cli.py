@@ -2,325 +2,35 @@ import argparse
 import configparser
 import logging
 import os
-import random
 import sys
-import json
-import re
-import time
-import uuid
-from multiprocessing import Pool
 
-""" Setting up default values """
-config = configparser.ConfigParser()
-config.read('default.ini')
-default = config['default']
+import delta
+import formats
+import metrics
+import serializers
+import sinks
+import sizing
+import tables
+from generator import ConsoleUtility, generate
 
-""" Main Class"""
+""" Command line interface
 
+Parses the arguments, with defaults from default.ini in the working directory
+or next to this file, and runs the generator. ConsoleUtility and generate are
+imported from the generator module, which does not read any configuration.
+"""
 
-class ConsoleUtility:
-    def __init__(self, path: str, file_count: int, file_name: str, file_prefix: str, data_schema: str, data_lines: int,
-                 clear_path: bool, multiprocessing: int):
-        self.path = path
-        self.file_count = file_count
-        self.file_name = file_name
-        self.file_prefix = file_prefix
-        self.data_schema = data_schema
-        self.data_lines = data_lines
-        self.clear_path = clear_path
-        self.multiprocessing = multiprocessing
+# Defaults of the command line, read next to the module when the working directory has none
+DEFAULT_CONFIG = 'default.ini'
 
-    def check_args(self):
-        """ Checking if provided arguments are correct """
-        file_prefixes = ['count', 'random', 'uuid']
-        path_booleans = ['True', 'False']
 
-        if self.path == '.':
-            self.path = os.getcwd()
-        if not os.path.exists(self.path):
-            logging.error('Error: Directory does not exist.')
-            return False
-        if self.file_prefix not in file_prefixes:
-            logging.error('Error: File prefix must be either "count", "random" or "uuid"')
-            return False
-        if self.clear_path not in path_booleans:
-            logging.error('Error: Clear path only takes True or False values')
-            return False
-        if self.file_count < 0:
-            logging.error('Error: Files count must be greater than 0')
-            return False
-        if self.multiprocessing <= 0:
-            logging.error('Error: Multiprocessing must be greater than 0')
-            return False
-        if self.multiprocessing > os.cpu_count():
-            self.multiprocessing = os.cpu_count()
-            logging.info("Number of input processing units larger than amount of cpu processors, setting input to "
-                         "cpu_count")
-        return True
-
-    def clear_path_and_files(self, path: str):
-        """ Clearing directory path files """
-        for file in os.listdir(path):
-            if file.find(self.file_name) != -1:
-                os.remove(path + '/' + file)
-        logging.info('Removed files that match filename')
-
-    def check_path_or_schema(self, path_to_schema):
-        """ Checking if the provided schema is a string schema or JSON file """
-        try:
-            with open(path_to_schema, 'r') as file:
-                path_to_schema = json.load(file)
-            logging.info('Provided with JSON file schema')
-        except:
-            logging.info('Provided with command line schema')
-            return False
-        return True
-
-    def load_schema(self, path_to_schema: str):
-        """ Loading string with dict schema and returning dict object """
-        with open(path_to_schema, 'r') as file:
-            data_schema = json.load(file)
-        return data_schema
-
-    def is_list_regex(string):
-        """ Returning true or false if regex finds a list """
-        isList_regex = re.match(r'\[|\(|\]|\)', string)
-        return (False, True)[bool(isList_regex)]
-
-    def convert_str_to_list(self, my_str):
-        """ Converting provided string to list """
-        if my_str.find('[') != -1 and my_str.find(']') != -1:
-            list_values = my_str[1:-1]
-        return list_values.replace("'", '').replace(' ', '').split(',')
-
-    def has_numbers(self, my_list: list):
-        """ Returning true of false if number contains digit or not """
-        digits = list(filter(lambda character: character.isdigit(), my_list))
-        return len(digits) > 0
-
-    def convert_str_to_dict(self, data_schema):
-        """ Converting provided string to dict """
-        try:
-            result_schema = json.loads(data_schema)
-        except ValueError:
-            logging.warning('Error: Provided data schema is not valid json')
-            sys.exit(1)
-        return result_schema
-
-    def validate_schema(self, schema: dict):
-        """ Validating if provided schema has correct keys and values """
-        logging.info('Validating keys and values')
-        for key, value in schema.items():
-            # Get both left and right value
-            left_value = value.split(':')[0]
-            try:
-                right_value = value.split(':')[1]
-            except:
-                pass
-
-            # Checking if left values are valid
-            if left_value in ['timestamp', 'int', 'str']:
-                if left_value.find('timestamp') != -1:
-                    # Value has more attributes on the right side
-                    if len(list(filter(None, value.split(":")))) > 1:  # Filter removes unnecessary '' produced by split
-                        logging.warning(
-                            'Error: Timestamp does not support any values and it will be ignored \'{}\':\'{}\''.format(
-                                key,
-                                value))
-                    # Value is valid
-                    else:
-                        logging.info(
-                            'Valid timestamp schema \'{}\':\'{}\''.format(key, left_value))
-
-                # Checking if the value is a valid string
-                if left_value.find('str') != -1:
-                    # Checking if the rand type has a correct schema
-                    if right_value.find('rand') != -1:
-                        if right_value.find('(') != -1 and right_value.find(')') != -1:
-                            logging.error('Error: Invalid rand schema \'{}\':\'{}\''.format(
-                                key, left_value + ':' + right_value))
-                            sys.exit(1)
-                        else:
-                            logging.info('Valid string schema for: \'{}\':\'{}:{}\''.format(
-                                key, left_value, right_value))
-
-                    # Checking if the list type has a correct schema
-                    if ConsoleUtility.is_list_regex(right_value):
-                        logging.info(
-                            'List schema found, transforming string schema to actual list...')
-                        # Converting str to list
-                        right_value = ConsoleUtility.convert_str_to_list(self, right_value)
-                        # Checking if the list is valid
-                        if ConsoleUtility.has_numbers(self, right_value):
-                            logging.error(
-                                'Invalid list schema str:list should not contain numbers \'{}\':\'{}:{}\''.format(
-                                    key, left_value, right_value))
-                            sys.exit(1)
-                        else:
-                            logging.info('Valid list schema \'{}\':\'{}:{}\''.format(
-                                key, left_value, right_value))
-                    elif isinstance(right_value, str) and right_value != '':
-                        logging.info('Valid stand alone value string schema \'{}\':\'{}:{}\''.format(
-                            key, left_value, right_value))
-
-                    # Checking if right value it's empty
-                    if right_value == '':
-                        logging.info('Valid empty schema, \'\' replacing with: \'{}\':\'{}:{}\''.format(
-                            key, left_value, ''))
-
-                # Checking if the value is a valid integer
-                if left_value.find('int') != -1:
-
-                    # Checking if the rand type has a correct schema
-                    if right_value.find('rand') != -1:
-                        if right_value.find('(') and right_value.find(')') != -1:
-                            logging.info('Valid integer rand(from, to) schema for \'{}\':\'{}\''.format(
-                                key, left_value + ':' + right_value))
-                        else:
-                            logging.info('Valid integer schema for: \'{}\':\'{}:{}\''.format(
-                                key, left_value, right_value))
-
-                    # Checking if the list type has a correct schema
-                    if ConsoleUtility.is_list_regex(right_value):
-                        logging.info(
-                            'List schema found, transforming integer schema to actual list')
-                        # Converting str to list
-                        right_value = ConsoleUtility.convert_str_to_list(self, right_value)
-
-                        # Checking if the list is valid
-                        if not ConsoleUtility.has_numbers(right_value):
-                            logging.error(
-                                'Error:Invalid list schema int:list should not contain strings \'{}\':\'{}:{}\''.format(
-                                    key, left_value, right_value))
-                            sys.exit(1)
-                        else:
-                            logging.info('Valid list schema \'{}\':\'{}\':\'{}\''.format(
-                                key, left_value, right_value))
-
-                    # Checking if stand alone integer is valid
-                    try:
-                        int(right_value)
-                        logging.info('Valid stand alone integer schema \'{}\':\'{}:{}\''.format(
-                            key, left_value, right_value))
-                    except:
-                        pass
-
-                    # Checking if right value it's empty
-                    if right_value == '':
-                        logging.info('Valid empty schema, None will replace it \'{}\':\'{}:{}\''.format(
-                            key, left_value, None))
-
-                return True
-            return False
-
-    def generate_jsonl_content(self, provided_schema: dict):
-        """ Generating JSON content for each data line """
-        result = {}
-        for key, value in provided_schema.items():
-            # Getting left and right value
-            try:
-                left_value = value.split(":")[0]
-                right_value = value.split(":")[1]
-            except:
-                pass
-
-            # Creating actual values
-            # Checking timestamp types
-            if left_value == 'timestamp':
-                result[key] = str(time.time())
-            # Checking string types
-            elif left_value == 'str':
-                # str:rand
-                if right_value == 'rand':
-                    result[key] = str(uuid.uuid4())
-                # str:['a', 'b', 'c']
-                elif ConsoleUtility.is_list_regex(right_value):
-                    list_values = ConsoleUtility.convert_str_to_list(self, right_value)
-                    result[key] = random.choice(list_values)
-                # str:'cat' stand alone value
-                elif isinstance(right_value, str) and right_value != '':
-                    result[key] = str(right_value.replace('\'', ''))
-                # str:'' empty value
-                elif right_value == '':
-                    result[key] = ''
-
-            # Checking int types
-            elif left_value == 'int':
-                # int:rand
-                if right_value.find('rand') != -1:
-                    if right_value.find('rand(') != -1 and right_value.find(')') != -1:
-                        regex = re.findall(r'\d+', right_value)
-                        result[key] = random.randint(int(regex[0]), int(regex[1]))
-                    else:
-                        result[key] = random.randint(0, 100)
-                # int:[1,2,3]
-                elif ConsoleUtility.is_list_regex(right_value):
-                    result[key] = random.choice(right_value)
-                # int:1 stand alone value
-                elif isinstance(right_value, int) and right_value != '':
-                    result[key] = right_value
-                # int:empty value
-                elif right_value == '':
-                    result[key] = 'None'
-        return result
-
-    def generate_jsonl(self, prefix):
-        """ Generating a single JSON file """
-        with open(self.path + '/' + self.file_name + '_' + prefix + '.jsonl', 'w') as file:
-            for j in range(1, self.data_lines + 1):
-                data = ConsoleUtility.generate_jsonl_content(self, provided_schema=self.data_schema)
-                json.dump(data, file, ensure_ascii=True)
-                if j <= self.data_lines - 1:
-                    file.write('\n')
-
-    def generate_jsonl_loop(self):
-        """ Generating multiple JSON files """
-        if self.file_prefix == 'count':
-            for i in range(1, self.file_count + 1):
-                prefix = str(i)
-                ConsoleUtility.generate_jsonl(self, prefix)
-            logging.info("Done generating files")
-
-        elif self.file_prefix == 'random':
-            for i in range(1, self.file_count + 1):
-                prefix = str(random.randint(0, 100000))
-                ConsoleUtility.generate_jsonl(self, prefix)
-            logging.info("Done generating files")
-
-        elif self.file_prefix == 'uuid':
-            for i in range(1, self.file_count + 1):
-                prefix = str(uuid.uuid4())
-                ConsoleUtility.generate_jsonl(self, prefix)
-            logging.info("Done generating files")
-
-    def multiprocess_prefix_count(self):
-        """ Multiprocess JSON file generator with count prefix """
-        counter = 1
-        ConsoleUtility.generate_jsonl(self, str(counter))
-        counter += 1
-        return 'Done generating {}'.format(self.file_count)
-
-    def multiprocess_prefix_random(self):
-        """ Multiprocess JSON file generator with random prefix """
-        prefix = str(random.randint(0, 100000))
-        ConsoleUtility.generate_jsonl(self, prefix)
-        return 'Done generating {}'.format(self.file_count)
-
-    def multiprocess_prefix_uuid(self):
-        """ Multiprocess JSON file generator with uuid prefix """
-        prefix = str(uuid.uuid4())
-        ConsoleUtility.generate_jsonl(self, prefix)
-        return 'Done generating {}'.format(self.file_count)
-
-    def multiprocess_generate_jsonl(self):
-        """ Generating JSON files using multiprocessing with provided prefix """
-        if self.file_prefix == 'count':
-            ConsoleUtility.multiprocess_prefix_count(self)
-        elif self.file_prefix == 'random':
-            pass
-            ConsoleUtility.multiprocess_prefix_random(self)
-        else:
-            ConsoleUtility.multiprocess_prefix_uuid(self)
+def load_defaults(path: str = DEFAULT_CONFIG):
+    """ Returning default argument values of the first config file with a default section, empty without one """
+    for candidate in (path, os.path.join(os.path.dirname(os.path.abspath(__file__)), DEFAULT_CONFIG)):
+        config = configparser.ConfigParser()
+        if config.read(candidate) and config.has_section('default'):
+            return dict(config['default'])
+    return {}
 
 
 """ Main method """
@@ -341,67 +51,106 @@ def main():
     parser.add_argument('--data_lines', help='Count of lines per each file', type=int)
     parser.add_argument('--clear_path', help='Clear the path before generating files', action="store_true")
     parser.add_argument('--multiprocessing', help='The number of processes used to create files', type=int)
+    parser.add_argument('--seed', help='Root seed, the same seed generates identical files for any number of '
+                                       'processes', type=int)
+    parser.add_argument('--base_time', help='Base epoch time of timestamps in seeded runs', type=float)
+    parser.add_argument('--serializer', help='Row serializer, template formats rows without building dicts',
+                        type=str, choices=serializers.SERIALIZERS)
+    parser.add_argument('--buffer_size', help='Bytes of serialized rows collected before each write', type=int)
+    parser.add_argument('--format', help='Output file format', type=str, choices=formats.FORMATS)
+    parser.add_argument('--compression', help='Compress files while they are written', type=str,
+                        choices=sinks.COMPRESSIONS)
+    parser.add_argument('--compression_level', help='Compression level, defaults to the codec default', type=int)
+    parser.add_argument('--output', help='Stream rows to stdout (-) or a FIFO/file path instead of writing files',
+                        type=str)
+    parser.add_argument('--rate', help='Rows per second limit of the stream', type=float)
+    parser.add_argument('--duration', help='Seconds to stream for, rows are unbounded until then', type=float)
+    parser.add_argument('--file_size', help='Fill every file with rows up to this uncompressed size, like 512MB or '
+                                            '1GiB, instead of data_lines rows', type=sizing.parse_size)
+    parser.add_argument('--total_size', help='Total uncompressed size of all files, split into files of --file_size '
+                                             'or evenly into --files_count files', type=sizing.parse_size)
+    parser.add_argument('--partition_by', help='Split files into Hive style field=value directories by a list, '
+                                               'weighted, bool or constant schema field', type=str)
+    parser.add_argument('--shards', help='Spread files over this many hash named subdirectories', type=int)
+    parser.add_argument('--manifest', help='Record completed files with seed, rows, bytes and sha256 in '
+                                           '<file_name>.manifest.jsonl', action='store_true')
+    parser.add_argument('--resume', help='Skip files completed in the manifest of an interrupted run',
+                        action='store_true')
+    parser.add_argument('--tables', help='JSON file of related tables, each with data_schema, data_lines and '
+                                         'file_count, ref:table.field fields take keys of other tables', type=str)
+    parser.add_argument('--pool_cache', help='Directory caching the value pools of seeded runs, like '
+                                             'str:rand(pool=100000), for repeated runs', type=str)
+    parser.add_argument('--delta', help='Manifest of a seeded run or delta, writes only the rows changed since then '
+                                        'with an op column next to it', type=str)
+    parser.add_argument('--inserts', help='Rows inserted by the delta, as a rate of the existing rows', type=float,
+                        default=0.0)
+    parser.add_argument('--updates', help='Existing rows updated by the delta, as a rate', type=float, default=0.0)
+    parser.add_argument('--deletes', help='Existing rows deleted by the delta, as a rate', type=float, default=0.0)
+    parser.add_argument('--progress_interval', help='Seconds between progress lines, 0 disables them', type=float)
+    parser.add_argument('--metrics_file', help='Path of JSON file with run metrics, refreshed with every progress '
+                                               'line', type=str)
+    parser.add_argument('--profile', help='Run under cProfile and tracemalloc and write a report to the path',
+                        nargs='?', const='profile_report.txt', type=str)
+    parser.add_argument('--engine', help='Row generation engine, numpy generates rows in vectorized blocks', type=str,
+                        choices=['python', 'numpy'])
     logging.basicConfig(level=logging.INFO)
-    parser.set_defaults(**default)
+    parser.set_defaults(**load_defaults())
     args = parser.parse_args()
     cli = ConsoleUtility(args.path_to_save_files, args.files_count, args.file_name, args.file_prefix, args.data_schema,
-                         args.data_lines, args.clear_path, args.multiprocessing)
-
-    if cli.check_args():
-        if args.clear_path == 'True':
+                         args.data_lines, args.clear_path, args.multiprocessing, args.engine, args.seed,
+                         args.base_time, args.serializer, args.buffer_size, args.compression, args.compression_level,
+                         args.format, args.output, args.rate, args.duration, args.progress_interval,
+                         args.metrics_file, args.file_size, args.total_size, args.manifest, args.resume,
+                         args.partition_by, args.shards, args.tables, args.pool_cache, args.delta, args.inserts,
+                         args.updates, args.deletes)
+
+    valid = cli.check_args()
+    if valid and cli.delta is not None:
+        try:
+            delta.run_delta(cli, cli.delta, cli.inserts, cli.updates, cli.deletes)
+        except ValueError as error:
+            logging.error('Error: {}'.format(error))
+            sys.exit(1)
+    elif valid and cli.tables is not None:
+        try:
+            table_settings = tables.load_tables(cli.tables)
+            if args.clear_path == 'True' and not args.resume:
+                tables.clear_tables(cli, table_settings)
+            tables.run_tables(cli, table_settings)
+        except ValueError as error:
+            logging.error('Error: {}'.format(error))
+            sys.exit(1)
+    elif valid:
+        if args.clear_path == 'True' and args.resume:
+            logging.warning('Clear path is ignored when resuming a run')
+        elif args.clear_path == 'True':
             cli.clear_path_and_files(path=args.path_to_save_files)
-        if cli.multiprocessing != 1:
-            logging.info('Multiprocessing enabled with {} processes'.format(cli.multiprocessing))
-            if cli.check_path_or_schema(cli.data_schema):
-                if os.path.exists(cli.data_schema):
-                    logging.info('Opening data schema from JSON file')
-                    async_results = []
-                    schema = cli.load_schema(path_to_schema=args.data_schema)
-                    cli.data_schema = schema
-                    cli.validate_schema(schema)
-                    pool = Pool(processes=cli.multiprocessing)
-                    start = time.time()
-                    for n_files in range(cli.file_count):
-                        async_results.append(pool.apply_async(cli.multiprocess_generate_jsonl()))
-                    pool.close()
-                    pool.join()
-                    logging.info('Time to generate {} files: {}'.format(cli.file_count, time.time() - start))
-                else:
-                    logging.error('Data schema does not exist')
-                    sys.exit(1)
+        if cli.check_path_or_schema(cli.data_schema):
+            if os.path.exists(cli.data_schema):
+                logging.info('Opening data schema from JSON file')
+                cli.data_schema = cli.load_schema(path_to_schema=args.data_schema)
             else:
-                logging.info('Opening data schema from provided schema')
-                async_results = []
-                schema = cli.convert_str_to_dict(cli.data_schema)
-                cli.data_schema = schema
-                cli.validate_schema(schema)
-                pool = Pool(processes=cli.multiprocessing)
-                start = time.time()
-                for n_files in range(cli.file_count):
-                    async_results.append(pool.apply_async(cli.multiprocess_generate_jsonl()))
-                pool.close()
-                pool.join()
-                logging.info('Time to generate {} files: {}'.format(cli.file_count, time.time() - start))
+                logging.error('Data schema does not exist')
+                sys.exit(1)
         else:
-            logging.info('Running with one process')
-            if cli.check_path_or_schema(cli.data_schema):
-                if os.path.exists(cli.data_schema):
-                    logging.info('Opening data schema from JSON file')
-                    schema = cli.load_schema(path_to_schema=args.data_schema)
-                    cli.validate_schema(schema=schema)
-                    start = time.time()
-                    cli.generate_jsonl_loop()
-                    logging.info("Time to generate {} files: {}".format(cli.file_count, time.time() - start))
-                else:
-                    logging.error('Data schema does not exist')
-                    sys.exit(1)
-            else:
-                logging.info('Opening data schema from provided schema')
+            logging.info('Opening data schema from provided schema')
+            try:
                 cli.data_schema = cli.convert_str_to_dict(cli.data_schema)
-                cli.validate_schema(cli.data_schema)
-                start = time.time()
-                cli.generate_jsonl_loop()
-                logging.info("Time to generate {} files: {}".format(cli.file_count, time.time() - start))
+            except ValueError as error:
+                logging.error('Error: {}'.format(error))
+                sys.exit(1)
+        if not cli.validate_schema(cli.data_schema):
+            sys.exit(1)
+        try:
+            cli.get_schema_plan()
+            if args.profile:
+                logging.info('Profiling the run, pool workers are not profiled')
+                metrics.profile_run(cli.run, args.profile)
+            else:
+                cli.run()
+        except ValueError as error:
+            logging.error('Error: {}'.format(error))
+            sys.exit(1)
     else:
         logging.error('Error: Invalid arguments')
         sys.exit(1)
@@ -9,7 +9,13 @@ config['default'] = {
     'data_schema': 'schema',
     'data_lines': '1',
     'clear_path': 'False',
-    'multiprocessing': '1'
+    'multiprocessing': '1',
+    'engine': 'python',
+    'serializer': 'json',
+    'buffer_size': '1048576',
+    'compression': 'none',
+    'format': 'jsonl',
+    'progress_interval': '10'
 }
 
 
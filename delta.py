@@ -0,0 +1,165 @@
+import logging
+import os
+import random
+import time
+
+import formats
+import manifest
+from schema_compiler import SchemaPlan, UniqueSequence, compile_field
+from seeding import derive_seed
+
+""" Delta datasets
+
+A delta run reads the manifest of a seeded run and writes one file of changed
+rows with an op column of insert, update or delete. Every row of a run has a
+position and its int:unique keys are a keyed permutation of the position, so
+updates and deletes pick distinct existing positions through another keyed
+permutation and compute their keys, without reading the previous files.
+Inserts take the positions after the last row. Deleted rows keep their keys
+and leave the other fields empty. The delta writes its own manifest, which
+records every step, so the next delta continues from it and never touches
+rows deleted before. Work is proportional to the size of the delta.
+"""
+
+# Name of the operation column
+OP_FIELD = 'op'
+
+OPERATIONS = ('insert', 'update', 'delete')
+
+# Settings of the previous run reused by the delta
+DELTA_SETTINGS = ('file_name', 'data_schema', 'data_lines', 'file_count', 'seed', 'base_time', 'engine',
+                  'output_format', 'compression', 'compression_level')
+
+
+def read_previous(path: str):
+    """ Returning settings of the run or delta recorded in a manifest, ValueError when it can not take a delta """
+    header, entries = manifest.read_manifest(path)
+    settings = header['settings']
+    if not any(entry.get('complete') for entry in entries):
+        raise ValueError('Manifest {} belongs to an unfinished run'.format(path))
+    if settings.get('seed') is None:
+        raise ValueError('Delta runs need the manifest of a seeded run')
+    if settings.get('file_size') is not None or settings.get('total_size') is not None:
+        raise ValueError('Delta runs need a run of data_lines rows per file, without size targets')
+    return settings
+
+
+def delta_counts(rows: int, inserts: float, updates: float, deletes: float):
+    """ Returning numbers of inserted, updated and deleted rows for rates of the existing rows """
+    return round(rows * inserts), round(rows * updates), round(rows * deletes)
+
+
+def changed_positions(seed, step: int, rows: int, count: int, deleted: set):
+    """ Returning up to count distinct positions below rows, not deleted before, in keyed permutation order """
+    if count <= 0 or rows <= 0:
+        return []
+    sequence = UniqueSequence('delta', 0, rows - 1)
+    sequence.seek(0, seed, step)
+    positions = []
+    for index in range(rows):
+        position = sequence.permute(index)
+        if position not in deleted:
+            positions.append(position)
+            if len(positions) == count:
+                break
+    return positions
+
+
+def deleted_positions(seed, steps: list):
+    """ Returning positions deleted by the previous steps, selected again from their records """
+    deleted = set()
+    for step in steps:
+        positions = changed_positions(seed, step['step'], step['positions'], step['updates'] + step['deletes'], deleted)
+        deleted.update(positions[step['updates']:])
+    return deleted
+
+
+def key_indexes(plan):
+    """ Returning indexes of the int:unique fields of the plan, ValueError when there is none """
+    indexes = [index for index, field in enumerate(plan) if field.kind == 'unique']
+    if not indexes:
+        raise ValueError('Delta runs need an int:unique key field in the schema')
+    if OP_FIELD in plan.keys:
+        raise ValueError('Schema field {} clashes with the operation column of delta runs'.format(OP_FIELD))
+    return indexes
+
+
+def delta_plan(plan):
+    """ Returning plan of the written rows, the schema fields followed by the operation column """
+    return SchemaPlan(list(plan) + [compile_field(OP_FIELD, 'str:{}'.format(list(OPERATIONS)))])
+
+
+def delta_rows(cli, plan, rng, updated: list, deleted: list, first: int, inserts: int):
+    """ Yielding values of the updated, deleted and inserted rows with their operation """
+    keys = key_indexes(plan)
+    for position in updated:
+        cli.seek_rows(plan, 0, position)
+        yield plan.values(rng) + ['update']
+    for position in deleted:
+        cli.seek_rows(plan, 0, position)
+        values = plan.values(rng)
+        row = [None] * len(values)
+        for index in keys:
+            row[index] = values[index]
+        yield row + ['delete']
+    # Inserted positions follow each other, so unique fields are moved once and advance with every row
+    cli.seek_rows(plan, 0, first)
+    for _ in range(inserts):
+        yield plan.values(rng) + ['insert']
+
+
+def write_rows(path: str, plan, rows, output_format: str, compression: str, level: int = None):
+    """ Writing rows in batches to a file of the format, returning the number of rows """
+    writer = formats.open_writer(output_format, path, plan, compression, level)
+    written = 0
+    batch = []
+    try:
+        for row in rows:
+            batch.append(row)
+            if len(batch) == formats.ROW_GROUP_ROWS:
+                writer.write_columns(list(zip(*batch)))
+                written += len(batch)
+                batch = []
+        if batch:
+            writer.write_columns(list(zip(*batch)))
+            written += len(batch)
+    finally:
+        writer.close()
+    return written
+
+
+def run_delta(cli, path: str, inserts: float = 0.0, updates: float = 0.0, deletes: float = 0.0):
+    """ Writing the next delta of the run recorded in the manifest next to it, returning the delta record """
+    start = time.time()
+    settings = read_previous(path)
+    for name in DELTA_SETTINGS:
+        setattr(cli, name, settings[name])
+    cli.path = os.path.dirname(os.path.abspath(path))
+    cli.partition_by = None
+    cli.shards = None
+    cli.table = None
+    steps = settings.get('deltas', [])
+    seed = cli.seed
+    plan = cli.get_schema_plan()
+    key_indexes(plan)
+    rows = cli.data_lines * cli.file_count + sum(previous['inserts'] for previous in steps)
+    live_rows = rows - sum(previous['deletes'] for previous in steps)
+    step = len(steps) + 1
+    insert_count, update_count, delete_count = delta_counts(live_rows, inserts, updates, deletes)
+    positions = changed_positions(seed, step, rows, update_count + delete_count, deleted_positions(seed, steps))
+    record = {'step': step, 'positions': rows, 'inserts': insert_count, 'updates': min(update_count, len(positions)),
+              'deletes': max(len(positions) - update_count, 0)}
+    rng = random.Random(derive_seed(seed, 'delta', step))
+    prefix = 'delta{}'.format(step)
+    delta_settings = dict(settings, deltas=steps + [record])
+    run_manifest = manifest.Manifest(manifest.manifest_path(cli.path, '{}_{}'.format(cli.file_name, prefix)),
+                                     delta_settings, [prefix])
+    rows_iter = delta_rows(cli, plan, rng, positions[:update_count], positions[update_count:], rows, insert_count)
+    with manifest.atomic_path(cli.file_path(prefix)) as temporary:
+        written = write_rows(temporary, delta_plan(plan), rows_iter, cli.output_format, cli.compression,
+                             cli.compression_level)
+    run_manifest.add(manifest.file_entry(cli.file_path(prefix), cli.path, 0, prefix, seed, written, **record))
+    run_manifest.finish({'seconds': time.time() - start})
+    logging.info('Delta {} with {} inserts, {} updates and {} deletes of {} rows written in {:.3f} seconds'.format(
+        step, record['inserts'], record['updates'], record['deletes'], rows, time.time() - start))
+    return record
@@ -0,0 +1,200 @@
+import datetime
+import json
+import mmap
+import os
+
+""" Fixed width records
+
+Schemas of bounded fields (integers of a range, unique and foreign keys, list,
+weighted and constant choices, uuids, bools, floats, timestamps, dates and
+datetimes) have a largest byte width per field, so every row is a record of
+the same width: each value left aligned and padded with spaces to the width of
+its field, nulls blank, the record ended by a newline. Row n of a file starts
+at byte n * record width, so a file is preallocated at its final size and rows
+are copied from encoded batches straight into a memory map of their byte
+range. Processes writing ranges of the same file write in place at computed
+offsets, nothing is merged afterwards. A small JSON index next to each file
+records the field layout and the byte offsets of evenly spaced rows, readers
+seek to any row or split the file for parallel reads without scanning it.
+"""
+
+# Widest repr of a float64 like -2.2250738585072014e-308, timestamps are formatted floats too
+FLOAT_WIDTH = 24
+
+# Widest int64 with its sign, integers of unbounded distributions
+INT_WIDTH = 20
+
+UUID_WIDTH = 36
+
+INDEX_SUFFIX = '.idx'
+
+# Rows between the offsets recorded in the index
+INDEX_ROWS = 65536
+
+
+def _text(value):
+    """ Returning UTF-8 bytes of a value, nulls empty """
+    return b'' if value is None else str(value).encode('utf-8')
+
+
+def _bool_text(value):
+    """ Returning bytes of a bool as written in JSON, nulls empty """
+    return b'' if value is None else (b'true' if value else b'false')
+
+
+def _float_text(value):
+    """ Returning bytes of the float repr, nulls empty, NumPy floats included """
+    return b'' if value is None else repr(float(value)).encode('ascii')
+
+
+def field_encoder(field):
+    """ Returning the function converting values of a plan field to bytes """
+    if field.type == 'bool':
+        return _bool_text
+    if field.type == 'float':
+        return _float_text
+    return _text
+
+
+def datetime_width(offset: int, span: int, date_format: str):
+    """ Returning widest formatted datetime of the range, over its ends and every month, weekday and half day """
+    start = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=offset)
+    end = start + datetime.timedelta(seconds=span)
+    samples = [start, end] + [datetime.datetime(start.year, month, day, hour) for month in range(1, 13)
+                              for day in (1, 2, 3, 4, 5, 6, 7, 28) for hour in (0, 23)]
+    return max(len(sample.strftime(date_format).encode('utf-8')) for sample in samples)
+
+
+def field_width(field):
+    """ Returning largest byte width of a plan field, ValueError when its values are not bounded """
+    encode = field_encoder(field)
+    if field.kind in ('const', 'choice', 'weighted'):
+        values = field.args if field.kind == 'const' else field.args[0]
+        return max(len(encode(value)) for value in values)
+    if field.kind in ('randint', 'unique'):
+        return max(len(encode(field.args[0])), len(encode(field.args[1])))
+    if field.kind == 'ref' and field.args[-1].parent is not None:
+        # Keys of parent rows are values of the unique sequence of the parent
+        parent = field.args[-1].parent
+        return max(len(encode(parent.low)), len(encode(parent.high)))
+    if field.kind == 'zipf':
+        return len(encode(field.args[1]))
+    if field.kind == 'normal' and field.type == 'int':
+        return INT_WIDTH
+    if field.kind in ('uniform', 'normal', 'timestamp'):
+        return FLOAT_WIDTH
+    if field.kind == 'bool':
+        return len(b'false')
+    if field.kind == 'uuid':
+        return UUID_WIDTH
+    if field.kind == 'datetime':
+        return datetime_width(*field.args)
+    raise ValueError('Fixed width output needs fields of bounded width, {} is a {} {} field'.format(
+        field.key, field.type, field.kind))
+
+
+class RecordLayout:
+    """ Byte widths and offsets of the fields of fixed width records """
+
+    def __init__(self, plan):
+        self.keys = plan.keys
+        self.widths = tuple(field_width(field) for field in plan)
+        self.encoders = tuple(field_encoder(field) for field in plan)
+        self.offsets = tuple(sum(self.widths[:index]) for index in range(len(self.widths)))
+        # Fields and the newline ending the record
+        self.width = sum(self.widths) + 1
+        self.template = b''.join(b'%-' + str(width).encode('ascii') + b's' for width in self.widths) + b'\n'
+
+    def encode(self, columns: list):
+        """ Returning bytes of the records of a column batch, ValueError when a value is wider than its field """
+        encoded = []
+        for key, width, encode, column in zip(self.keys, self.widths, self.encoders, columns):
+            values = list(map(encode, column))
+            if values and max(map(len, values)) > width:
+                raise ValueError('Value of {} is wider than its {} bytes of fixed width records'.format(key, width))
+            encoded.append(values)
+        if not encoded:
+            return b''
+        template = self.template
+        return b''.join([template % values for values in zip(*encoded)])
+
+    def index(self, rows: int):
+        """ Returning index of a file of rows records with the offsets of every INDEX_ROWS row """
+        return {'record_width': self.width, 'rows': rows,
+                'fields': [{'key': key, 'offset': offset, 'width': width}
+                           for key, offset, width in zip(self.keys, self.offsets, self.widths)],
+                'offsets': [[row, row * self.width] for row in range(0, rows, INDEX_ROWS)]}
+
+
+def record_layout(plan):
+    """ Returning RecordLayout of the plan, ValueError when a field has no bounded width """
+    return RecordLayout(plan)
+
+
+def index_path(path: str):
+    """ Returning path of the row offset index of a fixed width file """
+    return path + INDEX_SUFFIX
+
+
+def write_index(path: str, layout, rows: int):
+    """ Writing the row offset index next to a fixed width file """
+    with open(index_path(path), 'w') as file:
+        json.dump(layout.index(rows), file)
+
+
+def preallocate(path: str, size: int):
+    """ Creating an empty file of size bytes, with its blocks reserved where the file system supports it """
+    with open(path, 'wb') as file:
+        file.truncate(size)
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(file.fileno(), 0, size)
+            except OSError:
+                # Sparse file, blocks are allocated when the rows are written
+                pass
+
+
+class MappedFile:
+    """ Writable memory map of a byte range of a preallocated file """
+
+    def __init__(self, path: str, offset: int, size: int):
+        self.file = open(path, 'r+b')
+        # Maps start on allocation granularity, the range starts shift bytes into the map
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        self.position = offset - start
+        self.end = self.position + size
+        self.map = mmap.mmap(self.file.fileno(), self.end, offset=start) if size else None
+
+    def write(self, block: bytes):
+        """ Copying a block to the next bytes of the range, ValueError past its end """
+        end = self.position + len(block)
+        if end > self.end:
+            raise ValueError('Block of {} bytes passes the end of the mapped range'.format(len(block)))
+        if block:
+            self.map[self.position:end] = block
+        self.position = end
+
+    def close(self):
+        """ Flushing written pages and closing the map and the file """
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+        self.file.close()
+
+
+class FixedWidthWriter:
+    """ Writing column batches as fixed width records to a file, for writers of unknown row counts """
+
+    def __init__(self, path: str, plan, compression: str = 'none', level: int = None, header: bool = True):
+        if compression != 'none':
+            raise ValueError('Fixed width files can not be compressed')
+        self.layout = record_layout(plan)
+        self.file = open(path, 'wb')
+
+    def write_columns(self, columns: list):
+        """ Writing a batch of rows """
+        self.file.write(self.layout.encode(columns))
+
+    def close(self):
+        """ Closing the file """
+        self.file.close()
@@ -0,0 +1,195 @@
+import csv
+import io
+import json
+
+import fixed_width
+import serializers
+import sinks
+from schema_compiler import NESTED_KINDS
+
+""" Output formats
+
+Besides JSON Lines, rows can be written as CSV, Parquet or Arrow IPC files.
+Writers receive column batches (one list of values per plan field) of at most
+ROW_GROUP_ROWS rows, each batch becomes a Parquet row group or an Arrow record
+batch, so memory stays bounded for any file size. JSON Lines files are normally
+written from serialized line blocks, the JSON Lines writer serves partitioned
+output. Columns are typed from the schema: int -> int64, timestamp and float ->
+float64, bool -> bool, str and date choices -> dictionary encoded string, other
+str and datetime -> string, nested objects -> struct and arrays -> list of
+their item type. CSV cells of nested objects and arrays hold their JSON text.
+Fixed width files of bounded fields are written by fixed_width.
+"""
+
+FORMATS = ['jsonl', 'csv', 'parquet', 'arrow', 'fixed']
+
+EXTENSIONS = {'jsonl': '.jsonl', 'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow', 'fixed': '.dat'}
+
+# Text formats are compressed as a stream and can be split into concatenated parts
+TEXT_FORMATS = ['jsonl', 'csv']
+
+# Compressions applied inside columnar files by pyarrow
+COLUMNAR_COMPRESSIONS = {'parquet': ['none', 'gzip', 'zstd'], 'arrow': ['none', 'zstd']}
+
+ROW_GROUP_ROWS = 65536
+
+
+def file_extension(output_format: str, compression: str = 'none'):
+    """ Returning file extension of the format, with compression extension for text formats """
+    if output_format in TEXT_FORMATS:
+        return EXTENSIONS[output_format] + sinks.compression_extension(compression)
+    return EXTENSIONS[output_format]
+
+
+def arrow_type(field, nested: bool = False):
+    """ Returning Arrow type of a plan field, values inside objects and arrays are not converted or encoded """
+    import pyarrow as pa
+    if field.kind == 'object':
+        return pa.struct([pa.field(item.key, arrow_type(item, True)) for item in field.args[0]])
+    if field.kind == 'array':
+        return pa.list_(arrow_type(field.args[0], True))
+    if field.type == 'timestamp' or (nested and field.kind == 'const' and field.args[0] == 'None'):
+        return pa.string() if nested else pa.float64()
+    if field.type == 'int':
+        return pa.int64()
+    if field.type == 'float':
+        return pa.float64()
+    if field.type == 'bool':
+        return pa.bool_()
+    if field.kind in ('choice', 'weighted') and not nested:
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+def arrow_column(field, values):
+    """ Converting a list of generated values to an Arrow array of the field type """
+    import pyarrow as pa
+    if field.kind in NESTED_KINDS:
+        return pa.array(values, arrow_type(field))
+    if field.type == 'timestamp':
+        return pa.array(values, pa.string()).cast(pa.float64())
+    if field.type == 'int':
+        if field.kind == 'const' and field.args[0] == 'None':
+            return pa.nulls(len(values), pa.int64())
+        return pa.array(values, pa.int64())
+    if field.type in ('float', 'bool'):
+        return pa.array(values, arrow_type(field))
+    if field.kind in ('choice', 'weighted'):
+        # Same dictionary for every batch, as required by the Arrow IPC file format, null values have no index
+        indexes = {value: index for index, value in enumerate(field.args[0])}
+        return pa.DictionaryArray.from_arrays(pa.array([indexes.get(value) for value in values], pa.int32()),
+                                              pa.array(field.args[0], pa.string()))
+    return pa.array(values, pa.string())
+
+
+def arrow_schema(plan):
+    """ Returning Arrow schema of the plan """
+    import pyarrow as pa
+    return pa.schema([pa.field(field.key, arrow_type(field)) for field in plan])
+
+
+def text_columns(plan, columns: list):
+    """ Returning columns with nested object and array values replaced by their JSON text """
+    return [[json.dumps(value, ensure_ascii=True) for value in column] if field.kind in NESTED_KINDS else column
+            for field, column in zip(plan, columns)]
+
+
+def csv_block(columns: list):
+    """ Returning CSV text of a column batch, every row newline terminated """
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(zip(*columns))
+    return buffer.getvalue()
+
+
+class JsonlWriter:
+    """ Writing column batches as JSON lines, without trailing newline """
+
+    def __init__(self, path: str, plan, compression: str = 'none', level: int = None, header: bool = True,
+                 serializer: str = 'json', buffer_size: int = serializers.DEFAULT_BUFFER_SIZE):
+        self.keys = plan.keys
+        self.dumps = serializers.get_serializer(serializer)
+        self.file = sinks.open_output(path, compression, level)
+        self.writer = serializers.BufferedLineWriter(self.file, buffer_size)
+
+    def write_columns(self, columns: list):
+        """ Writing a batch of rows """
+        keys, dumps = self.keys, self.dumps
+        self.writer.write_block('\n'.join([dumps(dict(zip(keys, row))) for row in zip(*columns)]))
+
+    def close(self):
+        """ Flushing buffered lines and closing the file """
+        self.writer.flush()
+        self.file.close()
+
+
+class CsvWriter:
+    """ Writing column batches as CSV rows, header only at the start of the file """
+
+    def __init__(self, path: str, plan, compression: str = 'none', level: int = None, header: bool = True):
+        self.plan = plan
+        self.file = sinks.open_output(path, compression, level)
+        self.writer = csv.writer(self.file, lineterminator='\n')
+        if header:
+            self.writer.writerow(plan.keys)
+
+    def write_columns(self, columns: list):
+        """ Writing a batch of rows """
+        self.writer.writerows(zip(*text_columns(self.plan, columns)))
+
+    def close(self):
+        """ Closing the file """
+        self.file.close()
+
+
+class ParquetWriter:
+    """ Writing every column batch as a Parquet row group """
+
+    def __init__(self, path: str, plan, compression: str = 'none', level: int = None, header: bool = True):
+        import pyarrow.parquet as pq
+        self.plan = plan
+        self.schema = arrow_schema(plan)
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression.upper(),
+                                       compression_level=level if compression != 'none' else None)
+
+    def write_columns(self, columns: list):
+        """ Writing a batch of rows as a row group """
+        import pyarrow as pa
+        arrays = [arrow_column(field, values) for field, values in zip(self.plan, columns)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        """ Writing the footer and closing the file """
+        self.writer.close()
+
+
+class ArrowWriter:
+    """ Writing every column batch as an Arrow IPC record batch """
+
+    def __init__(self, path: str, plan, compression: str = 'none', level: int = None, header: bool = True):
+        import pyarrow as pa
+        self.plan = plan
+        self.schema = arrow_schema(plan)
+        self.sink = pa.OSFile(path, 'wb')
+        codec = None if compression == 'none' else pa.Codec(compression, compression_level=level)
+        self.writer = pa.ipc.new_file(self.sink, self.schema, options=pa.ipc.IpcWriteOptions(compression=codec))
+
+    def write_columns(self, columns: list):
+        """ Writing a batch of rows as a record batch """
+        import pyarrow as pa
+        arrays = [arrow_column(field, values) for field, values in zip(self.plan, columns)]
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        """ Writing the footer and closing the file """
+        self.writer.close()
+        self.sink.close()
+
+
+WRITERS = {'jsonl': JsonlWriter, 'csv': CsvWriter, 'parquet': ParquetWriter, 'arrow': ArrowWriter,
+           'fixed': fixed_width.FixedWidthWriter}
+
+
+def open_writer(output_format: str, path: str, plan, compression: str = 'none', level: int = None,
+                header: bool = True, **options):
+    """ Opening column batch writer of the format, options are passed to the writer """
+    return WRITERS[output_format](path, plan, compression or 'none', level, header, **options)
@@ -0,0 +1,817 @@
+import functools
+import json
+import logging
+import os
+import random
+import time
+import uuid
+
+import scheduler
+import fixed_width
+import formats
+import layout
+import manifest
+import metrics
+import seeding
+import serializers
+import sinks
+import sizing
+import pools
+from schema_compiler import ForeignKey, SchemaPlan, UniqueSequence, compile_schema
+from schema_parser import SchemaError, describe_problem, ignored_specs, parse_schema, point_problem
+
+""" Generation library
+
+ConsoleUtility holds the settings of a run and generates its files or stream,
+generate() writes the rows of a schema to a path, a file object or a list for
+callers importing the generator as a library. Nothing is read at import time
+and optional dependencies (NumPy, PyArrow, zstandard, orjson, ujson) are only
+imported by the modes using them, so imports by small jobs and by spawned
+pool workers stay cheap. cli.py parses the command line and default.ini.
+"""
+
+# Distinct prefixes of --file_prefix=random, the integers from 0 to 100000
+RANDOM_PREFIXES = 100001
+
+
+class ConsoleUtility:
+    def __init__(self, path: str, file_count: int, file_name: str, file_prefix: str, data_schema: str, data_lines: int,
+                 clear_path: bool, multiprocessing: int, engine: str = 'python', seed: int = None,
+                 base_time: float = None, serializer: str = 'json', buffer_size: int = serializers.DEFAULT_BUFFER_SIZE,
+                 compression: str = 'none', compression_level: int = None, output_format: str = 'jsonl',
+                 output: str = None, rate: float = None, duration: float = None,
+                 progress_interval: float = metrics.PROGRESS_INTERVAL, metrics_file: str = None,
+                 file_size: int = None, total_size: int = None, write_manifest: bool = False, resume: bool = False,
+                 partition_by: str = None, shards: int = None, tables: str = None, pool_cache: str = None,
+                 delta: str = None, inserts: float = 0.0, updates: float = 0.0, deletes: float = 0.0):
+        self.path = path
+        self.file_count = file_count
+        self.file_name = file_name
+        self.file_prefix = file_prefix
+        self.data_schema = data_schema
+        self.data_lines = data_lines
+        self.clear_path = clear_path
+        self.multiprocessing = multiprocessing
+        self.engine = engine
+        self.seed = seed
+        self.base_time = base_time
+        self.chunk_rows = seeding.CHUNK_ROWS
+        self.serializer = serializer
+        self.buffer_size = buffer_size
+        self.compression = compression
+        self.compression_level = compression_level
+        self.output_format = output_format
+        self.output = output
+        self.rate = rate
+        self.duration = duration
+        self.progress_interval = progress_interval
+        self.metrics_file = metrics_file
+        self.file_size = file_size
+        self.total_size = total_size
+        self.segment_bytes = sizing.SEGMENT_BYTES
+        self.segment_positions = None
+        self.write_manifest = write_manifest or resume
+        self.resume = resume
+        self.manifest = None
+        self.partition_by = partition_by
+        self.shards = shards
+        self.tables = tables
+        self.pool_cache = pool_cache
+        self.delta = delta
+        self.inserts = inserts
+        self.updates = updates
+        self.deletes = deletes
+        # Name of the table generated by a multi table run, unique fields are then unique across its files
+        self.table = None
+        self.metrics = metrics.Metrics(interval=progress_interval)
+        self.schema_plan = None
+        self.schema_plan_source = None
+        self.schema_nodes = None
+
+    def check_args(self):
+        """ Checking if provided arguments are correct """
+        file_prefixes = ['count', 'random', 'uuid']
+        path_booleans = ['True', 'False']
+        engines = ['python', 'numpy']
+
+        if self.path == '.':
+            self.path = os.getcwd()
+        if not os.path.exists(self.path):
+            logging.error('Error: Directory does not exist.')
+            return False
+        if self.file_prefix not in file_prefixes:
+            logging.error('Error: File prefix must be either "count", "random" or "uuid"')
+            return False
+        if self.clear_path not in path_booleans:
+            logging.error('Error: Clear path only takes True or False values')
+            return False
+        if self.file_count < 0:
+            logging.error('Error: Files count must be greater than 0')
+            return False
+        if self.engine not in engines:
+            logging.error('Error: Engine must be either "python" or "numpy"')
+            return False
+        if self.engine == 'numpy':
+            try:
+                import numpy
+            except ImportError:
+                logging.error('Error: NumPy engine requires numpy to be installed')
+                return False
+        if self.serializer not in serializers.SERIALIZERS:
+            logging.error('Error: Serializer must be one of {}'.format(', '.join(serializers.SERIALIZERS)))
+            return False
+        if self.serializer in ['orjson', 'ujson']:
+            try:
+                __import__(self.serializer)
+            except ImportError:
+                logging.error('Error: {} serializer requires {} to be installed'.format(self.serializer,
+                                                                                       self.serializer))
+                return False
+        if self.buffer_size <= 0:
+            logging.error('Error: Buffer size must be greater than 0')
+            return False
+        if self.output_format not in formats.FORMATS:
+            logging.error('Error: Format must be one of {}'.format(', '.join(formats.FORMATS)))
+            return False
+        if self.output_format in ['parquet', 'arrow']:
+            try:
+                import pyarrow
+            except ImportError:
+                logging.error('Error: {} format requires pyarrow to be installed'.format(self.output_format))
+                return False
+            if self.compression not in formats.COLUMNAR_COMPRESSIONS[self.output_format]:
+                logging.error('Error: {} format supports only {} compression'.format(
+                    self.output_format, ', '.join(formats.COLUMNAR_COMPRESSIONS[self.output_format])))
+                return False
+        if self.output_format == 'fixed' and self.compression != 'none':
+            logging.error('Error: Fixed width files are written through a memory map and can not be compressed')
+            return False
+        if self.output is not None and self.output_format not in formats.TEXT_FORMATS:
+            logging.error('Error: Streaming output supports only jsonl and csv formats')
+            return False
+        if self.file_size is not None or self.total_size is not None:
+            if (self.file_size is not None and self.file_size <= 0) or (self.total_size is not None
+                                                                        and self.total_size <= 0):
+                logging.error('Error: File size and total size must be greater than 0')
+                return False
+            if self.output_format not in formats.TEXT_FORMATS:
+                logging.error('Error: File size targets support only jsonl and csv formats')
+                return False
+            if self.output is not None:
+                logging.error('Error: File size targets can not be used with streaming output')
+                return False
+            logging.info('Files are filled up to the size target, data_lines is ignored')
+        if self.shards is not None and self.shards <= 0:
+            logging.error('Error: Shards must be greater than 0')
+            return False
+        if self.file_prefix == 'random' and self.output is None:
+            sizes = self.file_sizes()
+            if (self.file_count if sizes is None else len(sizes)) > RANDOM_PREFIXES:
+                logging.error('Error: Random prefixes are distinct numbers up to {}, use uuid prefixes for more '
+                              'files'.format(RANDOM_PREFIXES - 1))
+                return False
+        if self.partition_by is not None and (self.file_size is not None or self.total_size is not None):
+            logging.error('Error: Partitioned output can not be combined with file size targets')
+            return False
+        if (self.partition_by is not None or self.shards is not None) and self.output is not None:
+            logging.error('Error: Partitions and shards apply to files, not to streamed output')
+            return False
+        if self.write_manifest and self.output is not None:
+            logging.error('Error: Manifest and resume apply to files, not to streamed output')
+            return False
+        if self.tables is not None:
+            if not os.path.exists(self.tables):
+                logging.error('Error: Tables file does not exist')
+                return False
+            if self.output is not None or self.file_size is not None or self.total_size is not None \
+                    or self.partition_by is not None:
+                logging.error('Error: Tables are written as files of data_lines rows, without streaming, size targets '
+                              'or partitions')
+                return False
+        if self.delta is not None:
+            if not os.path.exists(self.delta):
+                logging.error('Error: Manifest of the previous run does not exist')
+                return False
+            if self.output is not None or self.tables is not None:
+                logging.error('Error: Delta runs write a file next to the previous run, without streaming or tables')
+                return False
+            if any(rate < 0 or rate > 1 for rate in (self.inserts, self.updates, self.deletes)) \
+                    or self.updates + self.deletes > 1:
+                logging.error('Error: Insert, update and delete rates must be between 0 and 1, updates and deletes '
+                              'together at most 1')
+                return False
+        if self.progress_interval < 0:
+            logging.error('Error: Progress interval must not be negative')
+            return False
+        if self.rate is not None and self.rate <= 0:
+            logging.error('Error: Rate must be greater than 0')
+            return False
+        if self.duration is not None and self.duration <= 0:
+            logging.error('Error: Duration must be greater than 0')
+            return False
+        if self.compression not in sinks.COMPRESSIONS:
+            logging.error('Error: Compression must be one of {}'.format(', '.join(sinks.COMPRESSIONS)))
+            return False
+        if self.compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                logging.error('Error: zstd compression requires zstandard to be installed')
+                return False
+        if self.compression_level is not None and self.compression != 'none':
+            low, high = sinks.LEVEL_RANGES[self.compression]
+            if not low <= self.compression_level <= high:
+                logging.error('Error: {} compression level must be between {} and {}'.format(self.compression, low,
+                                                                                             high))
+                return False
+        if self.multiprocessing <= 0:
+            logging.error('Error: Multiprocessing must be greater than 0')
+            return False
+        if self.multiprocessing > os.cpu_count():
+            self.multiprocessing = os.cpu_count()
+            logging.info("Number of input processing units larger than amount of cpu processors, setting input to "
+                         "cpu_count")
+        return True
+
+    def clear_path_and_files(self, path: str):
+        """ Clearing directory path files, the ones listed in the manifest when the path has one """
+        manifest_file = manifest.manifest_path(path, self.file_name)
+        if os.path.exists(manifest_file):
+            removed = layout.clear_manifest_files(manifest_file)
+            logging.info('Removed {} files listed in the manifest'.format(removed))
+        else:
+            removed = layout.clear_files(path, self.file_name, self.shards, self.partition_by)
+        logging.info('Removed files that match filename')
+        return removed
+
+    def check_path_or_schema(self, path_to_schema):
+        """ Checking if the provided schema is a string schema or JSON file """
+        try:
+            with open(path_to_schema, 'r') as file:
+                path_to_schema = json.load(file)
+            logging.info('Provided with JSON file schema')
+        except:
+            logging.info('Provided with command line schema')
+            return False
+        return True
+
+    def load_schema(self, path_to_schema: str):
+        """ Loading string with dict schema and returning dict object """
+        with open(path_to_schema, 'r') as file:
+            data_schema = json.load(file)
+        return data_schema
+
+    def convert_str_to_dict(self, data_schema):
+        """ Converting provided string to dict, ValueError when it is not valid JSON """
+        try:
+            result_schema = json.loads(data_schema)
+        except ValueError:
+            raise ValueError('Provided data schema is not valid json')
+        return result_schema
+
+    def validate_schema(self, schema: dict):
+        """ Validating every key and value of the schema in one pass, logging all problems with their columns """
+        logging.info('Validating keys and values')
+        try:
+            nodes = parse_schema(schema)
+        except SchemaError as error:
+            for problem in error.problems:
+                # The value and its caret start on their own lines, so the caret stays under the column
+                pointer = point_problem(problem)
+                logging.error('Error: Invalid schema {}{}'.format(describe_problem(problem),
+                                                                  '\n' + pointer if pointer else ''))
+            return False
+        for node in nodes:
+            logging.info('Valid {} schema \'{}\':\'{}\''.format(node.type, node.key, schema[node.key]))
+        for path, value in ignored_specs(nodes):
+            logging.warning('Error: Timestamp does not support any values and it will be ignored \'{}\':\'{}\''.format(
+                path, value))
+        # The plan is compiled from these nodes, without parsing the schema again
+        self.schema_nodes = (schema, nodes)
+        return True
+
+    def get_schema_plan(self):
+        """ Returning compiled schema plan, compiling data schema only when it changed """
+        if self.schema_plan is None or self.schema_plan_source is not self.data_schema:
+            pools.set_cache_dir(self.pool_cache)
+            nodes = self.data_schema
+            if self.schema_nodes is not None and self.schema_nodes[0] is self.data_schema:
+                nodes = self.schema_nodes[1]
+            plan = compile_schema(nodes, seeded=self.seed is not None, base_time=self.base_time, seed=self.seed)
+            unbound = [counter.key for counter in plan.counters
+                       if isinstance(counter, ForeignKey) and counter.parent is None]
+            if unbound:
+                raise ValueError('ref fields {} refer to other tables, generate them with --tables'.format(
+                    ', '.join(unbound)))
+            self.schema_plan = plan
+            self.schema_plan_source = self.data_schema
+        return self.schema_plan
+
+    def generate_jsonl_content(self, provided_schema: dict):
+        """ Generating JSON content for each data line """
+        if provided_schema is self.data_schema:
+            plan = self.get_schema_plan()
+        else:
+            plan = compile_schema(provided_schema)
+        return plan.row(random)
+
+    def file_path(self, prefix: str, partition: str = None):
+        """ Returning path of the output file with provided prefix, in its partition and shard directory """
+        name = self.file_name + '_' + prefix + formats.file_extension(self.output_format, self.compression)
+        if partition is None and self.shards is None:
+            return self.path + '/' + name
+        directory = self.path
+        if partition is not None:
+            directory += '/' + partition
+        if self.shards is not None:
+            directory += '/' + layout.shard_dir(name, self.shards)
+        # Layout directories are created when their first file path is requested
+        layout.make_dirs(directory)
+        return directory + '/' + name
+
+    def open_file(self, path: str):
+        """ Opening output file with configured compression """
+        return sinks.open_output(path, self.compression, self.compression_level)
+
+    def file_sizes(self):
+        """ Returning byte target of every file, None when files have data_lines rows """
+        if self.file_size is None and self.total_size is None:
+            return None
+        return sizing.file_sizes(self.file_count, self.file_size, self.total_size)
+
+    def file_prefixes(self):
+        """ Returning distinct prefixes for all files """
+        if self.manifest is not None and self.manifest.prefixes is not None:
+            # Resumed runs keep the prefixes of the manifest
+            return list(self.manifest.prefixes)
+        sizes = self.file_sizes()
+        file_count = self.file_count if sizes is None else len(sizes)
+        if self.file_prefix == 'count':
+            return [str(i) for i in range(1, file_count + 1)]
+        rng = random if self.seed is None else random.Random(seeding.derive_seed(self.seed, 'prefix'))
+        if self.file_prefix == 'random' and file_count > RANDOM_PREFIXES:
+            raise ValueError('Random prefixes are distinct numbers up to {}, {} files need uuid prefixes'.format(
+                RANDOM_PREFIXES - 1, file_count))
+        prefixes = []
+        seen = set()
+        while len(prefixes) < file_count:
+            if self.file_prefix == 'random':
+                prefix = str(rng.randint(0, RANDOM_PREFIXES - 1))
+            elif self.seed is None:
+                prefix = str(uuid.uuid4())
+            else:
+                prefix = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            if prefix not in seen:
+                seen.add(prefix)
+                prefixes.append(prefix)
+        return prefixes
+
+    @staticmethod
+    def positioned(segments, start: int = 0):
+        """ Yielding (row position, (seed, rows)) of consecutive segments starting at row start """
+        position = start
+        for segment in segments:
+            yield position, segment
+            position += segment[1]
+
+    def sized_positions(self):
+        """ Returning first row position of every size targeted file and the smallest row size in bytes
+
+        ValueError when a unique field has fewer values than the rows the size targets can hold.
+        """
+        if self.segment_positions is None:
+            plan = self.get_schema_plan()
+            row_size = sizing.min_row_size(plan, self.output_format)
+            starts, rows = sizing.file_positions(self.file_sizes(), self.segment_bytes, row_size)
+            for counter in plan.counters:
+                if isinstance(counter, UniqueSequence) and counter.size < rows:
+                    raise ValueError('Unique field {} has {} values, size targets can hold up to {} rows of at least '
+                                     '{} bytes'.format(counter.key, counter.size, rows, row_size))
+            self.segment_positions = (starts, row_size)
+        return self.segment_positions
+
+    def seek_rows(self, plan, file_index, position: int):
+        """ Moving unique fields of the plan to the row position of the file in the run """
+        if not plan.counters:
+            return
+        if isinstance(file_index, tuple):
+            # Segments hold a bounded number of rows, each gets that many positions after the segments before it
+            file_index, segment = file_index
+            starts, row_size = ConsoleUtility.sized_positions(self)
+            position += starts[file_index] + segment * sizing.segment_rows(self.segment_bytes, row_size)
+            file_index = self.table
+        else:
+            # Positions continue across files, so keys are unique in the run or table and computable from the row
+            position += file_index * self.data_lines
+            file_index = self.table
+        plan.seek(position, self.seed, file_index)
+
+    def line_blocks(self, rows, file_index: int = 0, start: int = 0, batch_rows: int = None):
+        """ Yielding blocks of serialized JSON lines joined without trailing newline, unbounded when rows is None """
+        plan = self.get_schema_plan()
+        metrics = self.metrics
+        segments = seeding.chunk_segments(self.seed, file_index, start, rows, self.chunk_rows)
+        if self.engine == 'numpy':
+            import numpy
+            from numpy_engine import BLOCK_ROWS, BlockGenerator
+            batch_rows = batch_rows or BLOCK_ROWS
+            generator = BlockGenerator(plan)
+            for position, (seed, count) in ConsoleUtility.positioned(segments, start):
+                ConsoleUtility.seek_rows(self, plan, file_index, position)
+                if seed is not None:
+                    generator.rng = numpy.random.default_rng(seed)
+                for batch in range(0, count, batch_rows):
+                    size = min(batch_rows, count - batch)
+                    with metrics.timer('generate'):
+                        columns = generator.generate_columns(size)
+                    with metrics.timer('serialize'):
+                        block = generator.serialize_block(columns, size)
+                    metrics.add(rows=size)
+                    yield block
+            return
+        batch_rows = batch_rows or serializers.BATCH_ROWS
+        row_values, format_values = serializers.row_serializer(plan, self.serializer)
+        for position, (seed, count) in ConsoleUtility.positioned(segments, start):
+            ConsoleUtility.seek_rows(self, plan, file_index, position)
+            rng = random if seed is None else random.Random(seed)
+            for batch in range(0, count, batch_rows):
+                size = min(batch_rows, count - batch)
+                with metrics.timer('generate'):
+                    values = [row_values(rng) for _ in range(size)]
+                with metrics.timer('serialize'):
+                    block = '\n'.join(map(format_values, values))
+                metrics.add(rows=size)
+                yield block
+
+    def write_jsonl_rows(self, file, rows: int, file_index: int = 0, start: int = 0):
+        """ Writing data lines to an open file without trailing newline, ranges past row 0 start with newline """
+        metrics = self.metrics
+        writer = serializers.BufferedLineWriter(file, self.buffer_size, started=start > 0)
+        for block in ConsoleUtility.line_blocks(self, rows, file_index, start):
+            with metrics.timer('io'):
+                writer.write_block(block)
+            metrics.add(size=len(block) + 1)
+        with metrics.timer('io'):
+            writer.flush()
+
+    def partition_index(self):
+        """ Returning plan index of the partition field, ValueError when it can not partition files """
+        plan = self.get_schema_plan()
+        if self.partition_by not in plan.keys:
+            raise ValueError('Partition field {} is not in the data schema'.format(self.partition_by))
+        field = plan.fields[plan.keys.index(self.partition_by)]
+        if field.kind not in layout.PARTITION_KINDS:
+            raise ValueError('Partition field {} must be a list, weighted, bool or constant field, not {}:{}'.format(
+                field.key, field.type, field.kind))
+        return plan.keys.index(self.partition_by)
+
+    def open_partition_writer(self, prefix, plan, value):
+        """ Returning (writer, temporary path, path) of a new partition file """
+        path = self.file_path(prefix, layout.partition_dir(self.partition_by, value))
+        temporary = path + manifest.TEMP_SUFFIX
+        options = {'serializer': self.serializer, 'buffer_size': self.buffer_size} \
+            if self.output_format == 'jsonl' else {}
+        writer = formats.open_writer(self.output_format, temporary, plan, self.compression, self.compression_level,
+                                     **options)
+        return writer, temporary, path
+
+    def generate_partitioned_file(self, prefix, file_index: int = 0):
+        """ Generating a file split into one file per partition value, returning (path, rows) of every partition """
+        index = ConsoleUtility.partition_index(self)
+        plan = self.get_schema_plan()
+        file_plan = SchemaPlan(field for field in plan if field.key != self.partition_by)
+        writers = layout.PartitionWriters(functools.partial(self.open_partition_writer, prefix, file_plan), index)
+        try:
+            for columns in ConsoleUtility.column_batches(self, self.data_lines, file_index):
+                with self.metrics.timer('io'):
+                    writers.write_columns(columns)
+        except BaseException:
+            writers.abort()
+            raise
+        with self.metrics.timer('io'):
+            written = writers.close()
+        self.metrics.add(size=sum(os.path.getsize(path) for path, _ in written), files=1)
+        return written
+
+    def generate_jsonl(self, prefix, file_index: int = 0):
+        """ Generating a single JSON file """
+        ConsoleUtility.write_file(self, self.file_path(prefix), self.data_lines, file_index)
+
+    def column_batches(self, rows, file_index: int = 0, start: int = 0,
+                       batch_rows: int = formats.ROW_GROUP_ROWS):
+        """ Yielding batches of generated rows as one list of values per plan field, unbounded when rows is None """
+        plan = self.get_schema_plan()
+        segments = seeding.chunk_segments(self.seed, file_index, start, rows, self.chunk_rows)
+        if self.engine == 'numpy':
+            import numpy
+            from numpy_engine import BlockGenerator
+            generator = BlockGenerator(plan)
+            for position, (seed, count) in ConsoleUtility.positioned(segments, start):
+                ConsoleUtility.seek_rows(self, plan, file_index, position)
+                if seed is not None:
+                    generator.rng = numpy.random.default_rng(seed)
+                for batch in range(0, count, batch_rows):
+                    size = min(batch_rows, count - batch)
+                    with self.metrics.timer('generate'):
+                        columns = generator.value_columns(size)
+                    self.metrics.add(rows=size)
+                    yield columns
+            return
+        for position, (seed, count) in ConsoleUtility.positioned(segments, start):
+            ConsoleUtility.seek_rows(self, plan, file_index, position)
+            rng = random if seed is None else random.Random(seed)
+            for batch in range(0, count, batch_rows):
+                size = min(batch_rows, count - batch)
+                with self.metrics.timer('generate'):
+                    columns = list(zip(*[plan.values(rng) for _ in range(size)]))
+                self.metrics.add(rows=size)
+                yield columns
+
+    def write_format_rows(self, path: str, rows: int, file_index: int = 0, start: int = 0):
+        """ Writing data lines to a csv, parquet or arrow file, csv header only for ranges from row 0 """
+        writer = formats.open_writer(self.output_format, path, self.get_schema_plan(), self.compression,
+                                     self.compression_level, header=start == 0)
+        try:
+            for columns in ConsoleUtility.column_batches(self, rows, file_index, start):
+                with self.metrics.timer('io'):
+                    writer.write_columns(columns)
+        finally:
+            with self.metrics.timer('io'):
+                writer.close()
+        self.metrics.add(size=os.path.getsize(path))
+
+    def record_layout(self):
+        """ Returning fixed width record layout of the schema plan, ValueError when a field has no bounded width """
+        return fixed_width.record_layout(self.get_schema_plan())
+
+    def write_fixed_rows(self, path: str, rows: int, file_index: int = 0, start: int = 0):
+        """ Writing rows from start at their offsets of a preallocated fixed width file, through a memory map """
+        layout = ConsoleUtility.record_layout(self)
+        mapped = fixed_width.MappedFile(path, start * layout.width, rows * layout.width)
+        try:
+            for columns in ConsoleUtility.column_batches(self, rows, file_index, start):
+                with self.metrics.timer('serialize'):
+                    block = layout.encode(columns)
+                with self.metrics.timer('io'):
+                    mapped.write(block)
+                self.metrics.add(size=len(block))
+        finally:
+            with self.metrics.timer('io'):
+                mapped.close()
+
+    def generate_fixed_file(self, prefix, file_index: int = 0):
+        """ Generating a single preallocated fixed width file and its row offset index """
+        ConsoleUtility.write_file(self, self.file_path(prefix), self.data_lines, file_index)
+
+    def write_file(self, path: str, rows: int, file_index: int = 0):
+        """ Writing rows to a file of the output format, under a temporary name renamed to path when complete """
+        if self.output_format == 'fixed':
+            layout = ConsoleUtility.record_layout(self)
+            with manifest.atomic_path(path) as temporary:
+                fixed_width.preallocate(temporary, rows * layout.width)
+                ConsoleUtility.write_fixed_rows(self, temporary, rows, file_index)
+            fixed_width.write_index(path, layout, rows)
+        elif self.output_format == 'jsonl':
+            with manifest.atomic_path(path) as temporary, self.open_file(temporary) as file:
+                ConsoleUtility.write_jsonl_rows(self, file, rows, file_index)
+        else:
+            with manifest.atomic_path(path) as temporary:
+                ConsoleUtility.write_format_rows(self, temporary, rows, file_index)
+        self.metrics.add(files=1)
+
+    def generate_file(self, prefix, file_index: int = 0):
+        """ Generating a single file in the configured output format, returning (path, rows) of written files """
+        if self.partition_by is not None:
+            return ConsoleUtility.generate_partitioned_file(self, prefix, file_index)
+        ConsoleUtility.write_file(self, self.file_path(prefix), self.data_lines, file_index)
+        return [(self.file_path(prefix), self.data_lines)]
+
+    def write_sized_rows(self, file, size: int, file_index: int = 0, segment: int = 0):
+        """ Writing whole rows of a file segment until the next one would pass `size` bytes, returning written bytes """
+        metrics = self.metrics
+        # Rows of every segment come from their own stream, independent of the other segments
+        stream = (file_index, segment)
+        # No more rows than the segment can hold are drawn, the positions of unique fields stay within its range
+        rows = sizing.segment_rows(size, ConsoleUtility.sized_positions(self)[1])
+        if self.output_format == 'csv':
+            writer = None
+            used = 0
+            if segment == 0:
+                header = formats.csv_block([[key] for key in self.get_schema_plan().keys])
+                with metrics.timer('io'):
+                    file.write(header)
+                used = sizing.text_size(header)
+                metrics.add(size=used)
+            plan = self.get_schema_plan()
+            blocks = (formats.csv_block(formats.text_columns(plan, columns))[:-1] for columns in
+                      ConsoleUtility.column_batches(self, rows, stream, 0, serializers.BATCH_ROWS))
+        else:
+            writer = serializers.BufferedLineWriter(file, self.buffer_size, started=segment > 0)
+            blocks = ConsoleUtility.line_blocks(self, rows, stream)
+            # The first line of the file is the only one without a preceding newline
+            used = -1 if segment == 0 else 0
+        for block in blocks:
+            block, block_size, dropped = sizing.fit_block(block, size - used)
+            if block:
+                with metrics.timer('io'):
+                    if writer is None:
+                        file.write(block + '\n')
+                    else:
+                        writer.write_block(block)
+                metrics.add(size=block_size + min(used, 0))
+            used += block_size
+            if dropped:
+                metrics.add(rows=-dropped)
+                break
+        if writer is not None:
+            with metrics.timer('io'):
+                writer.flush()
+        return max(used, 0)
+
+    def write_sized_file(self, path: str, budgets: list, file_index: int = 0, first_segment: int = 0):
+        """ Writing segments with provided byte budgets to a file, returning written bytes """
+        written = 0
+        with self.open_file(path) as file:
+            for segment, budget in enumerate(budgets, first_segment):
+                written += ConsoleUtility.write_sized_rows(self, file, budget, file_index, segment)
+        return written
+
+    def generate_sized_file(self, prefix, size: int, file_index: int = 0):
+        """ Generating a single file filled with rows up to size bytes, returning [(path, rows)] """
+        rows = self.metrics.rows
+        with manifest.atomic_path(self.file_path(prefix)) as path:
+            ConsoleUtility.write_sized_file(self, path, sizing.segments(size, self.segment_bytes), file_index)
+        self.metrics.add(files=1)
+        return [(self.file_path(prefix), self.metrics.rows - rows)]
+
+    def manifest_settings(self):
+        """ Returning settings that determine the content of the files, a resumed run must keep them """
+        return {'file_name': self.file_name, 'file_prefix': self.file_prefix, 'file_count': self.file_count,
+                'data_schema': self.data_schema, 'data_lines': self.data_lines, 'file_size': self.file_size,
+                'total_size': self.total_size, 'engine': self.engine, 'seed': self.seed, 'base_time': self.base_time,
+                'serializer': self.serializer, 'output_format': self.output_format,
+                'compression': self.compression, 'compression_level': self.compression_level,
+                'partition_by': self.partition_by, 'shards': self.shards}
+
+    def file_entries(self, written: list, file_index: int, prefix: str):
+        """ Returning manifest records of the (path, rows) files written for the file index """
+        if self.partition_by is None:
+            return [manifest.file_entry(path, self.path, file_index, prefix, self.seed, rows) for path, rows in written]
+        # Partition directories are the first level below the output path
+        return [manifest.file_entry(path, self.path, file_index, prefix, self.seed, rows,
+                                    partition=os.path.relpath(path, self.path).split(os.sep)[0], outputs=len(written))
+                for path, rows in written]
+
+    def open_manifest(self):
+        """ Creating the run manifest or loading it to resume the run """
+        path = manifest.manifest_path(self.path, self.file_name)
+        self.manifest = None
+        self.manifest = manifest.Manifest(path, self.manifest_settings(), self.file_prefixes(), self.resume)
+        if self.resume:
+            # Recorded files that were deleted or changed since are generated again, they do not count as complete
+            complete = sum(map(self.manifest.is_complete, range(len(self.manifest.prefixes))))
+            logging.info('Resuming run from {}, {} files already complete'.format(path, complete))
+        return self.manifest
+
+    def iter_rows(self, rows: int = None, file_index: int = 0):
+        """ Yielding generated data lines as dicts, unbounded when rows is None """
+        plan = self.get_schema_plan()
+        segments = seeding.chunk_segments(self.seed, file_index, 0, rows, self.chunk_rows)
+        for position, (seed, count) in ConsoleUtility.positioned(segments, 0):
+            ConsoleUtility.seek_rows(self, plan, file_index, position)
+            rng = random if seed is None else random.Random(seed)
+            for _ in range(count):
+                yield plan.row(rng)
+
+    def iter_chunks(self, rows: int = None, file_index: int = 0, batch_rows: int = None):
+        """ Yielding UTF-8 encoded chunks of newline terminated jsonl or csv rows, unbounded when rows is None """
+        if self.output_format == 'csv':
+            yield formats.csv_block([[key] for key in self.get_schema_plan().keys]).encode('utf-8')
+            for columns in ConsoleUtility.column_batches(self, rows, file_index, 0,
+                                                         batch_rows or serializers.BATCH_ROWS):
+                yield formats.csv_block(formats.text_columns(self.get_schema_plan(), columns)).encode('utf-8')
+            return
+        for block in ConsoleUtility.line_blocks(self, rows, file_index, 0, batch_rows):
+            yield (block + '\n').encode('utf-8')
+
+    def stream(self, output: str, rows: int = None, rate: float = None, duration: float = None):
+        """ Streaming rows to stdout ('-') or a file/FIFO path, returning number of written rows """
+        limiter = sinks.RateLimiter(rate) if rate else None
+        # Small batches keep a rate limited stream smooth
+        batch_rows = max(1, min(serializers.BATCH_ROWS, int(rate / 10))) if rate else None
+        deadline = time.monotonic() + duration if duration else None
+        written = 0
+        header = self.output_format == 'csv'
+        stream = sinks.StreamSink(output, self.compression, self.compression_level)
+        try:
+            for chunk in ConsoleUtility.iter_chunks(self, None if duration else rows, batch_rows=batch_rows):
+                count = 0 if header else chunk.count(b'\n')
+                header = False
+                if limiter:
+                    limiter.wait(count)
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                with self.metrics.timer('io'):
+                    stream.write(chunk)
+                self.metrics.add(size=len(chunk))
+                written += count
+        except BrokenPipeError:
+            logging.warning('Stream consumer closed the pipe after {} rows'.format(written))
+        finally:
+            try:
+                stream.close()
+            except BrokenPipeError:
+                pass
+        return written
+
+    def run(self):
+        """ Generating files or the stream with progress reporting """
+        streaming = self.output is not None
+        sizes = None if streaming else self.file_sizes()
+        total_rows = None if streaming and self.duration else self.data_lines * (1 if streaming else self.file_count)
+        total_files = None if streaming else self.file_count
+        if sizes is not None:
+            total_rows = None
+            total_files = len(sizes)
+        monitor = metrics.ProgressMonitor(total_rows, total_files, self.progress_interval, self.metrics_file,
+                                          None if sizes is None else sum(sizes))
+        if self.partition_by is not None:
+            ConsoleUtility.partition_index(self)
+        if sizes is not None and self.get_schema_plan().counters:
+            # Unique ranges too small for the size targets fail before any file is written
+            ConsoleUtility.sized_positions(self)
+        if self.output_format == 'fixed' and not streaming:
+            # Unbounded fields fail before any file is preallocated
+            ConsoleUtility.record_layout(self)
+        if self.write_manifest and not streaming:
+            ConsoleUtility.open_manifest(self)
+        self.metrics.report = monitor.update
+        start = time.time()
+        if streaming:
+            logging.info('Streaming rows to {}'.format('stdout' if self.output == '-' else self.output))
+            rows = ConsoleUtility.stream(self, self.output, self.data_lines, self.rate, self.duration)
+            self.metrics.flush()
+            logging.info('Time to stream {} rows: {}'.format(rows, time.time() - start))
+        elif self.multiprocessing != 1:
+            logging.info('Multiprocessing enabled with {} processes'.format(self.multiprocessing))
+            scheduler.run(self, self.multiprocessing, monitor)
+            logging.info("Done generating files")
+            logging.info('Time to generate {} files: {}'.format(total_files, time.time() - start))
+        else:
+            logging.info('Running with one process')
+            ConsoleUtility.generate_jsonl_loop(self)
+            self.metrics.flush()
+            logging.info("Time to generate {} files: {}".format(total_files, time.time() - start))
+        monitor.finish()
+        if self.manifest is not None:
+            self.manifest.finish(monitor.summary())
+        return monitor.summary()
+
+    def generate_jsonl_loop(self):
+        """ Generating multiple JSON files """
+        sizes = self.file_sizes()
+        for file_index, prefix in enumerate(self.file_prefixes()):
+            if self.manifest is not None and self.manifest.is_complete(file_index):
+                continue
+            if sizes is None:
+                written = ConsoleUtility.generate_file(self, prefix, file_index)
+            else:
+                written = ConsoleUtility.generate_sized_file(self, prefix, sizes[file_index], file_index)
+            if self.manifest is not None:
+                self.manifest.add(*self.file_entries(written, file_index, prefix))
+        logging.info("Done generating files")
+
+    def multiprocess_generate_jsonl(self):
+        """ Generating JSON files using multiprocessing with provided prefix """
+        scheduler.run(self, self.multiprocessing)
+        logging.info("Done generating files")
+
+
+def generate(schema: dict, rows: int, sink=None, output_format: str = 'jsonl', seed: int = None, **options):
+    """ Generating rows of the schema into the sink, returning the number of rows
+
+    The sink is a file path written in the output format with the same bytes as a cli.py file of the seed, '-' for
+    stdout or a binary file object receiving jsonl or csv chunks. Without a sink the rows are returned as a list of
+    dicts. Options are ConsoleUtility settings like engine, base_time, serializer, compression and compression_level.
+    """
+    cli = ConsoleUtility(path='.', file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=rows, clear_path='False', multiprocessing=1, seed=seed,
+                         output_format=output_format, progress_interval=0, **options)
+    if not cli.check_args():
+        raise ValueError('Invalid generation settings')
+    cli.get_schema_plan()
+    if sink is None:
+        return list(cli.iter_rows(rows))
+    if not isinstance(sink, str):
+        if output_format not in formats.TEXT_FORMATS:
+            raise ValueError('File objects take only jsonl and csv rows')
+        for chunk in cli.iter_chunks(rows):
+            sink.write(chunk)
+        return rows
+    if sink == '-':
+        if output_format not in formats.TEXT_FORMATS:
+            raise ValueError('stdout takes only jsonl and csv rows')
+        return cli.stream(sink, rows)
+    cli.write_file(sink, rows)
+    return rows
+
@@ -0,0 +1,192 @@
+import hashlib
+import os
+import re
+
+import manifest
+
+""" Output directory layout
+
+Files are written flat into the output path by default. --shards spreads them
+over hash named subdirectories and --partition_by splits every file into one
+file per value of a schema field under Hive style key=value directories, so
+no directory has to hold millions of entries. Every process keeps one open
+writer per partition of the file it generates. Clearing walks only the
+directories the configured layout creates with os.scandir, instead of listing
+and matching the whole tree, and removes the files listed in the manifest when
+the run has one.
+"""
+
+# Kinds with a bounded set of values, usable as partition fields
+PARTITION_KINDS = ('choice', 'weighted', 'bool', 'const')
+
+# Directory of null partition values, as named by Hive
+DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# Characters escaped in partition directory names, as by Hive
+ESCAPED_CHARACTERS = set('"#%\'*/:=?\\\x7f{[]^')
+
+# Directories created by this process
+_created = set()
+
+
+def escape_partition_value(value):
+    """ Returning partition value with characters not allowed in directory names escaped as %XX """
+    if value is None or value == 'None' or value == '':
+        return DEFAULT_PARTITION
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return ''.join('%{:02X}'.format(ord(character)) if character in ESCAPED_CHARACTERS or ord(character) < 32
+                   else character for character in str(value))
+
+
+def partition_dir(key: str, value):
+    """ Returning Hive style key=value directory name """
+    return '{}={}'.format(escape_partition_value(key), escape_partition_value(value))
+
+
+def shard_dir(name: str, shards: int):
+    """ Returning hexadecimal subdirectory of the file name among `shards` hash shards """
+    digest = hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest()
+    return '{:0{}x}'.format(int.from_bytes(digest, 'big') % shards, shard_width(shards))
+
+
+def shard_width(shards: int):
+    """ Returning number of hexadecimal digits of the shard directory names """
+    return max(2, len('{:x}'.format(shards - 1)))
+
+
+def make_dirs(directory: str):
+    """ Creating directory once per process """
+    if directory not in _created:
+        os.makedirs(directory, exist_ok=True)
+        _created.add(directory)
+
+
+def is_layout_dir(name: str):
+    """ Returning true if the directory name is a partition or shard directory """
+    return '=' in name or re.fullmatch(r'[0-9a-f]{2,}', name) is not None
+
+
+def layout_levels(shards: int = None, partition_by: str = None):
+    """ Returning checks of the directory names the layout creates, one per level below the output path """
+    levels = []
+    if partition_by is not None:
+        prefix = escape_partition_value(partition_by) + '='
+        levels.append(lambda name: name.startswith(prefix))
+    if shards is not None:
+        width = shard_width(shards)
+        levels.append(lambda name: len(name) == width and re.fullmatch(r'[0-9a-f]+', name) is not None
+                      and int(name, 16) < shards)
+    return levels
+
+
+def clear_files(path: str, file_name: str, shards: int = None, partition_by: str = None):
+    """ Removing files whose name contains file_name from path and the layout directories, returning their count
+
+    Only partition directories of partition_by and shard directories named for the number of shards are entered,
+    other directories are left as they are.
+    """
+    return _clear_files(path, file_name, layout_levels(shards, partition_by))
+
+
+def _clear_files(path: str, file_name: str, levels: list):
+    """ Removing matching files from path and its directories accepted by the checks of the next levels """
+    removed = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if levels and levels[0](entry.name):
+                    removed += _clear_files(entry.path, file_name, levels[1:])
+                    remove_empty_dir(entry.path)
+            elif file_name in entry.name:
+                os.remove(entry.path)
+                removed += 1
+    return removed
+
+
+def clear_manifest_files(manifest_file: str):
+    """ Removing files and parts listed in a manifest with their temporary files and the manifest, returning count """
+    root = os.path.dirname(manifest_file)
+    _, entries = manifest.read_manifest(manifest_file)
+    removed = 0
+    directories = set()
+    for entry in entries:
+        if 'file' not in entry:
+            continue
+        path = os.path.join(root, entry['file'])
+        directories.add(os.path.dirname(path))
+        for candidate in (path, path + manifest.TEMP_SUFFIX):
+            try:
+                os.remove(candidate)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    os.remove(manifest_file)
+    # Deepest directories first, so emptied parents can be removed too
+    for directory in sorted(directories, key=len, reverse=True):
+        while directory != root and os.path.dirname(directory) != directory:
+            if not is_layout_dir(os.path.basename(directory)) or not remove_empty_dir(directory):
+                break
+            directory = os.path.dirname(directory)
+    return removed
+
+
+def remove_empty_dir(directory: str):
+    """ Removing directory when it is empty, returning true if it was removed """
+    try:
+        os.rmdir(directory)
+    except OSError:
+        return False
+    _created.discard(directory)
+    return True
+
+
+class PartitionWriters:
+    """ Routing column batches to one open writer per value of the partition field """
+
+    def __init__(self, open_writer, index: int):
+        # open_writer(value) returns (writer, temporary path, final path) of a new partition, keyed by its directory
+        self.open_writer = open_writer
+        self.index = index
+        self.writers = {}
+        self.rows = {}
+
+    def write_columns(self, columns: list):
+        """ Writing rows of the batch to the writers of their partitions, without the partition column """
+        groups = {}
+        values = {}
+        for row, value in enumerate(columns[self.index]):
+            # Values sharing a directory, like None and '' of the default partition, share its writer
+            name = escape_partition_value(value)
+            groups.setdefault(name, []).append(row)
+            values.setdefault(name, value)
+        others = columns[:self.index] + columns[self.index + 1:]
+        for name, rows in groups.items():
+            if name not in self.writers:
+                self.writers[name] = self.open_writer(values[name])
+                self.rows[name] = 0
+            if len(rows) == len(columns[self.index]):
+                self.writers[name][0].write_columns(others)
+            else:
+                self.writers[name][0].write_columns([[column[row] for row in rows] for column in others])
+            self.rows[name] += len(rows)
+
+    def close(self):
+        """ Closing all writers and renaming their files, returning (path, rows) of every partition """
+        written = []
+        for name, (writer, temporary, path) in self.writers.items():
+            writer.close()
+            os.replace(temporary, path)
+            written.append((path, self.rows[name]))
+        self.writers = {}
+        return written
+
+    def abort(self):
+        """ Closing all writers and removing their temporary files """
+        for writer, temporary, _ in self.writers.values():
+            try:
+                writer.close()
+            finally:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+        self.writers = {}
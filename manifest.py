@@ -0,0 +1,172 @@
+import contextlib
+import hashlib
+import json
+import os
+
+""" Run manifest
+
+A manifest run records the run settings and every completed file and part in
+an append only JSON Lines file next to the output, with its seed, row count,
+byte size and sha256 checksum. Files and parts are written to temporary names
+and renamed when complete, so a file in the manifest is always whole. A
+resumed run reads the manifest, skips finished work and generates the rest
+with the same file prefixes. Downstream jobs read the file list from the
+manifest instead of listing the directory.
+"""
+
+MANIFEST_SUFFIX = '.manifest.jsonl'
+
+TEMP_SUFFIX = '.tmp'
+
+
+def manifest_path(path: str, file_name: str):
+    """ Returning path of the manifest of files named file_name in path """
+    return os.path.join(path, file_name + MANIFEST_SUFFIX)
+
+
+@contextlib.contextmanager
+def atomic_path(path: str):
+    """ Yielding temporary path that is renamed to path when the block completes, removed when it fails """
+    temporary = path + TEMP_SUFFIX
+    try:
+        yield temporary
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    os.replace(temporary, path)
+
+
+def file_checksum(path: str):
+    """ Returning sha256 hex digest of the file """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_entry(path: str, root: str, file_index: int, prefix: str, seed, rows: int, **fields):
+    """ Returning manifest record of a completed file or part, named relative to the output root
+
+    Parts add part and range fields, files of partitioned runs add partition and outputs, the number of files
+    generated from the same file index.
+    """
+    entry = {'file': os.path.relpath(path, root), 'file_index': file_index, 'prefix': prefix, 'seed': seed,
+             'rows': rows, 'bytes': os.path.getsize(path), 'sha256': file_checksum(path)}
+    entry.update(fields)
+    return entry
+
+
+class Manifest:
+    """ Append only record of the run settings and completed files and parts """
+
+    def __init__(self, path: str, settings: dict, prefixes: list = None, resume: bool = False):
+        self.path = path
+        self.root = os.path.dirname(path)
+        self.settings = settings
+        self.prefixes = prefixes
+        self.files = {}
+        self.parts = {}
+        self.sources = {}
+        if resume and os.path.exists(path):
+            repair_tail(path)
+            header, entries = read_manifest(path)
+            if header['settings'] != settings:
+                changed = sorted(key for key in set(settings) | set(header['settings'])
+                                 if settings.get(key) != header['settings'].get(key))
+                raise ValueError('Manifest {} was written with different settings: {}'.format(path,
+                                                                                              ', '.join(changed)))
+            self.prefixes = header['prefixes']
+            for entry in entries:
+                self.record(entry)
+        else:
+            with open(path, 'w') as file:
+                file.write(json.dumps({'settings': settings, 'prefixes': prefixes}) + '\n')
+
+    def record(self, entry: dict):
+        """ Storing completed file or part in memory """
+        if 'part' in entry:
+            self.parts[(entry['file'], entry['part'])] = entry
+        elif 'file' in entry:
+            self.files[entry['file']] = entry
+            self.sources.setdefault(entry['file_index'], {})[entry['file']] = entry
+
+    def add(self, *entries):
+        """ Appending completed files or parts to the manifest in one write """
+        for entry in entries:
+            self.record(entry)
+        with open(self.path, 'a') as file:
+            file.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def exists(self, entry: dict):
+        """ Returning true if the recorded file still exists with the recorded size """
+        path = os.path.join(self.root, entry['file'])
+        return os.path.exists(path) and os.path.getsize(path) == entry['bytes']
+
+    def is_complete(self, file_index: int):
+        """ Returning true if all files generated from the file index are recorded and still exist """
+        entries = list(self.sources.get(file_index, {}).values())
+        if not entries or len(entries) != entries[0].get('outputs', 1):
+            return False
+        return all(self.exists(entry) for entry in entries)
+
+    def part(self, path: str, part: int):
+        """ Returning manifest record of a finished part file """
+        return self.parts.get((os.path.relpath(path, self.root), part))
+
+    def completed_part(self, path: str, part: int, task_range: list):
+        """ Returning manifest record of a finished part with the same range whose part file still exists """
+        entry = self.part(path, part)
+        if entry is not None and entry['range'] == list(task_range) and self.exists(entry):
+            return entry
+        return None
+
+    def finish(self, summary: dict):
+        """ Appending the record that marks the run as complete """
+        files = list(self.files.values())
+        self.add({'complete': True, 'files': len(files), 'rows': sum(entry['rows'] for entry in files),
+                  'bytes': sum(entry['bytes'] for entry in files), 'seconds': summary.get('seconds')})
+
+
+def repair_tail(path: str):
+    """ Ending the manifest after its last whole record, so records appended by a resumed run start on a new line
+
+    A last line without its newline is kept when it is a whole record and cut off when the run died writing it.
+    """
+    with open(path, 'rb+') as file:
+        data = file.read()
+        if not data or data.endswith(b'\n'):
+            return
+        end = data.rfind(b'\n') + 1
+        try:
+            json.loads(data[end:])
+        except ValueError:
+            file.truncate(end)
+        else:
+            file.write(b'\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def read_manifest(path: str):
+    """ Returning header and records of a manifest, a torn last line of a killed run is ignored """
+    with open(path, 'r') as file:
+        lines = file.read().split('\n')
+    header = json.loads(lines[0])
+    entries = []
+    for line in lines[1:]:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return header, entries
+
+
+def completed_files(path: str):
+    """ Returning records of the complete files listed in a manifest, in file order """
+    _, entries = read_manifest(path)
+    files = {entry['file']: entry for entry in entries if 'file' in entry and 'part' not in entry}
+    return sorted(files.values(), key=lambda entry: (entry['file_index'], entry['file']))
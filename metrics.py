@@ -0,0 +1,204 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import time
+
+""" Progress, metrics and profiling
+
+Every process keeps a Metrics object counting rows, bytes and completed files
+and the time spent generating values, serializing them and writing them out.
+Snapshots are reported to a ProgressMonitor, directly or through a queue from
+pool workers, which logs a periodic progress line with ETA and keeps the JSON
+metrics file up to date.
+"""
+
+PROGRESS_INTERVAL = 10.0
+
+PHASES = ('generate', 'serialize', 'io')
+
+
+class Metrics:
+    """ Counting rows, bytes, files and time per phase of one process """
+
+    def __init__(self, worker: str = 'main', report=None, interval: float = PROGRESS_INTERVAL):
+        self.worker = worker
+        self.report = report
+        self.interval = interval
+        self.rows = 0
+        self.bytes = 0
+        self.files = 0
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Report callbacks belong to the process that created them
+        state['report'] = None
+        return state
+
+    @contextlib.contextmanager
+    def timer(self, phase: str):
+        """ Adding time spent in the block to the phase """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] += time.perf_counter() - start
+
+    def add(self, rows: int = 0, size: int = 0, files: int = 0):
+        """ Counting generated rows, written bytes and completed files """
+        self.rows += rows
+        self.bytes += size
+        self.files += files
+        if self.report is not None and self.interval and time.monotonic() - self.last_report >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """ Reporting current snapshot """
+        self.last_report = time.monotonic()
+        if self.report is not None:
+            self.report(self.snapshot())
+
+    def snapshot(self):
+        """ Returning counters as dict """
+        now = time.monotonic()
+        return {'worker': self.worker, 'rows': self.rows, 'bytes': self.bytes, 'files': self.files,
+                'seconds': now - self.started, 'timings': dict(self.timings), 'reported': time.time()}
+
+
+def format_count(value: float):
+    """ Returning human readable count """
+    for unit in ['', 'K', 'M', 'G']:
+        if abs(value) < 1000:
+            return '{:.1f}{}'.format(value, unit) if unit else '{:.0f}'.format(value)
+        value /= 1000.0
+    return '{:.1f}T'.format(value)
+
+
+class ProgressMonitor:
+    """ Aggregating worker snapshots into progress lines and the metrics file """
+
+    def __init__(self, total_rows: int = None, total_files: int = None, interval: float = PROGRESS_INTERVAL,
+                 metrics_file: str = None, total_bytes: int = None):
+        self.total_rows = total_rows
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.interval = interval
+        self.metrics_file = metrics_file
+        self.workers = {}
+        self.started = time.monotonic()
+        self.last_line = self.started
+
+    def update(self, snapshot: dict):
+        """ Storing newest snapshot of a worker and logging progress when the interval passed """
+        previous = self.workers.get(snapshot['worker'])
+        if previous is None or previous['reported'] <= snapshot['reported']:
+            self.workers[snapshot['worker']] = snapshot
+        if self.interval and time.monotonic() - self.last_line >= self.interval:
+            self.log()
+
+    def totals(self):
+        """ Returning rows, bytes and files of all workers """
+        rows = sum(worker['rows'] for worker in self.workers.values())
+        size = sum(worker['bytes'] for worker in self.workers.values())
+        files = sum(worker['files'] for worker in self.workers.values())
+        return rows, size, files
+
+    def line(self):
+        """ Returning progress line """
+        rows, size, files = self.totals()
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        rate = rows / elapsed
+        parts = []
+        if self.total_files:
+            parts.append('{}/{} files'.format(files, self.total_files))
+        if self.total_rows:
+            parts.append('{}/{} rows ({:.1f}%)'.format(format_count(rows), format_count(self.total_rows),
+                                                       100.0 * rows / self.total_rows))
+        else:
+            parts.append('{} rows'.format(format_count(rows)))
+        parts.append('{} rows/s'.format(format_count(rate)))
+        if self.total_bytes:
+            parts.append('{:.1f}/{:.1f} MB ({:.1f}%)'.format(size / 1024 / 1024, self.total_bytes / 1024 / 1024,
+                                                             100.0 * size / self.total_bytes))
+        else:
+            parts.append('{:.1f} MB'.format(size / 1024 / 1024))
+        if self.total_rows and rate > 0:
+            parts.append('ETA {:.0f}s'.format(max(self.total_rows - rows, 0) / rate))
+        elif self.total_bytes and size > 0:
+            parts.append('ETA {:.0f}s'.format(max(self.total_bytes - size, 0) * elapsed / size))
+        return 'Progress: ' + ', '.join(parts)
+
+    def log(self):
+        """ Logging progress line and refreshing the metrics file """
+        self.last_line = time.monotonic()
+        logging.info(self.line())
+        self.write()
+
+    def summary(self):
+        """ Returning totals, per worker throughput and time split between phases """
+        rows, size, files = self.totals()
+        elapsed = time.monotonic() - self.started
+        timings = dict.fromkeys(PHASES, 0.0)
+        workers = []
+        for snapshot in sorted(self.workers.values(), key=lambda worker: worker['worker']):
+            for phase, seconds in snapshot['timings'].items():
+                timings[phase] = timings.get(phase, 0.0) + seconds
+            workers.append(dict(snapshot, rows_per_sec=snapshot['rows'] / snapshot['seconds']
+                                if snapshot['seconds'] else 0.0))
+        return {'rows': rows, 'bytes': size, 'files': files, 'seconds': elapsed,
+                'rows_per_sec': rows / elapsed if elapsed else 0.0,
+                'mb_per_sec': size / 1024 / 1024 / elapsed if elapsed else 0.0,
+                'total_rows': self.total_rows, 'total_files': self.total_files, 'total_bytes': self.total_bytes,
+                'timings': timings,
+                'workers': workers}
+
+    def write(self):
+        """ Writing summary to the metrics file, replacing it atomically """
+        if not self.metrics_file:
+            return
+        temporary = self.metrics_file + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+        os.replace(temporary, self.metrics_file)
+
+    def finish(self):
+        """ Logging final progress line and time split, writing the metrics file """
+        logging.info(self.line())
+        timings = self.summary()['timings']
+        total = sum(timings.values())
+        if total:
+            logging.info('Time split: ' + ', '.join('{} {:.1f}%'.format(phase, 100.0 * seconds / total)
+                                                    for phase, seconds in timings.items()))
+        self.write()
+
+
+def profile_run(function, report_path: str, top: int = 40):
+    """ Running function under cProfile and tracemalloc and writing a text report """
+    # Profilers are imported by profiled runs only, they slow down the start of every process
+    import cProfile
+    import pstats
+    import tracemalloc
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        return function()
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        output = io.StringIO()
+        output.write('cProfile, top {} functions by cumulative time\n\n'.format(top))
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(top)
+        output.write('\ntracemalloc, current {:.1f} MB, peak {:.1f} MB, top allocations\n\n'.format(
+            current / 1024 / 1024, peak / 1024 / 1024))
+        for statistic in snapshot.statistics('lineno')[:top]:
+            output.write('{}\n'.format(statistic))
+        with open(report_path, 'w') as file:
+            file.write(output.getvalue())
+        logging.info('Profile report written to {}'.format(report_path))
@@ -0,0 +1,236 @@
+import datetime
+import json
+import random
+import time
+
+import numpy as np
+
+from serializers import RAW_STRING_KINDS, CHOICE_KINDS, choice_values, is_inline, jsonl_template, template_encoder
+from schema_compiler import FEISTEL_MULTIPLIER, NESTED_KINDS
+from schema_parser import DATETIME_FORMAT, EPOCH
+
+""" Vectorized NumPy engine
+
+Generates a whole block of rows per field at once from a compiled SchemaPlan
+and serializes the block in one pass using a precomputed row template.
+Nested objects and arrays are generated row by row from a Random seeded by
+the block stream, expressions are evaluated row by row once the block is
+generated.
+"""
+
+BLOCK_ROWS = 65536
+
+# Positions of the hex digits inside the 36 characters of a canonical uuid string
+_UUID_HEX_POSITIONS = [i for i in range(36) if i not in (8, 13, 18, 23)]
+
+
+def uuid_column(rng, rows: int):
+    """ Generating uuid4 strings from bulk random bytes """
+    raw = np.frombuffer(rng.bytes(16 * rows), dtype=np.uint8).reshape(rows, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0f) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3f) | 0x80
+    hex_digits = np.frombuffer(raw.tobytes().hex().encode('ascii'), dtype='S1').reshape(rows, 32)
+    result = np.full((rows, 36), b'-', dtype='S1')
+    result[:, _UUID_HEX_POSITIONS] = hex_digits
+    return result.view('S36').ravel().astype('U36').tolist()
+
+
+def timestamp_column(rows: int, start: float, end: float):
+    """ Generating timestamps spread evenly between block start and end """
+    return [str(value) for value in np.linspace(start, end, rows).tolist()]
+
+
+def choice_column(rng, rows: int, values: np.ndarray):
+    """ Picking values with an index array """
+    return values[rng.integers(0, len(values), size=rows)].tolist()
+
+
+def randint_column(rng, rows: int, low: int, high: int):
+    """ Generating integers from closed range """
+    return rng.integers(low, high, size=rows, endpoint=True).tolist()
+
+
+def weighted_index(rng, rows: int, cum_weights: np.ndarray):
+    """ Generating indexes picked with cumulative weights """
+    indexes = np.searchsorted(cum_weights, rng.random(rows) * cum_weights[-1], side='right')
+    return np.minimum(indexes, len(cum_weights) - 1)
+
+
+def datetime_column(rng, rows: int, start: int, span: int, date_format: str):
+    """ Generating formatted datetimes from start epoch seconds plus random seconds up to span """
+    values = np.datetime64(start, 's') + rng.integers(0, span, size=rows, endpoint=True)
+    if date_format == DATETIME_FORMAT:
+        return np.datetime_as_string(values, unit='s').tolist()
+    return [(EPOCH + datetime.timedelta(seconds=value)).strftime(date_format)
+            for value in values.astype(np.int64).tolist()]
+
+
+def permute_column(sequence, indexes: np.ndarray):
+    """ Permuting uint64 indexes with the Feistel network of a UniqueSequence, as UniqueSequence.permute """
+    half = np.uint64(sequence.half)
+    mask = np.uint64(sequence.mask)
+    shift = np.uint64(64 - sequence.half)
+    multiplier = np.uint64(FEISTEL_MULTIPLIER)
+    keys = [np.uint64(key) for key in sequence.round_keys]
+    size = np.uint64(sequence.size)
+
+    def permute(values):
+        left, right = values >> half, values & mask
+        for key in keys:
+            left, right = right, left ^ (((right + key) * multiplier) >> shift)
+        return (left << half) | right
+
+    indexes = permute(indexes)
+    outside = np.flatnonzero(indexes >= size)
+    while len(outside):
+        indexes[outside] = permute(indexes[outside])
+        outside = outside[indexes[outside] >= size]
+    return (indexes + np.uint64(sequence.low)).tolist()
+
+
+def unique_column(sequence, rows: int):
+    """ Generating the next values of a unique sequence """
+    start = sequence.take(rows)
+    return permute_column(sequence, np.arange(start, start + rows, dtype=np.uint64))
+
+
+def foreign_key_column(foreign_key, rng, rows: int):
+    """ Generating keys of parent rows picked with the cardinality of a ForeignKey """
+    if foreign_key.parent is None:
+        raise ValueError('ref field {} is not bound to table {}'.format(foreign_key.key, foreign_key.table))
+    parent_rows = foreign_key.parent_rows
+    if foreign_key.cardinality == 'each':
+        start = foreign_key.take(rows)
+        indexes = np.arange(start, start + rows, dtype=object) * parent_rows // foreign_key.rows % parent_rows
+        indexes = indexes.astype(np.uint64)
+    elif foreign_key.cardinality == 'zipf':
+        uniform, exponent = rng.random(rows), foreign_key.exponent
+        if exponent == 1.0:
+            ranks = np.power(float(parent_rows + 1), uniform)
+        else:
+            ranks = np.power(1 + uniform * ((parent_rows + 1) ** (1 - exponent) - 1), 1 / (1 - exponent))
+        indexes = (np.minimum(ranks.astype(np.int64), parent_rows) - 1).astype(np.uint64)
+    else:
+        indexes = rng.integers(0, parent_rows, size=rows, dtype=np.uint64)
+    return permute_column(foreign_key.parent, indexes)
+
+
+class BlockGenerator:
+    """ Generating and serializing blocks of rows for a compiled plan """
+
+    def __init__(self, plan, rng=None):
+        self.plan = plan
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.template, self.fields = jsonl_template(plan)
+        # Choice values as (JSON encoded, raw, cumulative weights) arrays indexed by random index arrays
+        self.choices = {}
+        self.weights = {}
+        for field in self.fields:
+            if field.kind in CHOICE_KINDS:
+                values, cum_weights = choice_values(field)
+                encoded = np.array([json.dumps(value, ensure_ascii=True) for value in values], dtype=object)
+                raw = np.empty(len(values), dtype=object)
+                raw[:] = values
+                self.choices[field.key] = (encoded, raw)
+                if cum_weights is not None:
+                    self.weights[field.key] = np.array(cum_weights, dtype=np.float64)
+            elif field.kind == 'zipf':
+                self.weights[field.key] = np.array(field.args[2], dtype=np.float64)
+
+    def field_column(self, field, rows: int, encoded: bool):
+        """ Generating values of a single field, None for timestamps filled in after the block """
+        rng, kind, args = self.rng, field.kind, field.args
+        if kind == 'timestamp' and args:
+            base_time, span = args
+            return [str(value) for value in (base_time + rng.random(rows) * span).tolist()]
+        if kind == 'timestamp':
+            # Filled in once the block is generated so timestamps span its generation time
+            return None
+        if kind == 'uuid':
+            return uuid_column(rng, rows)
+        if kind in CHOICE_KINDS:
+            values = self.choices[field.key][0 if encoded else 1]
+            if field.key not in self.weights:
+                return choice_column(rng, rows, values)
+            return values[weighted_index(rng, rows, self.weights[field.key])].tolist()
+        if kind == 'randint':
+            return randint_column(rng, rows, *args)
+        if kind == 'uniform':
+            return rng.uniform(args[0], args[1], size=rows).tolist()
+        if kind == 'normal' and field.type == 'int':
+            return np.rint(rng.normal(args[0], args[1], size=rows)).astype(np.int64).tolist()
+        if kind == 'normal':
+            return rng.normal(args[0], args[1], size=rows).tolist()
+        if kind == 'zipf':
+            return (weighted_index(rng, rows, self.weights[field.key]) + 1).tolist()
+        if kind == 'datetime':
+            return datetime_column(rng, rows, *args)
+        if kind == 'unique':
+            return unique_column(args[2], rows)
+        if kind == 'ref':
+            return foreign_key_column(field.generate, rng, rows)
+        if kind in NESTED_KINDS:
+            generator = random.Random(int(rng.integers(1 << 63)))
+            values = [field.generate(generator) for _ in range(rows)]
+            return [json.dumps(value, ensure_ascii=True) for value in values] if encoded else values
+        if kind == 'expr':
+            # Evaluated once the other fields of the block are generated
+            return [None] * rows
+        # Constant with null rate
+        return [json.dumps(args[0], ensure_ascii=True) if encoded else args[0]] * rows
+
+    def generate_columns(self, rows: int, encoded: bool = True):
+        """ Generating one list of values per non constant field, choices JSON encoded by default """
+        if not self.plan.expressions:
+            return self.random_columns(rows, encoded)
+        raw = iter(self.random_columns(rows, False))
+        columns = [[field.args[0]] * rows if is_inline(field) else next(raw) for field in self.plan]
+        values = [self.plan.evaluate(list(row)) for row in zip(*columns)]
+        columns = [list(column) for field, column in zip(self.plan, zip(*values)) if not is_inline(field)]
+        if encoded:
+            columns = [list(map(template_encoder(field), column)) for field, column in zip(self.fields, columns)]
+        return columns
+
+    def random_columns(self, rows: int, encoded: bool = True):
+        """ Generating one list of values per non constant field without evaluating expressions """
+        start = time.time()
+        columns = [self.field_column(field, rows, encoded) for field in self.fields]
+        end = time.time()
+        for index, field in enumerate(self.fields):
+            if field.kind == 'timestamp' and not field.args:
+                columns[index] = timestamp_column(rows, start, end)
+        for index, field in enumerate(self.fields):
+            if field.null_rate:
+                column = columns[index]
+                if encoded and field.kind in RAW_STRING_KINDS:
+                    # Nullable strings are not quoted by the template
+                    column = ['"%s"' % value for value in column]
+                null = 'null' if encoded else None
+                for row in np.flatnonzero(self.rng.random(rows) < field.null_rate).tolist():
+                    column[row] = null
+                columns[index] = column
+        return columns
+
+    def value_columns(self, rows: int):
+        """ Generating one list of raw values per plan field, constants included """
+        columns = iter(self.generate_columns(rows, encoded=False))
+        return [[field.args[0]] * rows if is_inline(field) else next(columns) for field in self.plan]
+
+    def serialize_block(self, columns: list, rows: int):
+        """ Serializing generated columns into JSON lines joined without trailing newline """
+        template = self.template
+        if not columns:
+            return '\n'.join([template] * rows)
+        return '\n'.join([template % values for values in zip(*columns)])
+
+    def generate_block(self, rows: int):
+        """ Generating a serialized block of JSON lines without trailing newline """
+        return self.serialize_block(self.generate_columns(rows), rows)
+
+    def write(self, writer, rows: int, block_rows: int = BLOCK_ROWS):
+        """ Writing rows to BufferedLineWriter block by block """
+        written = 0
+        while written < rows:
+            size = min(block_rows, rows - written)
+            writer.write_block(self.generate_block(size))
+            written += size
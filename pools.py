@@ -0,0 +1,87 @@
+import collections
+import hashlib
+import json
+import os
+import random
+
+import manifest
+from seeding import derive_seed
+
+""" Value pools
+
+A field with a pool, like str:rand(pool=100000) or float:normal(0, 1)|pool(1000),
+generates its values once when the schema is compiled and rows pick from them
+by index, so expensive generators like uuids and timestamps run once per pool
+value instead of once per row. Pools are compiled into choice fields and are
+shipped to the pool workers with the plan. Compiled pools are kept in an LRU
+cache of the process, seeded pools are also stored in the disk cache
+directory when one is set, keyed by field, spec, seed and base time, so
+repeated runs load them instead of generating them again.
+"""
+
+# Largest number of values of a pool
+MAX_POOL_VALUES = 10000000
+
+# Pools kept in memory by the process
+LRU_POOLS = 32
+
+# Bumped when the generated values of a spec change, so old cache files are not used
+CACHE_VERSION = 1
+
+_cache_dir = None
+
+_pools = collections.OrderedDict()
+
+
+def set_cache_dir(path: str = None):
+    """ Setting directory of the disk cache of seeded pools, None disables it """
+    global _cache_dir
+    _cache_dir = path
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+
+
+def pool_key(key: str, spec: str, size: int, seed=None, base_time: float = None):
+    """ Returning cache key of a pool """
+    text = json.dumps([CACHE_VERSION, key, spec, size, seed, base_time])
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def read_pool(path: str):
+    """ Returning pool values stored in a cache file, None when it is missing or damaged """
+    try:
+        with open(path, 'r') as file:
+            return tuple(json.load(file))
+    except (OSError, ValueError):
+        return None
+
+
+def write_pool(path: str, values: tuple):
+    """ Storing pool values in a cache file, renamed into place when complete """
+    with manifest.atomic_path(path) as temporary, open(temporary, 'w') as file:
+        json.dump(list(values), file)
+
+
+def pool_values(key: str, spec: str, size: int, generate, seed=None, base_time: float = None):
+    """ Returning up to size distinct generated values of a field, from the caches when they hold them """
+    cache_key = pool_key(key, spec, size, seed, base_time)
+    if cache_key in _pools:
+        _pools.move_to_end(cache_key)
+        return _pools[cache_key]
+    path = None if seed is None or _cache_dir is None else os.path.join(_cache_dir, cache_key + '.json')
+    values = read_pool(path) if path is not None else None
+    if values is None:
+        rng = random.Random(derive_seed(seed, 'pool', key, spec)) if seed is not None else random.Random()
+        # Repeated values are dropped, so every value of the pool is picked equally often
+        values = tuple(dict.fromkeys(generate(rng) for _ in range(size)))
+        if path is not None:
+            write_pool(path, values)
+    _pools[cache_key] = values
+    if len(_pools) > LRU_POOLS:
+        _pools.popitem(last=False)
+    return values
+
+
+def clear_memory():
+    """ Dropping pools kept in memory """
+    _pools.clear()
@@ -0,0 +1,242 @@
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+from multiprocessing import Pool
+
+import fixed_width
+import formats
+import manifest
+import metrics
+import sizing
+
+""" Process pool scheduler
+
+Files are sent to the pool as file level tasks. When there are fewer files
+than workers every file is split into row ranges, each worker writes its range
+to a part file and the parts are concatenated in order afterwards. Parts after
+the first start with the separating newline and compressed parts are complete
+streams, so merging never decompresses. Seeded runs split on chunk boundaries,
+so output is the same for any pool size. Fixed width files are preallocated
+and their ranges are written in place at their record offsets, they are never
+merged. Parquet and Arrow files are never split. Size targeted files are
+scheduled by bytes, files larger than an equal share of the total bytes are
+split on segment boundaries and the largest tasks are sent first. Files and
+parts are written to temporary names and renamed when complete, runs with a
+manifest record every finished task and resumed runs only schedule the
+unfinished ones.
+"""
+
+# ConsoleUtility instance shared with the worker once, by the pool initializer
+_worker_cli = None
+
+
+def _init_worker(cli, reports=None):
+    """ Storing ConsoleUtility instance in the worker process, with metrics reported to the parent """
+    global _worker_cli
+    _worker_cli = cli
+    _worker_cli.metrics = metrics.Metrics('worker-{}'.format(os.getpid()),
+                                          reports.put if reports is not None else None, cli.progress_interval)
+
+
+def part_path(path: str, part: int):
+    """ Returning path of a row range part of the file """
+    return '{}.part{}'.format(path, part)
+
+
+def split_rows(rows: int, parts: int, align: int = 1):
+    """ Splitting rows into at most `parts` non empty ranges starting on multiples of `align` """
+    units = -(-rows // align)
+    parts = max(1, min(parts, units))
+    size, rest = divmod(units, parts)
+    ranges = []
+    start = 0
+    for part in range(parts):
+        stop = min(rows, start + (size + 1 if part < rest else size) * align)
+        ranges.append((start, stop - start))
+        start = stop
+    return ranges
+
+
+def plan_tasks(prefixes: list, data_lines: int, processes: int, align: int = 1, split: bool = True):
+    """ Returning (file_index, prefix, part, start, rows) tasks, part is None for whole files """
+    if not split or len(prefixes) >= processes or data_lines <= 1:
+        return [(index, prefix, None, 0, data_lines) for index, prefix in enumerate(prefixes)]
+    parts_per_file = -(-processes // len(prefixes))
+    tasks = []
+    for index, prefix in enumerate(prefixes):
+        for part, (start, rows) in enumerate(split_rows(data_lines, parts_per_file, align)):
+            tasks.append((index, prefix, part, start, rows))
+    return tasks
+
+
+def plan_sized_tasks(prefixes: list, sizes: list, processes: int, segment_bytes: int = sizing.SEGMENT_BYTES):
+    """ Returning (file_index, prefix, part, first_segment, budgets) tasks balanced by bytes, largest first """
+    share = max(segment_bytes, -(-sum(sizes) // processes))
+    step = max(1, share // segment_bytes)
+    tasks = []
+    for index, (prefix, size) in enumerate(zip(prefixes, sizes)):
+        budgets = sizing.segments(size, segment_bytes)
+        if size <= share:
+            tasks.append((index, prefix, None, 0, budgets))
+            continue
+        for part, first in enumerate(range(0, len(budgets), step)):
+            tasks.append((index, prefix, part, first, budgets[first:first + step]))
+    return sorted(tasks, key=lambda task: sum(task[4]), reverse=True)
+
+
+def task_range(task):
+    """ Returning [start, count] of a task, in rows or segments """
+    start, span = task[3], task[4]
+    return [start, span if isinstance(span, int) else len(span)]
+
+
+def _task_entries(task, written: list):
+    """ Returning manifest records of the (path, rows) files written by a task, empty when the run has no manifest """
+    if _worker_cli.manifest is None or not written:
+        return []
+    file_index, prefix, part = task[:3]
+    if part is None:
+        return _worker_cli.file_entries(written, file_index, prefix)
+    return [manifest.file_entry(path, _worker_cli.path, file_index, prefix, _worker_cli.seed, rows, part=part,
+                                range=task_range(task)) for path, rows in written]
+
+
+def run_task(task):
+    """ Generating a whole file or a single part of it in the worker, returning task, manifest records and metrics """
+    file_index, prefix, part, start, rows = task
+    if part is None:
+        written = _worker_cli.generate_file(prefix, file_index)
+    elif _worker_cli.output_format == 'fixed':
+        # Ranges of the preallocated file are written in place, the file is recorded once it is whole
+        _worker_cli.write_fixed_rows(_worker_cli.file_path(prefix) + manifest.TEMP_SUFFIX, rows, file_index, start)
+        written = []
+        if part == 0:
+            _worker_cli.metrics.add(files=1)
+    else:
+        path = part_path(_worker_cli.file_path(prefix), part)
+        with manifest.atomic_path(path) as temporary:
+            if _worker_cli.output_format == 'jsonl':
+                with _worker_cli.open_file(temporary) as file:
+                    _worker_cli.write_jsonl_rows(file, rows, file_index, start)
+            else:
+                _worker_cli.write_format_rows(temporary, rows, file_index, start)
+        written = [(path, rows)]
+        if part == 0:
+            # The file is counted once, by its first part
+            _worker_cli.metrics.add(files=1)
+    return task, _task_entries(task, written), _worker_cli.metrics.snapshot()
+
+
+def run_sized_task(task):
+    """ Generating a size targeted file or a range of its segments in the worker, returning task, records, metrics """
+    file_index, prefix, part, first_segment, budgets = task
+    path = _worker_cli.file_path(prefix)
+    if part is not None:
+        path = part_path(path, part)
+    generated = _worker_cli.metrics.rows
+    with manifest.atomic_path(path) as temporary:
+        _worker_cli.write_sized_file(temporary, budgets, file_index, first_segment)
+    if part is None or part == 0:
+        _worker_cli.metrics.add(files=1)
+    return task, _task_entries(task, [(path, _worker_cli.metrics.rows - generated)]), _worker_cli.metrics.snapshot()
+
+
+def merge_parts(path: str, parts: int):
+    """ Concatenating part files into the final file and removing them, with parts left by an earlier plan """
+    with manifest.atomic_path(path) as temporary:
+        with open(temporary, 'wb') as destination:
+            for part in range(parts):
+                with open(part_path(path, part), 'rb') as source:
+                    shutil.copyfileobj(source, destination, 1024 * 1024)
+    part = 0
+    while part < parts or os.path.exists(part_path(path, part)):
+        if os.path.exists(part_path(path, part)):
+            os.remove(part_path(path, part))
+        part += 1
+
+
+def pending_tasks(cli, tasks: list):
+    """ Returning tasks of a resumed run whose file or part is not complete in the manifest """
+    pending = []
+    for task in tasks:
+        if cli.manifest.is_complete(task[0]):
+            continue
+        if task[2] is not None and cli.manifest.completed_part(part_path(cli.file_path(task[1]), task[2]), task[2],
+                                                               task_range(task)) is not None:
+            continue
+        pending.append(task)
+    return pending
+
+
+def _drain_reports(reports, monitor):
+    """ Passing progress reports of the workers to the monitor """
+    if reports is None:
+        return
+    while True:
+        try:
+            monitor.update(reports.get_nowait())
+        except queue.Empty:
+            return
+
+
+def run(cli, processes: int, monitor=None):
+    """ Generating all files of ConsoleUtility with a process pool, reporting progress to the monitor """
+    prefixes = cli.file_prefixes()
+    sizes = cli.file_sizes()
+    if sizes is not None:
+        tasks = plan_sized_tasks(prefixes, sizes, processes, cli.segment_bytes)
+        worker = run_sized_task
+    else:
+        # Seeded runs split files on chunk boundaries so every chunk keeps its own stream
+        align = 1 if cli.seed is None else cli.chunk_rows
+        # Parquet and Arrow files can not be concatenated, they are only scheduled as whole files
+        # Partitioned files are written by one process with a writer per partition
+        tasks = plan_tasks(prefixes, cli.data_lines, processes, align,
+                           cli.output_format in formats.TEXT_FORMATS + ['fixed'] and cli.partition_by is None)
+        worker = run_task
+    parts = {}
+    for file_index, prefix, part, _, _ in tasks:
+        if part is not None and (cli.manifest is None or not cli.manifest.is_complete(file_index)):
+            parts[prefix] = (file_index, parts.get(prefix, (file_index, 0))[1] + 1)
+    if cli.manifest is not None:
+        tasks = pending_tasks(cli, tasks)
+    fixed = cli.output_format == 'fixed' and cli.partition_by is None
+    if fixed:
+        width = cli.record_layout().width
+        for prefix in parts:
+            fixed_width.preallocate(cli.file_path(prefix) + manifest.TEMP_SUFFIX, cli.data_lines * width)
+    logging.info('Scheduling {} tasks for {} files on {} processes'.format(len(tasks), len(prefixes), processes))
+
+    reports = multiprocessing.Queue() if monitor is not None else None
+    with Pool(processes=processes, initializer=_init_worker, initargs=(cli, reports)) as pool:
+        results = pool.imap_unordered(worker, tasks)
+        remaining = len(tasks)
+        while remaining:
+            try:
+                _, entries, snapshot = results.next(timeout=0.5)
+                remaining -= 1
+                if entries:
+                    cli.manifest.add(*entries)
+                if monitor is not None:
+                    monitor.update(snapshot)
+            except multiprocessing.TimeoutError:
+                pass
+            _drain_reports(reports, monitor)
+        _drain_reports(reports, monitor)
+
+    for prefix, (file_index, count) in parts.items():
+        path = cli.file_path(prefix)
+        if fixed:
+            os.replace(path + manifest.TEMP_SUFFIX, path)
+            fixed_width.write_index(path, cli.record_layout(), cli.data_lines)
+            if cli.manifest is not None:
+                cli.manifest.add(manifest.file_entry(path, cli.path, file_index, prefix, cli.seed, cli.data_lines))
+            continue
+        if cli.manifest is not None:
+            rows = sum(cli.manifest.part(part_path(path, part), part)['rows'] for part in range(count))
+        merge_parts(path, count)
+        if cli.manifest is not None:
+            cli.manifest.add(manifest.file_entry(path, cli.path, file_index, prefix, cli.seed, rows))
+    return prefixes
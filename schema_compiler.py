@@ -0,0 +1,494 @@
+import bisect
+import collections
+import datetime
+import functools
+import itertools
+import random
+import time
+import uuid
+
+import pools
+from schema_parser import EPOCH, EXPRESSION_FUNCTIONS, parse_expression, parse_field, parse_schema
+from seeding import DEFAULT_BASE_TIME, TIMESTAMP_SPAN, derive_seed
+
+""" Compiled schema plan
+
+The FieldNodes of the schema parser are compiled once into a tuple of
+FieldPlan entries. Each entry keeps the typed arguments of the node, with
+defaults filled from the base time, and a picklable generator callable
+taking a random source (the `random` module or a `random.Random` instance),
+so rows can be produced without touching the schema strings again. Seeded
+plans take timestamps and uuids from the random source too.
+
+Besides timestamp, str and int fields the plan supports float (uniform and
+normal), bool, date and datetime ranges with strftime formats, weighted
+choices, list choices, Zipf distributed integers and a null rate appended to
+any field as |nullable(rate).
+
+A dict value is a nested object compiled into its own plan, a list value
+[item, length] or [item, min_length, max_length] is an array of generated
+items. expr: fields are Python expressions over the other fields of the same
+object, evaluated after the random fields in dependency order, and int:unique
+fields map the row position through a keyed permutation of their range, so
+values never repeat within a run without remembering the generated ones.
+ref:table.field fields of multi table datasets compute the keys of parent
+rows from the unique sequence of the parent table. Random fields with a pool,
+str:rand(pool=n), timestamp:rand(pool=n) or any spec with a |pool(n) suffix,
+compile into choice fields over n values generated once.
+"""
+
+FieldPlan = collections.namedtuple('FieldPlan', ['key', 'type', 'kind', 'args', 'generate', 'null_rate'],
+                                   defaults=(0.0,))
+
+# Kinds of fields holding generated objects and arrays
+NESTED_KINDS = ('object', 'array')
+
+# Rounds and multiplier of the Feistel network permuting unique fields
+FEISTEL_ROUNDS = 4
+FEISTEL_MULTIPLIER = 0x9E3779B97F4A7C15
+MASK_64 = 2 ** 64 - 1
+
+_EXPRESSION_GLOBALS = dict(EXPRESSION_FUNCTIONS, __builtins__={})
+
+# Sample rows evaluated to infer the type of expression fields
+EXPRESSION_SAMPLE_ROWS = 16
+
+
+def _timestamp(rng):
+    """ Returning current timestamp as string """
+    return str(time.time())
+
+
+def _uuid(rng):
+    """ Returning random uuid4 as string """
+    return str(uuid.uuid4())
+
+
+def _seeded_timestamp(base_time, span, rng):
+    """ Returning fixed base time plus generated offset as string """
+    return str(base_time + rng.random() * span)
+
+
+def _seeded_uuid(rng):
+    """ Returning uuid4 built from the random source as string """
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _choice(values, rng):
+    """ Returning random value from the precomputed tuple """
+    return rng.choice(values)
+
+
+def _randint(low, high, rng):
+    """ Returning random integer from closed range """
+    return rng.randint(low, high)
+
+
+def _const(value, rng):
+    """ Returning constant value """
+    return value
+
+
+def _uniform(low, high, rng):
+    """ Returning uniformly distributed float from range """
+    return rng.uniform(low, high)
+
+
+def _normal(mean, std, rng):
+    """ Returning normally distributed float """
+    return rng.gauss(mean, std)
+
+
+def _normal_int(mean, std, rng):
+    """ Returning normally distributed integer """
+    return int(round(rng.gauss(mean, std)))
+
+
+def _weighted(values, cum_weights, rng):
+    """ Returning value picked with cumulative weights """
+    return values[min(bisect.bisect(cum_weights, rng.random() * cum_weights[-1]), len(values) - 1)]
+
+
+def _zipf(cum_weights, rng):
+    """ Returning Zipf distributed integer from 1 to the number of weights """
+    return min(bisect.bisect(cum_weights, rng.random() * cum_weights[-1]), len(cum_weights) - 1) + 1
+
+
+def _bool(probability, rng):
+    """ Returning true with provided probability """
+    return rng.random() < probability
+
+
+def _datetime(start, span, date_format, rng):
+    """ Returning formatted datetime from start epoch seconds plus random seconds up to span """
+    return (EPOCH + datetime.timedelta(seconds=start + rng.randint(0, span))).strftime(date_format)
+
+
+def _nullable(rate, generate, rng):
+    """ Returning None with provided rate, otherwise generated value """
+    return None if rng.random() < rate else generate(rng)
+
+
+def _object(plan, rng):
+    """ Returning nested object generated by its plan """
+    return plan.row(rng)
+
+
+def _array(generate, low, high, rng):
+    """ Returning list of generated items with length from closed range """
+    return [generate(rng) for _ in range(low if low == high else rng.randint(low, high))]
+
+
+class UniqueSequence:
+    """ Distinct integers of a closed range, the value of row n is a keyed permutation of n
+
+    The permutation is a Feistel network over the smallest even number of bits covering the range, values outside
+    the range are permuted again until they fall into it. Keys come from the run seed, the stream of the positions
+    and the field key, so parts of a file written by different processes continue the same sequence.
+    """
+
+    def __init__(self, key: str, low: int, high: int, salt: int = 0):
+        self.key = key
+        self.low = low
+        self.high = high
+        self.size = high - low + 1
+        # Unseeded plans get a random salt when compiled, shared by the workers through the pickled plan
+        self.salt = salt
+        self.half = max(1, ((self.size - 1).bit_length() + 1) // 2)
+        self.mask = (1 << self.half) - 1
+        self.stream = None
+        self.seek(0)
+
+    def __reduce__(self):
+        return UniqueSequence, (self.key, self.low, self.high, self.salt)
+
+    def set_salt(self, salt: int):
+        """ Replacing the salt, for processes compiling the same unseeded schema separately """
+        self.salt = salt
+        self.stream = None
+        self.seek(0)
+
+    def seek(self, position: int, seed=None, file_index=0):
+        """ Moving to the row position of the file, with the permutation keys of the file """
+        self.position = position
+        if self.stream != (seed, file_index):
+            self.stream = (seed, file_index)
+            self.round_keys = tuple(derive_seed(self.salt, seed, file_index, self.key, round_index) & MASK_64
+                                    for round_index in range(FEISTEL_ROUNDS))
+
+    def take(self, count: int):
+        """ Reserving the next count positions, returning the first, ValueError when the range is exhausted """
+        position = self.position
+        if position + count > self.size:
+            raise ValueError('Unique values of {} are exhausted after {} rows'.format(self.key, self.size))
+        self.position = position + count
+        return position
+
+    def permute(self, index: int):
+        """ Returning position of index in the permuted range """
+        half, mask, shift = self.half, self.mask, 64 - self.half
+        while True:
+            left, right = index >> half, index & mask
+            for round_key in self.round_keys:
+                left, right = right, left ^ (((right + round_key) * FEISTEL_MULTIPLIER & MASK_64) >> shift)
+            index = (left << half) | right
+            if index < self.size:
+                return index
+
+    def __call__(self, rng):
+        return self.low + self.permute(self.take(1))
+
+
+class ForeignKey:
+    """ Key of a parent table row, computed from the unique sequence of the parent instead of reading its files
+
+    The parent row is picked uniformly, Zipf distributed by row (a few parents get most children) or, with each,
+    from the child row position so every parent gets an equal contiguous run of children.
+    """
+
+    def __init__(self, key: str, table: str, field: str, cardinality: str = 'uniform', exponent: float = None):
+        self.key = key
+        self.table = table
+        self.field = field
+        self.cardinality = cardinality
+        self.exponent = exponent
+        self.parent = None
+        self.parent_rows = None
+        self.rows = None
+        self.position = 0
+
+    def bind(self, parent, parent_rows: int, rows: int):
+        """ Binding to the unique sequence of the parent key field, its table and the table of this field """
+        self.parent = UniqueSequence(parent.key, parent.low, parent.high, parent.salt)
+        self.parent_rows = parent_rows
+        self.rows = rows
+
+    def seek(self, position: int, seed=None, file_index=0):
+        """ Moving to the row position of the table, with the permutation keys of the parent table """
+        self.position = position
+        if self.parent is not None:
+            self.parent.seek(0, seed, self.table)
+
+    def take(self, count: int):
+        """ Reserving the next count row positions, returning the first """
+        position = self.position
+        self.position = position + count
+        return position
+
+    def zipf_index(self, uniform: float):
+        """ Returning parent row of a uniform number, inverse of the continuous Zipf distribution over the rows """
+        rows, exponent = self.parent_rows, self.exponent
+        if exponent == 1.0:
+            rank = (rows + 1) ** uniform
+        else:
+            rank = (1 + uniform * ((rows + 1) ** (1 - exponent) - 1)) ** (1 / (1 - exponent))
+        return min(int(rank), rows) - 1
+
+    def __call__(self, rng):
+        if self.parent is None:
+            raise ValueError('ref field {} is not bound to table {}'.format(self.key, self.table))
+        if self.cardinality == 'each':
+            index = self.take(1) * self.parent_rows // self.rows % self.parent_rows
+        elif self.cardinality == 'zipf':
+            index = self.zipf_index(rng.random())
+        else:
+            index = rng.randrange(self.parent_rows)
+        return self.parent.low + self.parent.permute(index)
+
+
+class Expression:
+    """ Compiled expression over the other fields of a row, pickled by its text """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.code, self.paths = parse_expression(text)
+        self.names = tuple(sorted({path[0] for path in self.paths}))
+
+    def __reduce__(self):
+        return Expression, (self.text,)
+
+    def evaluate(self, namespace: dict):
+        """ Returning value of the expression, raising errors of its operands """
+        return eval(self.code, _EXPRESSION_GLOBALS, namespace)
+
+    def __call__(self, namespace: dict):
+        """ Returning value of the expression, None when an operand is null or outside the domain of an operator """
+        try:
+            return eval(self.code, _EXPRESSION_GLOBALS, namespace)
+        except (ArithmeticError, IndexError, KeyError, TypeError, ValueError):
+            return None
+
+
+def field_counters(field):
+    """ Returning unique sequences and foreign keys of a field and its nested fields """
+    if field.kind in ('unique', 'ref'):
+        return (field.generate,)
+    if field.kind == 'object':
+        return field.args[0].counters
+    return ()
+
+
+def date_field(node, base_time: float = None):
+    """ Compiling date node to a choice of its formatted days and datetime node to a datetime field """
+    start, end, date_format = node.args
+    if start is None:
+        # One year from the base time of seeded runs
+        start = EPOCH + datetime.timedelta(seconds=int(DEFAULT_BASE_TIME if base_time is None else base_time))
+        end = start + datetime.timedelta(days=365)
+    if node.kind == 'date':
+        days = (end.date() - start.date()).days
+        values = tuple((start.date() + datetime.timedelta(days=day)).strftime(date_format) for day in range(days + 1))
+        return FieldPlan(node.key, 'date', 'choice', (values,), functools.partial(_choice, values))
+    offset = int((start - EPOCH).total_seconds())
+    span = int((end - start).total_seconds())
+    return FieldPlan(node.key, 'datetime', 'datetime', (offset, span, date_format),
+                     functools.partial(_datetime, offset, span, date_format))
+
+
+def compile_kind(node, seeded: bool = False, base_time: float = None, seed=None):
+    """ Compiling the generator of a parsed field without null rate and pool """
+    key, field_type, kind, args = node.key, node.type, node.kind, node.args
+    if kind == 'timestamp':
+        if seeded:
+            base_time = DEFAULT_BASE_TIME if base_time is None else base_time
+            return FieldPlan(key, 'timestamp', 'timestamp', (base_time, TIMESTAMP_SPAN),
+                             functools.partial(_seeded_timestamp, base_time, TIMESTAMP_SPAN))
+        return FieldPlan(key, 'timestamp', 'timestamp', (), _timestamp)
+    if kind == 'uuid':
+        return FieldPlan(key, 'str', 'uuid', (), _seeded_uuid if seeded else _uuid)
+    if kind == 'const':
+        return FieldPlan(key, field_type, 'const', args, functools.partial(_const, args[0]))
+    if kind == 'choice':
+        return FieldPlan(key, field_type, 'choice', args, functools.partial(_choice, args[0]))
+    if kind == 'weighted':
+        values, cum_weights = args[0], tuple(itertools.accumulate(args[1]))
+        return FieldPlan(key, field_type, 'weighted', (values, cum_weights),
+                         functools.partial(_weighted, values, cum_weights))
+    if kind == 'randint':
+        return FieldPlan(key, 'int', 'randint', args, functools.partial(_randint, *args))
+    if kind == 'uniform':
+        return FieldPlan(key, 'float', 'uniform', args, functools.partial(_uniform, *args))
+    if kind == 'normal':
+        return FieldPlan(key, field_type, 'normal', args,
+                         functools.partial(_normal_int if field_type == 'int' else _normal, *args))
+    if kind == 'zipf':
+        exponent, count = args
+        cum_weights = tuple(itertools.accumulate(1.0 / rank ** exponent for rank in range(1, count + 1)))
+        return FieldPlan(key, 'int', 'zipf', (exponent, count, cum_weights), functools.partial(_zipf, cum_weights))
+    if kind == 'bool':
+        return FieldPlan(key, 'bool', 'bool', args, functools.partial(_bool, *args))
+    if kind in ('date', 'datetime'):
+        return date_field(node, base_time)
+    if kind == 'unique':
+        low, high = args
+        sequence = UniqueSequence(key, low, high, 0 if seeded else random.getrandbits(64))
+        return FieldPlan(key, 'int', 'unique', (low, high, sequence), sequence)
+    if kind == 'ref':
+        foreign_key = ForeignKey(key, *args)
+        return FieldPlan(key, 'int', 'ref', args + (foreign_key,), foreign_key)
+    if kind == 'expr':
+        text, _, rank = args
+        # Typed from sample rows once the whole object is compiled
+        return FieldPlan(key, 'str', 'expr', (Expression(text), rank), functools.partial(_const, None))
+    if kind == 'object':
+        plan = compile_nodes(args[0], seeded, base_time, seed)
+        return FieldPlan(key, 'object', 'object', (plan,), functools.partial(_object, plan))
+    item = compile_node(args[0], seeded, base_time, seed)
+    low, high = args[1], args[2]
+    return FieldPlan(key, 'array', 'array', (item, low, high), functools.partial(_array, item.generate, low, high))
+
+
+def pool_field(node, base_time: float = None, seed=None):
+    """ Compiling a field picking from a pool of values generated once by the field spec """
+    if base_time is None and seed is None:
+        # Timestamps of unseeded pools cover the day before the run
+        base_time = time.time() - TIMESTAMP_SPAN
+    # Compiled as seeded so uuids and timestamps are drawn from the pool random source
+    field = compile_kind(node, True, base_time, seed)
+    values = pools.pool_values(node.key, node.text, node.pool, field.generate, seed, base_time)
+    return FieldPlan(node.key, field.type, 'choice', (values,), functools.partial(_choice, values))
+
+
+def compile_node(node, seeded: bool = False, base_time: float = None, seed=None):
+    """ Compiling a parsed field node into a FieldPlan """
+    if node.pool is None:
+        field = compile_kind(node, seeded, base_time, seed)
+    else:
+        field = pool_field(node, base_time, seed)
+    if not node.null_rate:
+        return field
+    return field._replace(generate=functools.partial(_nullable, node.null_rate, field.generate),
+                          null_rate=node.null_rate)
+
+
+def compile_field(key: str, value, seeded: bool = False, base_time: float = None, seed=None):
+    """ Compiling a single schema field, SchemaError when it is malformed """
+    return compile_node(parse_field(key, value), seeded, base_time, seed)
+
+
+class SchemaPlan:
+    """ Immutable per-field generator plan built once from a validated schema """
+    __slots__ = ('fields', 'keys', 'generators', 'expressions', 'counters')
+
+    def __init__(self, fields):
+        fields = tuple(fields)
+        object.__setattr__(self, 'fields', fields)
+        object.__setattr__(self, 'keys', tuple(field.key for field in fields))
+        object.__setattr__(self, 'generators', tuple(field.generate for field in fields))
+        # (index, expression) of expression fields in dependency order
+        expressions = sorted((field.args[1], index) for index, field in enumerate(fields) if field.kind == 'expr')
+        object.__setattr__(self, 'expressions', tuple((index, fields[index].args[0]) for _, index in expressions))
+        object.__setattr__(self, 'counters', tuple(itertools.chain.from_iterable(field_counters(field)
+                                                                                 for field in fields)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('SchemaPlan is immutable')
+
+    def __reduce__(self):
+        return SchemaPlan, (self.fields,)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def values(self, rng):
+        """ Generating a list of values in field order """
+        values = [generate(rng) for generate in self.generators]
+        if self.expressions:
+            self.evaluate(values)
+        return values
+
+    def row(self, rng):
+        """ Generating a single data line as dict """
+        if self.expressions:
+            return dict(zip(self.keys, self.values(rng)))
+        return dict(zip(self.keys, [generate(rng) for generate in self.generators]))
+
+    def evaluate(self, values: list):
+        """ Filling expression fields of generated values in dependency order """
+        keys = self.keys
+        namespace = dict(zip(keys, values))
+        for index, expression in self.expressions:
+            values[index] = namespace[keys[index]] = expression(namespace)
+        return values
+
+    def seek(self, position: int, seed=None, file_index=0):
+        """ Moving unique fields to the row position of the file """
+        for counter in self.counters:
+            counter.seek(position, seed, file_index)
+
+
+def expression_type(key: str, value):
+    """ Returning field type of a value produced by an expression """
+    for value_type, name in ((bool, 'bool'), (int, 'int'), (float, 'float'), (str, 'str')):
+        if isinstance(value, value_type):
+            return name
+    raise ValueError('Expression {} must produce a number, bool or string, not {}'.format(key, type(value).__name__))
+
+
+def type_expressions(fields: list):
+    """ Returning fields with expressions typed from sample rows, the parser has ranked them in dependency order """
+    expressions = {field.key: field for field in fields if field.kind == 'expr'}
+    if not expressions:
+        return fields
+
+    # Random fields of the samples come from a fixed stream, unique fields stay at the start of their range
+    plan = SchemaPlan(fields)
+    rng = random.Random(0)
+    types, errors = {}, {}
+    for _ in range(EXPRESSION_SAMPLE_ROWS):
+        plan.seek(0)
+        values = [generate(rng) for generate in plan.generators]
+        namespace = dict(zip(plan.keys, values))
+        for index, expression in plan.expressions:
+            key = plan.keys[index]
+            try:
+                namespace[key] = expression.evaluate(namespace)
+            except (ArithmeticError, IndexError, KeyError, TypeError, ValueError) as error:
+                namespace[key] = None
+                errors.setdefault(key, error)
+            if namespace[key] is not None and key not in types:
+                types[key] = expression_type(key, namespace[key])
+    plan.seek(0)
+    for key in expressions:
+        if key not in types and key in errors:
+            raise ValueError('Expression {} fails on generated rows: {}'.format(key, errors[key]))
+    return [field._replace(type=types.get(field.key, 'str')) if field.kind == 'expr' else field for field in fields]
+
+
+def compile_nodes(nodes: list, seeded: bool = False, base_time: float = None, seed=None):
+    """ Compiling parsed field nodes of an object into a SchemaPlan """
+    return SchemaPlan(type_expressions([compile_node(node, seeded, base_time, seed) for node in nodes]))
+
+
+def compile_schema(schema, seeded: bool = False, base_time: float = None, seed=None):
+    """ Compiling dict schema or its parsed nodes into a SchemaPlan, seeded plans draw all values from the rng
+
+    The seed of seeded runs keys the value pools of the schema. Malformed schemas raise SchemaError listing every
+    problem before anything is generated.
+    """
+    seeded = seeded or seed is not None
+    nodes = parse_schema(schema) if isinstance(schema, dict) else schema
+    return compile_nodes(nodes, seeded, base_time, seed)
@@ -0,0 +1,842 @@
+import ast
+import collections
+import datetime
+import functools
+import graphlib
+import re
+
+import pools
+
+""" Schema parser
+
+Every field value of the data schema is parsed once, in a single pass over
+its tokens, into a FieldNode: the field type, the kind of generator, its
+typed arguments and the null rate and pool size modifiers. Nested objects
+and arrays become nodes holding their item nodes. The compiler builds the
+generators from the nodes without reading the strings again.
+
+A value is 'type:spec' followed by optional |nullable(rate) and |pool(n)
+modifiers, a bare [...] list is a list: field. Timestamps take no values, a
+spec other than rand or rand(pool=n) is ignored with a warning as by the
+original grammar. Parsing does not stop at the first mistake, every field is
+checked and SchemaError lists all problems with the field path and the column
+of the offending token, so a malformed schema is rejected as a whole before
+any row is generated.
+"""
+
+FIELD_TYPES = ('timestamp', 'str', 'int', 'float', 'bool', 'date', 'datetime', 'list', 'expr', 'ref')
+
+MODIFIERS = ('nullable', 'pool')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+DATE_FORMAT = '%Y-%m-%d'
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Largest number of days of a date range, its formatted dates are precomputed
+MAX_DATE_DAYS = 1000000
+
+# Largest n of int:zipf(s, n), its cumulative weights are precomputed
+MAX_ZIPF_VALUES = 10000000
+
+# Range of int:unique without bounds, positive int64 values
+UNIQUE_RANGE = (1, 2 ** 63 - 1)
+
+# How ref: fields pick parent rows, uniformly, Zipf distributed or in contiguous runs of equal length
+CARDINALITIES = ('uniform', 'zipf', 'each')
+
+# Functions expressions may call
+EXPRESSION_FUNCTIONS = {'abs': abs, 'bool': bool, 'float': float, 'int': int, 'len': len, 'lower': str.lower,
+                        'max': max, 'min': min, 'round': round, 'str': str, 'upper': str.upper}
+
+# Syntax allowed in expressions, anything else is rejected when the schema is parsed
+EXPRESSION_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call, ast.Name,
+                    ast.Load, ast.Constant, ast.Attribute, ast.Subscript, ast.Tuple, ast.List, ast.operator,
+                    ast.unaryop, ast.boolop, ast.cmpop)
+
+TOKEN_REGEX = re.compile(r'''
+    (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<unterminated>['"])
+  | (?P<date>\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?)
+  | (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<name>[A-Za-z_][A-Za-z_0-9]*)
+  | (?P<format>%[^\s,()\[\]{}|'"]*)
+  | (?P<punct>[()\[\]{},:|=.])
+  | (?P<space>\s+)
+  | (?P<other>.)
+''', re.VERBOSE | re.DOTALL)
+
+BRACKETS = {'(': ')', '[': ']', '{': '}'}
+
+Token = collections.namedtuple('Token', ['kind', 'text', 'position'])
+
+# Typed arguments of a field, kind names the generator built by the compiler
+FieldNode = collections.namedtuple('FieldNode', ['key', 'type', 'kind', 'args', 'null_rate', 'pool', 'text'],
+                                   defaults=(0.0, None, ''))
+
+# Field path, 0 based column in the value (None for the value as a whole), message and the value itself
+SchemaProblem = collections.namedtuple('SchemaProblem', ['path', 'position', 'message', 'value'])
+
+
+class SpecError(ValueError):
+    """ Problem of one field value at a column """
+
+    def __init__(self, message: str, position: int = None):
+        super().__init__(message)
+        self.message = message
+        self.position = position
+
+
+class SchemaError(ValueError):
+    """ All problems of a schema """
+
+    def __init__(self, problems: list):
+        self.problems = problems
+        super().__init__('; '.join(describe_problem(problem) for problem in problems))
+
+
+def describe_problem(problem):
+    """ Returning one line description of a schema problem """
+    if problem.position is None:
+        return '{}: {}'.format(problem.path, problem.message)
+    return '{} at column {}: {}'.format(problem.path, problem.position + 1, problem.message)
+
+
+def point_problem(problem):
+    """ Returning the value of a schema problem with a caret under the offending column, empty without a column """
+    if problem.position is None or not isinstance(problem.value, str):
+        return ''
+    return '{}\n{}^'.format(problem.value, ' ' * problem.position)
+
+
+def tokenize(text: str, start: int = 0, end: int = None):
+    """ Returning tokens of text[start:end] with positions in text, SpecError for unterminated strings """
+    tokens = []
+    for match in TOKEN_REGEX.finditer(text, start, len(text) if end is None else end):
+        kind = match.lastgroup
+        if kind == 'space':
+            continue
+        if kind == 'unterminated':
+            raise SpecError('unterminated string', match.start())
+        tokens.append(Token(kind, match.group(), match.start()))
+    return tokens
+
+
+def token_end(token):
+    """ Returning position after the token """
+    return token.position + len(token.text)
+
+
+def string_value(token):
+    """ Returning value of a quoted string token """
+    try:
+        return ast.literal_eval(token.text)
+    except (ValueError, SyntaxError):
+        raise SpecError('invalid string {}'.format(token.text), token.position)
+
+
+def number_value(token):
+    """ Returning int or float value of a number token """
+    try:
+        return int(token.text)
+    except ValueError:
+        return float(token.text)
+
+
+# Expressions parsed by the schema pass are compiled from the cache
+@functools.lru_cache(maxsize=1024)
+def parse_expression(text: str):
+    """ Returning code object of an expression and the field paths it refers to, attributes read nested objects """
+    try:
+        tree = ast.parse(text.strip(), mode='eval')
+    except SyntaxError as error:
+        raise SpecError('invalid expression: {}'.format(error.msg), max(0, (error.offset or 1) - 1))
+    paths = []
+    for node in ast.walk(tree):
+        position = getattr(node, 'col_offset', None)
+        if not isinstance(node, EXPRESSION_NODES):
+            raise SpecError('expression uses unsupported syntax {}'.format(type(node).__name__), position)
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.func.id not in
+                                           EXPRESSION_FUNCTIONS or node.keywords):
+            raise SpecError('expressions may only call {}'.format(', '.join(sorted(EXPRESSION_FUNCTIONS))), position)
+        if isinstance(node, ast.Attribute) and node.attr.startswith('_') or \
+                isinstance(node, ast.Name) and node.id.startswith('_'):
+            raise SpecError('expression refers to a private name', position)
+    functions = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    for node in ast.walk(tree):
+        # Only the outermost attribute of a chain like user.address.city records its path
+        if isinstance(node, ast.Attribute):
+            chain = [node.attr]
+            value = node.value
+            while isinstance(value, ast.Attribute):
+                chain.append(value.attr)
+                value = value.value
+            if isinstance(value, ast.Name):
+                paths.append(tuple([value.id] + chain[::-1]))
+        elif isinstance(node, ast.Name) and id(node) not in functions:
+            paths.append((node.id,))
+    paths = [path for path in paths if not any(other[:len(path)] == path and len(other) > len(path)
+                                               for other in paths)]
+    tree = ast.fix_missing_locations(_AttributeItems().visit(tree))
+    return compile(tree, '<expr>', 'eval'), tuple(sorted(set(paths)))
+
+
+class _AttributeItems(ast.NodeTransformer):
+    """ Rewriting attribute access user.name to item access user['name'] of the generated nested object """
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        return ast.copy_location(ast.Subscript(value=node.value, slice=ast.Constant(node.attr), ctx=ast.Load()), node)
+
+
+class SpecParser:
+    """ Recursive descent parser over the spec tokens of one field value """
+
+    def __init__(self, text: str, tokens: list, start: int, end: int):
+        self.text = text
+        self.tokens = tokens
+        self.index = 0
+        self.start = start
+        self.end = end
+
+    def peek(self, offset: int = 0):
+        """ Returning token at offset from the current one, None past the end """
+        index = self.index + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def advance(self):
+        """ Returning current token and moving to the next one """
+        token = self.peek()
+        if token is None:
+            raise SpecError('unexpected end of value', self.end)
+        self.index += 1
+        return token
+
+    def accept(self, text: str):
+        """ Moving past the current token when it is text, returning true if it was """
+        token = self.peek()
+        if token is not None and token.text == text and token.kind in ('punct', 'name'):
+            self.index += 1
+            return True
+        return False
+
+    def expect(self, text: str):
+        """ Moving past the current token, SpecError when it is not text """
+        token = self.peek()
+        if not self.accept(text):
+            raise SpecError('expected {!r}'.format(text), self.end if token is None else token.position)
+
+    def at_end(self):
+        """ Returning true when all tokens are consumed """
+        return self.index >= len(self.tokens)
+
+    def finish(self):
+        """ SpecError when tokens are left after the spec """
+        token = self.peek()
+        if token is not None:
+            raise SpecError('unexpected {!r}'.format(token.text), token.position)
+
+    def is_call(self, name: str = None):
+        """ Returning true if the current tokens are a name followed by '(' """
+        token, following = self.peek(), self.peek(1)
+        return (token is not None and token.kind == 'name' and (name is None or token.text == name)
+                and following is not None and following.text == '(')
+
+    def is_name(self, *names):
+        """ Returning true if the remaining spec is exactly one of the names """
+        token = self.peek()
+        return token is not None and token.kind == 'name' and token.text in names and self.index == len(self.tokens) - 1
+
+    def group(self, closing: str):
+        """ Returning lists of tokens of the comma separated items before the closing bracket, consuming it """
+        opening = self.tokens[self.index - 1]
+        items, item, depth = [], [], []
+        while True:
+            token = self.peek()
+            if token is None:
+                raise SpecError('{!r} is never closed'.format(opening.text), opening.position)
+            self.index += 1
+            if token.kind == 'punct':
+                if token.text in BRACKETS:
+                    depth.append(BRACKETS[token.text])
+                elif depth and token.text == depth[-1]:
+                    depth.pop()
+                elif not depth and token.text == closing:
+                    # A trailing comma adds no item
+                    if item:
+                        items.append(item)
+                    return items
+                elif not depth and token.text == ',':
+                    items.append(item)
+                    item = []
+                    continue
+                elif token.text in BRACKETS.values():
+                    raise SpecError('unexpected {!r}'.format(token.text), token.position)
+            item.append(token)
+
+    def item_value(self, tokens: list, position: int):
+        """ Returning (value, kind, position) of a list or call item, raw source text for several tokens """
+        if not tokens:
+            raise SpecError('empty item', position)
+        first = tokens[0]
+        if len(tokens) == 1:
+            if first.kind == 'string':
+                return string_value(first), 'string', first.position
+            if first.kind == 'number':
+                return number_value(first), 'number', first.position
+            return first.text, first.kind, first.position
+        return self.text[first.position:token_end(tokens[-1])].strip(), 'raw', first.position
+
+    def call(self):
+        """ Parsing name(arguments), returning (name token, positional items, keyword items) """
+        name = self.advance()
+        self.expect('(')
+        opening = self.tokens[self.index - 1]
+        arguments, keywords = [], {}
+        for tokens in self.group(')'):
+            position = tokens[0].position if tokens else opening.position + 1
+            if len(tokens) > 2 and tokens[0].kind == 'name' and tokens[1].text == '=':
+                keywords[tokens[0].text] = self.item_value(tokens[2:], tokens[1].position + 1)
+            else:
+                if keywords:
+                    raise SpecError('positional argument after keyword argument', position)
+                arguments.append(self.item_value(tokens, position))
+        return name, arguments, keywords
+
+    def list_items(self):
+        """ Parsing [item, ...], returning (value, kind, position) of the items """
+        opening = self.advance()
+        return [self.item_value(tokens, tokens[0].position if tokens else opening.position + 1)
+                for tokens in self.group(']')]
+
+    def raw(self):
+        """ Returning source text of the remaining tokens and consuming them """
+        if self.at_end():
+            return ''
+        first = self.tokens[self.index]
+        self.index = len(self.tokens)
+        return self.text[first.position:token_end(self.tokens[-1])].strip()
+
+
+def number_argument(item, name: str, integer: bool = False):
+    """ Returning number of a call argument, SpecError when it is not one """
+    value, kind, position = item
+    if kind != 'number' or (integer and not isinstance(value, int)):
+        raise SpecError('{} arguments must be {}'.format(name, 'integers' if integer else 'numbers'), position)
+    return value
+
+
+def call_numbers(parser, name: str, count: int, integer: bool = False):
+    """ Parsing name(a, b, ...) with count number arguments, returning them and the keyword arguments """
+    token, arguments, keywords = parser.call()
+    if len(arguments) != count:
+        raise SpecError('{} takes {} arguments, got {}'.format(name, count, len(arguments)), token.position)
+    return [number_argument(item, name, integer) for item in arguments], keywords
+
+
+def check_keywords(keywords: dict, allowed: tuple = ()):
+    """ SpecError for keyword arguments other than the allowed ones """
+    for name, (_, _, position) in keywords.items():
+        if name not in allowed:
+            raise SpecError('unknown argument {!r}'.format(name), position)
+
+
+def pool_argument(keywords: dict):
+    """ Returning pool size of a pool=n call argument, None without one """
+    check_keywords(keywords, ('pool',))
+    if 'pool' not in keywords:
+        return None
+    return pool_size(keywords['pool'])
+
+
+def pool_size(item):
+    """ Returning checked pool size """
+    value, kind, position = item
+    if kind != 'number' or not isinstance(value, int) or not 1 <= value <= pools.MAX_POOL_VALUES:
+        raise SpecError('pool size must be an integer between 1 and {}'.format(pools.MAX_POOL_VALUES), position)
+    return value
+
+
+def weights_argument(parser, field_type: str):
+    """ Parsing {'value': weight, ...} into values and weights """
+    opening = parser.peek()
+    parser.advance()
+    parser.group('}')
+    text = parser.text[opening.position:token_end(parser.tokens[parser.index - 1])]
+    try:
+        weights = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        raise SpecError('invalid weighted choice, expected {\'value\': weight, ...}', opening.position)
+    if not isinstance(weights, dict) or not weights:
+        raise SpecError('weighted choice must be a non empty dict', opening.position)
+    if any(not isinstance(weight, (int, float)) or isinstance(weight, bool) or weight < 0
+           for weight in weights.values()) or sum(weights.values()) <= 0:
+        raise SpecError('weights must be non negative numbers with a positive sum', opening.position)
+    expected = int if field_type == 'int' else str
+    if any(not isinstance(value, expected) or isinstance(value, bool) for value in weights):
+        raise SpecError('{} weighted choice values must be {}'.format(field_type, expected.__name__),
+                        opening.position)
+    return tuple(weights), tuple(float(weight) for weight in weights.values())
+
+
+def list_choice(parser, field_type: str):
+    """ Parsing [...] into choice values of the field type, list fields take ints when all items are ints """
+    opening = parser.peek()
+    items = parser.list_items()
+    if not items:
+        raise SpecError('list has no values', opening.position)
+    if field_type == 'int' or field_type == 'list' and all(is_int_item(item) for item in items):
+        values = []
+        for item in items:
+            if not is_int_item(item):
+                raise SpecError('int list items must be integers', item[2])
+            values.append(int(item[0]))
+        return tuple(values)
+    return tuple(str(value) for value, _, _ in items)
+
+
+def is_int_item(item):
+    """ Returning true if a list item is an integer, quoted or not """
+    value, kind, _ = item
+    if kind == 'number':
+        return isinstance(value, int)
+    return kind == 'string' and re.fullmatch(r'[-+]?\d+', value.strip()) is not None
+
+
+def parse_timestamp(parser, key: str):
+    """ Parsing timestamp: and timestamp:rand(pool=n), the text of any other spec is kept in args to be ignored """
+    if parser.at_end() or parser.is_name('rand'):
+        return 'timestamp', (), None
+    if parser.is_call('rand'):
+        try:
+            _, arguments, keywords = parser.call()
+        except SpecError:
+            arguments, keywords = None, {}
+        if arguments == [] and set(keywords) <= {'pool'} and parser.at_end():
+            return 'timestamp', (), pool_argument(keywords)
+    # As by the original grammar, timestamps take no values and the rest of the spec is ignored with a warning
+    parser.index = 0
+    return 'timestamp', (parser.raw(),), None
+
+
+def parse_str(parser, key: str):
+    """ Parsing str:rand, str:[...], str:{...}, str:'constant', str:constant and str: """
+    token = parser.peek()
+    if token is None:
+        return 'const', ('',), None
+    if parser.is_call('rand'):
+        _, arguments, keywords = parser.call()
+        if arguments:
+            raise SpecError('str:rand takes only a pool argument', arguments[0][2])
+        parser.finish()
+        return 'uuid', (), pool_argument(keywords)
+    if parser.is_name('rand'):
+        parser.advance()
+        return 'uuid', (), None
+    if token.text == '[':
+        values = list_choice(parser, 'str')
+        parser.finish()
+        return 'choice', (values,), None
+    if token.text == '{':
+        values, weights = weights_argument(parser, 'str')
+        parser.finish()
+        return 'weighted', (values, weights), None
+    if token.kind == 'string' and len(parser.tokens) == 1:
+        parser.advance()
+        return 'const', (string_value(token),), None
+    return 'const', (parser.raw(),), None
+
+
+def parse_int(parser, key: str):
+    """ Parsing int:rand, int:rand(low, high), int:unique, int:normal, int:zipf, int:[...], int:{...} and int:n """
+    token = parser.peek()
+    if token is None:
+        return 'const', ('None',), None
+    if parser.is_name('rand'):
+        parser.advance()
+        return 'randint', (0, 100), None
+    if parser.is_name('unique'):
+        parser.advance()
+        return 'unique', UNIQUE_RANGE, None
+    if parser.is_call('rand') or parser.is_call('unique'):
+        (low, high), keywords = call_numbers(parser, token.text, 2, integer=True)
+        if high < low:
+            raise SpecError('{} range ends before it starts'.format(token.text), token.position)
+        parser.finish()
+        if token.text == 'unique':
+            check_keywords(keywords)
+            return 'unique', (low, high), None
+        return 'randint', (low, high), pool_argument(keywords)
+    if parser.is_call('normal'):
+        (mean, deviation), keywords = call_numbers(parser, 'normal', 2)
+        if deviation < 0:
+            raise SpecError('normal standard deviation must not be negative', token.position)
+        parser.finish()
+        return 'normal', (float(mean), float(deviation)), pool_argument(keywords)
+    if parser.is_call('zipf'):
+        (exponent, count), keywords = call_numbers(parser, 'zipf', 2)
+        if exponent <= 0 or count != int(count) or not 1 <= count <= MAX_ZIPF_VALUES:
+            raise SpecError('zipf(s, n) needs s > 0 and an integer 1 <= n <= {}'.format(MAX_ZIPF_VALUES),
+                            token.position)
+        parser.finish()
+        return 'zipf', (float(exponent), int(count)), pool_argument(keywords)
+    if token.text == '[':
+        values = list_choice(parser, 'int')
+        parser.finish()
+        return 'choice', (values,), None
+    if token.text == '{':
+        values, weights = weights_argument(parser, 'int')
+        parser.finish()
+        return 'weighted', (values, weights), None
+    if token.kind == 'number' and isinstance(number_value(token), int) and len(parser.tokens) == 1:
+        parser.advance()
+        return 'const', (number_value(token),), None
+    raise SpecError('invalid int spec, expected rand, rand(low, high), unique, normal(mean, std), zipf(s, n), '
+                    '[...], {...} or an integer', token.position)
+
+
+def parse_float(parser, key: str):
+    """ Parsing float:, float:rand, float:rand(low, high), float:normal(mean, std) and float:n """
+    token = parser.peek()
+    if token is None:
+        return 'const', (None,), None
+    if parser.is_name('rand'):
+        parser.advance()
+        return 'uniform', (0.0, 1.0), None
+    for name, kind in (('rand', 'uniform'), ('normal', 'normal')):
+        if parser.is_call(name):
+            numbers, keywords = call_numbers(parser, name, 2)
+            if kind == 'normal' and numbers[1] < 0:
+                raise SpecError('normal standard deviation must not be negative', token.position)
+            parser.finish()
+            return kind, tuple(float(number) for number in numbers), pool_argument(keywords)
+    if token.kind == 'number' and len(parser.tokens) == 1:
+        parser.advance()
+        return 'const', (float(token.text),), None
+    raise SpecError('invalid float spec, expected rand, rand(low, high), normal(mean, std) or a number',
+                    token.position)
+
+
+def parse_bool(parser, key: str):
+    """ Parsing bool:, bool:rand, bool:true, bool:false and bool:probability """
+    token = parser.peek()
+    if token is None or parser.is_name('rand'):
+        parser.index = len(parser.tokens)
+        return 'bool', (0.5,), None
+    if token.kind == 'name' and token.text.lower() in ('true', 'false') and len(parser.tokens) == 1:
+        parser.advance()
+        return 'const', (token.text.lower() == 'true',), None
+    if token.kind == 'number' and len(parser.tokens) == 1:
+        parser.advance()
+        probability = float(token.text)
+        if not 0.0 <= probability <= 1.0:
+            raise SpecError('bool probability must be between 0 and 1', token.position)
+        return 'bool', (probability,), None
+    raise SpecError('invalid bool spec, expected bool:, bool:0.3, bool:true or bool:false', token.position)
+
+
+def date_argument(item, field_type: str):
+    """ Returning datetime of an ISO date argument """
+    value, kind, position = item
+    try:
+        return datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        raise SpecError('invalid {} {!r}, expected ISO format like 2023-01-31 or 2023-01-31T12:00:00'.format(
+            field_type, value), position)
+
+
+def parse_date(parser, key: str, field_type: str):
+    """ Parsing date:rand(start, end, format) and datetime:rand(start, end, format), the range defaults to a year """
+    token = parser.peek()
+    date_format = DATE_FORMAT if field_type == 'date' else DATETIME_FORMAT
+    start = end = None
+    pool = None
+    if token is None or parser.is_name('rand'):
+        parser.index = len(parser.tokens)
+        return field_type, (start, end, date_format), None
+    if not parser.is_call('rand'):
+        raise SpecError('{} must be {}:rand(start, end) or {}:rand(start, end, format)'.format(
+            field_type, field_type, field_type), token.position)
+    _, arguments, keywords = parser.call()
+    pool = pool_argument(keywords)
+    if len(arguments) not in (0, 2, 3):
+        raise SpecError('{}:rand takes start, end and an optional format'.format(field_type), token.position)
+    if len(arguments) == 3:
+        date_format, _, position = arguments[2]
+        date_format = str(date_format)
+        if not date_format.isascii() or not date_format.isprintable() or '"' in date_format or '\\' in date_format:
+            raise SpecError('date format must be printable ASCII without quotes or backslashes', position)
+    if arguments:
+        start, end = date_argument(arguments[0], field_type), date_argument(arguments[1], field_type)
+        if end < start:
+            raise SpecError('{} range ends before it starts'.format(field_type), arguments[1][2])
+        if field_type == 'date' and (end.date() - start.date()).days >= MAX_DATE_DAYS:
+            raise SpecError('date range is longer than {} days'.format(MAX_DATE_DAYS), arguments[1][2])
+    parser.finish()
+    return field_type, (start, end, date_format), pool
+
+
+def parse_list_field(parser, key: str):
+    """ Parsing list:[...] """
+    token = parser.peek()
+    if token is None or token.text != '[':
+        raise SpecError('invalid list spec, expected list:[...]', parser.end if token is None else token.position)
+    values = list_choice(parser, 'list')
+    parser.finish()
+    return 'choice', (values,), None
+
+
+def parse_reference(parser, key: str):
+    """ Parsing ref:table.field, ref:table.field:zipf(s) and ref:table.field:each """
+    token = parser.peek()
+    if token is None or token.kind != 'name' or parser.peek(1) is None or parser.peek(1).text != '.' \
+            or parser.peek(2) is None or parser.peek(2).kind != 'name':
+        raise SpecError('ref must name a table field like ref:customers.id',
+                        parser.end if token is None else token.position)
+    table, _, field = parser.advance().text, parser.advance(), parser.advance().text
+    cardinality, exponent = 'uniform', None
+    if parser.accept(':'):
+        following = parser.peek()
+        if parser.is_call('zipf'):
+            (exponent,), keywords = call_numbers(parser, 'zipf', 1)
+            check_keywords(keywords)
+            if exponent <= 0:
+                raise SpecError('zipf exponent must be greater than 0', following.position)
+            cardinality, exponent = 'zipf', float(exponent)
+        elif following is not None and following.kind == 'name' and following.text in ('uniform', 'each'):
+            cardinality = parser.advance().text
+        else:
+            raise SpecError('cardinality must be one of uniform, each or zipf(s)',
+                            parser.end if following is None else following.position)
+    parser.finish()
+    return 'ref', (table, field, cardinality, exponent), None
+
+
+def parse_expr(parser, key: str):
+    """ Parsing expr: Python expression over the other fields """
+    text = parser.text[parser.start:parser.end]
+    offset = parser.start + len(text) - len(text.lstrip())
+    if not text.strip():
+        raise SpecError('expression is empty', parser.start)
+    try:
+        _, paths = parse_expression(text.strip())
+    except SpecError as error:
+        raise SpecError(error.message, offset + (error.position or 0))
+    parser.index = len(parser.tokens)
+    return 'expr', (text.strip(), paths), None
+
+
+SPEC_PARSERS = {'timestamp': parse_timestamp, 'str': parse_str, 'int': parse_int, 'float': parse_float,
+                'bool': parse_bool, 'date': lambda parser, key: parse_date(parser, key, 'date'),
+                'datetime': lambda parser, key: parse_date(parser, key, 'datetime'), 'list': parse_list_field,
+                'expr': parse_expr, 'ref': parse_reference}
+
+
+def split_modifiers(text: str, tokens: list, field_type: str):
+    """ Returning spec tokens and (name, argument, position) of the trailing |nullable(rate) and |pool(n) modifiers """
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token.kind == 'punct' and token.text in BRACKETS:
+            depth += 1
+        elif token.kind == 'punct' and token.text in BRACKETS.values():
+            depth -= 1
+        elif depth == 0 and token.text == '|':
+            try:
+                return tokens[:index], parse_modifiers(text, tokens[index:])
+            except SpecError:
+                # A | of an expression is an operator unless modifiers follow it
+                if field_type != 'expr':
+                    raise
+    return tokens, []
+
+
+def parse_modifiers(text: str, tokens: list):
+    """ Parsing a chain of |name(argument) modifiers """
+    parser = SpecParser(text, tokens, tokens[0].position, token_end(tokens[-1]))
+    modifiers = []
+    while not parser.at_end():
+        parser.expect('|')
+        token = parser.peek()
+        if token is None or token.kind != 'name' or token.text not in MODIFIERS:
+            raise SpecError('unknown modifier, expected |nullable(rate) or |pool(n)',
+                            parser.end if token is None else token.position)
+        if not parser.is_call():
+            raise SpecError('{} needs an argument like |{}(...)'.format(token.text, token.text), token.position)
+        _, arguments, keywords = parser.call()
+        check_keywords(keywords)
+        if len(arguments) != 1:
+            raise SpecError('{} takes one argument'.format(token.text), token.position)
+        if any(name == token.text for name, _, _ in modifiers):
+            raise SpecError('{} is given twice'.format(token.text), token.position)
+        modifiers.append((token.text, arguments[0], token.position))
+    return modifiers
+
+
+def parse_value(key: str, value: str):
+    """ Parsing a 'type:spec|modifiers' value into a FieldNode, SpecError at the first problem """
+    stripped = value.lstrip()
+    if stripped.startswith('['):
+        # A bare list is a list: field
+        field_type, start = 'list', len(value) - len(stripped)
+    else:
+        colon = value.find(':')
+        type_text = value if colon < 0 else value[:colon]
+        field_type = type_text.strip()
+        if field_type not in FIELD_TYPES:
+            raise SpecError('unknown type {!r}, expected one of {}'.format(field_type, ', '.join(FIELD_TYPES)),
+                            len(type_text) - len(type_text.lstrip()))
+        start = len(value) if colon < 0 else colon + 1
+    tokens, modifiers = split_modifiers(value, tokenize(value, start), field_type)
+    end = token_end(tokens[-1]) if tokens else start
+    # Empty trailing segments like str:rand: are ignored, as by the original grammar
+    while field_type != 'expr' and tokens and tokens[-1].text == ':' and tokens[-1].kind == 'punct':
+        tokens = tokens[:-1]
+    parser = SpecParser(value, tokens, start, end)
+    kind, args, pool = SPEC_PARSERS[field_type](parser, key)
+    if field_type == 'list':
+        # List fields hold ints when all items are ints, strings otherwise
+        field_type = 'int' if isinstance(args[0][0], int) else 'str'
+    null_rate = 0.0
+    for name, argument, position in modifiers:
+        if name == 'nullable':
+            if argument[1] != 'number' or not 0.0 <= argument[0] <= 1.0:
+                raise SpecError('null rate must be a number between 0 and 1', argument[2])
+            if kind in ('expr', 'unique', 'ref'):
+                raise SpecError('{} fields can not be nullable'.format(kind), position)
+            null_rate = float(argument[0])
+        else:
+            if pool is not None:
+                raise SpecError('pool is given twice', position)
+            pool = pool_size(argument)
+    if pool is not None and kind in ('const', 'expr', 'unique', 'ref'):
+        raise SpecError('{} fields can not have a pool, only fields with random values can'.format(kind),
+                        modifiers[-1][2] if modifiers else start)
+    return FieldNode(key, field_type, kind, args, null_rate, pool, value[:end].strip())
+
+
+def parse_array(key: str, value: list, path: str, problems: list):
+    """ Parsing [item, length] or [item, min_length, max_length] into an array node, None when it is invalid """
+    lengths = value[1:]
+    if len(lengths) not in (1, 2) or any(not isinstance(length, int) or isinstance(length, bool) or length < 0
+                                         for length in lengths) or lengths[-1] < lengths[0]:
+        problems.append(SchemaProblem(path, None, 'arrays must be [item, length] or [item, min_length, max_length]',
+                                      value))
+        return None
+    item = parse_field(key, value[0], path + '[]', problems)
+    if item is None:
+        return None
+    if item.kind in ('expr', 'unique', 'ref') or contains_counters(item):
+        problems.append(SchemaProblem(path, None, 'array items can not be expressions, unique or ref fields', value))
+        return None
+    return FieldNode(key, 'array', 'array', (item, lengths[0], lengths[-1]))
+
+
+def ignored_specs(nodes: list, path: str = ''):
+    """ Yielding (path, value) of the timestamp fields whose spec is ignored, nested fields included """
+    for node in nodes:
+        field_path = join_path(path, node.key)
+        if node.kind == 'timestamp' and node.args:
+            yield field_path, node.text
+        elif node.kind == 'object':
+            yield from ignored_specs(node.args[0], field_path)
+        elif node.kind == 'array':
+            yield from ignored_specs([node.args[0]], field_path + '[]')
+
+
+def contains_counters(node):
+    """ Returning true if the node or its nested nodes are unique or ref fields """
+    if node.kind in ('unique', 'ref'):
+        return True
+    if node.kind == 'object':
+        return any(contains_counters(child) for child in node.args[0])
+    return False
+
+
+def parse_field(key: str, value, path: str = None, problems: list = None):
+    """ Parsing one schema value into a FieldNode, appending problems or raising SchemaError without a list """
+    path = key if path is None else path
+    collected = [] if problems is None else problems
+    node = None
+    if isinstance(value, dict):
+        children = parse_nodes(value, path, collected)
+        node = FieldNode(key, 'object', 'object', (tuple(children),))
+    elif isinstance(value, list):
+        node = parse_array(key, value, path, collected)
+    elif isinstance(value, str):
+        try:
+            node = parse_value(key, value)
+        except SpecError as error:
+            collected.append(SchemaProblem(path, error.position, error.message, value))
+    else:
+        collected.append(SchemaProblem(path, None, "values must be 'type:spec' strings, objects or arrays", value))
+    if problems is None and collected:
+        raise SchemaError(collected)
+    return node
+
+
+def check_expressions(nodes: list, path: str, problems: list):
+    """ Checking field references of the expressions of an object and ranking them in dependency order """
+    expressions = {node.key: node for node in nodes if node.kind == 'expr'}
+    if not expressions:
+        return nodes
+    by_key = {node.key: node for node in nodes}
+    valid = True
+    for node in expressions.values():
+        for reference in node.args[1]:
+            message = reference_problem(reference, by_key)
+            if message is not None:
+                problems.append(SchemaProblem(join_path(path, node.key), None, message, node.text))
+                valid = False
+    graph = {key: {name for path_ in node.args[1] for name in path_[:1] if name in expressions}
+             for key, node in expressions.items()}
+    try:
+        order = list(graphlib.TopologicalSorter(graph).static_order())
+    except graphlib.CycleError as error:
+        problems.append(SchemaProblem(path or '<schema>', None, 'expressions refer to each other in a cycle: {}'.format(
+            ' -> '.join(error.args[1])), None))
+        return nodes
+    if not valid:
+        return nodes
+    return [node._replace(args=node.args + (order.index(node.key),)) if node.kind == 'expr' else node
+            for node in nodes]
+
+
+def reference_problem(reference: tuple, nodes: dict):
+    """ Returning problem of an expression path that does not lead to a field, None when it does """
+    node = nodes.get(reference[0])
+    if node is None:
+        return 'expression refers to unknown field {}'.format(reference[0])
+    for depth, name in enumerate(reference[1:], 1):
+        if node.kind != 'object':
+            return 'expression reads {} of {}, which is not an object'.format(name, '.'.join(reference[:depth]))
+        node = {child.key: child for child in node.args[0]}.get(name)
+        if node is None:
+            return 'expression refers to unknown field {}'.format('.'.join(reference[:depth + 1]))
+    return None
+
+
+def join_path(path: str, key: str):
+    """ Returning dotted path of a key in the object at path """
+    return key if not path else '{}.{}'.format(path, key)
+
+
+def parse_nodes(schema: dict, path: str, problems: list):
+    """ Parsing the fields of an object, appending problems of every field """
+    nodes = []
+    for key, value in schema.items():
+        node = parse_field(key, value, join_path(path, key), problems)
+        if node is not None:
+            nodes.append(node)
+    return check_expressions(nodes, path, problems)
+
+
+def parse_schema(schema: dict):
+    """ Parsing every field of the schema into FieldNodes, SchemaError listing the problems of all fields """
+    if not isinstance(schema, dict):
+        raise SchemaError([SchemaProblem('<schema>', None, 'data schema must be a JSON object', schema)])
+    problems = []
+    nodes = parse_nodes(schema, '', problems)
+    if problems:
+        raise SchemaError(problems)
+    return nodes
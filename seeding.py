@@ -0,0 +1,41 @@
+import hashlib
+
+""" Deterministic seed derivation
+
+Every file and every row chunk gets its own stream derived from the root
+seed, so output does not depend on how the work is split between processes.
+"""
+
+# Rows generated from one derived stream, splits between workers happen on these boundaries
+CHUNK_ROWS = 65536
+
+# Base time of timestamps in seeded runs, 2023-01-01 00:00:00 UTC
+DEFAULT_BASE_TIME = 1672531200.0
+
+# Seeded timestamps are spread over one day after the base time
+TIMESTAMP_SPAN = 86400.0
+
+
+def derive_seed(root: int, *path):
+    """ Returning 64 bit seed derived from root seed and stream path """
+    digest = hashlib.blake2b(repr((root,) + path).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def chunk_segments(root, file_index: int, start: int, rows, chunk_rows: int = CHUNK_ROWS):
+    """ Yielding (seed, rows) segments covering rows from start, unbounded when rows is None """
+    if root is None:
+        if rows is None:
+            while True:
+                yield None, chunk_rows
+        if rows > 0:
+            yield None, rows
+        return
+    if start % chunk_rows:
+        raise ValueError('Seeded row ranges must start on a chunk boundary')
+    position = start
+    while rows is None or position < start + rows:
+        chunk = position // chunk_rows
+        chunk_stop = (chunk + 1) * chunk_rows if rows is None else min(start + rows, (chunk + 1) * chunk_rows)
+        yield derive_seed(root, file_index, chunk), chunk_stop - position
+        position = chunk_stop
@@ -0,0 +1,191 @@
+import bisect
+import functools
+import json
+
+""" Row serializers and buffered writer
+
+Rows are serialized either by a JSON library (stdlib JSONEncoder by default,
+orjson or ujson when installed) or by a row template built once from the
+compiled plan, which skips building a dict per row. Serialized lines are
+collected by BufferedLineWriter and written in large pre-joined chunks.
+"""
+
+SERIALIZERS = ['json', 'template', 'orjson', 'ujson']
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# Rows generated per list comprehension before they are handed to the writer
+BATCH_ROWS = 1024
+
+# Kinds whose generated strings never need JSON escaping, datetime formats are checked by the compiler
+RAW_STRING_KINDS = ('timestamp', 'uuid', 'datetime')
+
+# Kinds whose generated values are valid JSON when formatted with %s
+RAW_VALUE_KINDS = ('randint', 'uniform', 'normal', 'zipf', 'unique', 'ref')
+
+# Kinds picking from a fixed set of values, pre-encoded by the row template
+CHOICE_KINDS = ('choice', 'weighted', 'bool')
+
+
+def _encode(value):
+    """ Returning JSON text of a value escaped for %-formatting """
+    return json.dumps(value, ensure_ascii=True).replace('%', '%%')
+
+
+def is_inline(field):
+    """ Returning true if the field value is written into the row template itself """
+    return field.kind == 'const' and not field.null_rate
+
+
+def choice_values(field):
+    """ Returning (values, cumulative weights) of a choice, weighted or bool field, weights None when uniform """
+    if field.kind == 'bool':
+        return (True, False), (field.args[0], 1.0)
+    if field.kind == 'weighted':
+        return field.args
+    return field.args[0], None
+
+
+def template_encoder(field):
+    """ Returning function converting a generated value of a template field to its placeholder text """
+    if field.kind in RAW_STRING_KINDS and not field.null_rate:
+        return str
+    return functools.partial(json.dumps, ensure_ascii=True)
+
+
+def jsonl_template(plan):
+    """ Returning row template and the fields filling its placeholders """
+    parts = []
+    fields = []
+    for field in plan:
+        key = _encode(field.key)
+        if is_inline(field):
+            parts.append('{}: {}'.format(key, _encode(field.args[0])))
+        elif field.kind in RAW_STRING_KINDS and not field.null_rate:
+            parts.append('{}: "%s"'.format(key))
+            fields.append(field)
+        else:
+            parts.append('{}: %s'.format(key))
+            fields.append(field)
+    return '{' + ', '.join(parts) + '}', fields
+
+
+def _choice(values, rng):
+    """ Returning random pre-encoded value """
+    return rng.choice(values)
+
+
+def _weighted(values, cum_weights, rng):
+    """ Returning pre-encoded value picked with cumulative weights """
+    return values[min(bisect.bisect(cum_weights, rng.random() * cum_weights[-1]), len(values) - 1)]
+
+
+def _encoded(generate, rng):
+    """ Returning JSON text of a generated value """
+    return json.dumps(generate(rng), ensure_ascii=True)
+
+
+class RowTemplate:
+    """ Formatting rows straight into JSON text in the compiled field order """
+
+    def __init__(self, plan):
+        self.template, fields = jsonl_template(plan)
+        self.plan = plan
+        self.encoders = None
+        if plan.expressions:
+            # Expressions read the other fields, so rows are generated by the plan and encoded field by field
+            self.encoders = tuple(template_encoder(field) for field in fields)
+            self.indexes = tuple(index for index, field in enumerate(plan) if not is_inline(field))
+        generators = []
+        for field in fields:
+            if field.null_rate:
+                generators.append(functools.partial(_encoded, field.generate))
+            elif field.kind in CHOICE_KINDS:
+                # Same random draws as the plan generators, so both serializers give identical rows
+                values, cum_weights = choice_values(field)
+                encoded = tuple(json.dumps(value, ensure_ascii=True) for value in values)
+                if cum_weights is None:
+                    generators.append(functools.partial(_choice, encoded))
+                else:
+                    generators.append(functools.partial(_weighted, encoded, cum_weights))
+            elif field.kind in RAW_STRING_KINDS or field.kind in RAW_VALUE_KINDS:
+                generators.append(field.generate)
+            else:
+                generators.append(functools.partial(_encoded, field.generate))
+        self.generators = tuple(generators)
+
+    def values(self, rng):
+        """ Generating template values of a single data line """
+        if self.encoders is not None:
+            values = self.plan.values(rng)
+            return tuple([encode(values[index]) for index, encode in zip(self.indexes, self.encoders)])
+        return tuple([generate(rng) for generate in self.generators])
+
+    def format_values(self, values: tuple):
+        """ Serializing template values """
+        return self.template % values
+
+    def format(self, rng):
+        """ Generating a single serialized data line """
+        if self.encoders is not None:
+            return self.template % self.values(rng)
+        return self.template % tuple([generate(rng) for generate in self.generators])
+
+
+def _orjson_dumps(row):
+    """ Serializing row with orjson """
+    import orjson
+    return orjson.dumps(row).decode('utf-8')
+
+
+def get_serializer(name: str = 'json'):
+    """ Returning function serializing a row dict to a JSON string """
+    if name == 'orjson':
+        import orjson
+        return _orjson_dumps
+    if name == 'ujson':
+        import ujson
+        return functools.partial(ujson.dumps, ensure_ascii=True)
+    return json.JSONEncoder(ensure_ascii=True).encode
+
+
+def row_serializer(plan, name: str = 'json'):
+    """ Returning (values, format) functions generating row values from a random source and serializing them """
+    if name == 'template':
+        template = RowTemplate(plan)
+        return template.values, template.format_values
+    return plan.row, get_serializer(name)
+
+
+class BufferedLineWriter:
+    """ Writing lines separated by newlines in large pre-joined chunks, without trailing newline """
+
+    def __init__(self, file, buffer_size: int = DEFAULT_BUFFER_SIZE, started: bool = False):
+        self.file = file
+        self.buffer_size = buffer_size
+        self.chunks = []
+        self.size = 0
+        # Lines continuing already written ones are preceded by a newline
+        self.started = started
+
+    def write_lines(self, lines: list):
+        """ Buffering a list of serialized lines """
+        if lines:
+            self.write_block('\n'.join(lines))
+
+    def write_block(self, block: str):
+        """ Buffering pre-joined lines """
+        self.chunks.append(block)
+        self.size += len(block)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """ Writing buffered lines to the file in one call """
+        if not self.chunks:
+            return
+        data = '\n'.join(self.chunks)
+        self.file.write('\n' + data if self.started else data)
+        self.started = True
+        self.chunks = []
+        self.size = 0
@@ -0,0 +1,459 @@
+import argparse
+import ast
+import asyncio
+import collections
+import concurrent.futures
+import http
+import json
+import logging
+import os
+import random
+
+import formats
+import seeding
+from generator import ConsoleUtility
+from schema_compiler import UniqueSequence
+from schema_parser import SchemaError, parse_schema
+
+""" Generation server
+
+Serves generated rows over HTTP for load tests, from one long running process
+instead of a new cli.py run per consumer. POST /generate takes a JSON body
+with data_schema, rows and optionally format (jsonl or csv), seed, base_time,
+engine and serializer, and streams the rows as a chunked response. Rows are
+generated by a process pool in ranges of one seeding chunk, seeded requests
+return the same rows as a seeded run of cli.py and unseeded requests take the
+next unused row positions of the server, so their int:unique values do not
+repeat across requests. Every response keeps a bounded window of ranges in
+flight and waits for the client to read before submitting more, and the number
+of concurrent streams is bounded too. Compiled schemas are kept warm in an LRU
+cache of the server and of every worker, schemas missing from it are compiled
+off the event loop. Requests are limited to small value pools, Zipf and date
+ranges and arrays, and expressions may raise to small constant powers only and
+can not repeat strings, so no request compiles or generates for long. Unseeded
+pools are drawn once by the server and sent with every range to the workers,
+so all ranges pick from the same values. GET /health reports the server state.
+
+$ python server.py --port=8080 --processes=4
+$ curl -d '{"data_schema": {"id": "int:unique", "name": "str:rand"}, "rows": 1000}' localhost:8080/generate
+"""
+
+# Compiled schemas kept by every process
+WARM_SCHEMAS = 64
+
+# Rows generated by one pool task, rounded up to whole chunks for seeded requests
+TASK_ROWS = seeding.CHUNK_ROWS
+
+# Tasks of one response submitted before the client read the first of them
+QUEUE_TASKS = 4
+
+# Responses streamed at the same time, further requests get 503
+MAX_STREAMS = 64
+
+# Largest accepted request body
+MAX_BODY = 1024 * 1024
+
+# Largest value pool, Zipf n and number of days of a date range of a request, they are precomputed when compiled
+MAX_VALUES = 100000
+
+# Largest array length of a request
+MAX_ARRAY_ITEMS = 1000
+
+# Largest constant exponent of ** and << in expressions of a request
+MAX_EXPONENT = 64
+
+# Functions of numbers in expressions
+NUMBER_FUNCTIONS = ('abs', 'bool', 'float', 'int', 'len', 'max', 'min', 'round')
+
+CONTENT_TYPES = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Request settings besides rows, they select the warm compiled schema
+SETTING_KEYS = ('data_schema', 'format', 'seed', 'base_time', 'engine', 'serializer')
+
+# Salt of the unique fields of unseeded requests, every process compiles them separately
+_salt = random.getrandbits(64)
+
+_warm = collections.OrderedDict()
+
+
+def _init_worker(salt: int):
+    """ Sharing the unique field salt of the server with the pool worker """
+    global _salt
+    _salt = salt
+
+
+def request_settings(body: bytes):
+    """ Returning (settings, rows) of a generate request body, ValueError when it is invalid """
+    try:
+        request = json.loads(body or b'{}')
+    except ValueError:
+        raise ValueError('Request body must be a JSON object')
+    if not isinstance(request, dict):
+        raise ValueError('Request body must be a JSON object')
+    unknown = sorted(set(request) - set(SETTING_KEYS) - {'rows'})
+    if unknown:
+        raise ValueError('Unknown request settings: {}'.format(', '.join(unknown)))
+    rows = request.get('rows')
+    if not isinstance(rows, int) or isinstance(rows, bool) or rows <= 0:
+        raise ValueError('rows must be a positive integer')
+    if not isinstance(request.get('data_schema'), dict) or not request['data_schema']:
+        raise ValueError('data_schema must be a non empty JSON object')
+    settings = {'data_schema': request['data_schema'], 'format': request.get('format', 'jsonl'),
+                'seed': request.get('seed'), 'base_time': request.get('base_time'),
+                'engine': request.get('engine', 'python'), 'serializer': request.get('serializer', 'json')}
+    if settings['format'] not in CONTENT_TYPES:
+        raise ValueError('format must be one of {}'.format(', '.join(CONTENT_TYPES)))
+    if settings['seed'] is not None and (not isinstance(settings['seed'], int) or isinstance(settings['seed'], bool)):
+        raise ValueError('seed must be an integer')
+    return settings, rows
+
+
+def settings_key(settings: dict):
+    """ Returning cache key of request settings """
+    return json.dumps(settings, sort_keys=True)
+
+
+def is_number(node, fields: dict):
+    """ Returning true if an expression node always evaluates to a number, fields are the nodes of its object """
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, (int, float))
+    if isinstance(node, ast.UnaryOp):
+        return is_number(node.operand, fields)
+    if isinstance(node, ast.BinOp):
+        return is_number(node.left, fields) and is_number(node.right, fields)
+    if isinstance(node, ast.IfExp):
+        return is_number(node.body, fields) and is_number(node.orelse, fields)
+    if isinstance(node, ast.Call):
+        if node.func.id in ('min', 'max'):
+            return all(is_number(arg, fields) for arg in node.args)
+        return node.func.id in NUMBER_FUNCTIONS
+    chain = []
+    while isinstance(node, ast.Attribute):
+        chain.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return False
+    field = None
+    for name in [node.id] + chain[::-1]:
+        field = fields.get(name)
+        if field is None:
+            return False
+        if field.kind == 'object':
+            fields = {child.key: child for child in field.args[0]}
+    if field.kind == 'expr':
+        return is_number(ast.parse(field.args[0].strip(), mode='eval').body, fields)
+    return field.type in ('int', 'float', 'bool')
+
+
+def expression_limits(text: str, fields: dict):
+    """ Checking that an expression raises to small constant powers only and repeats no strings or lists """
+    for node in ast.walk(ast.parse(text.strip(), mode='eval')):
+        if not isinstance(node, ast.BinOp):
+            continue
+        if isinstance(node.op, (ast.Pow, ast.LShift)):
+            exponent = node.right.operand if isinstance(node.right, ast.UnaryOp) else node.right
+            nested = any(isinstance(inner, ast.BinOp) and isinstance(inner.op, (ast.Pow, ast.LShift))
+                         for inner in ast.walk(node.left))
+            if nested or not isinstance(exponent, ast.Constant) or not isinstance(exponent.value, (int, float)) \
+                    or abs(exponent.value) > MAX_EXPONENT:
+                raise ValueError('expressions may only use ** and << with a constant of at most {} and no other '
+                                 'power on the left'.format(MAX_EXPONENT))
+        elif isinstance(node.op, ast.Mult) and not (is_number(node.left, fields) and is_number(node.right, fields)):
+            raise ValueError('expressions may only multiply numbers')
+
+
+def request_limits(nodes: list, path: str = ''):
+    """ Checking the parsed fields of a request against the server limits, ValueError naming the field """
+    fields = {node.key: node for node in nodes}
+    for node in nodes:
+        field_path = node.key if not path else '{}.{}'.format(path, node.key)
+        try:
+            if node.pool is not None and node.pool > MAX_VALUES:
+                raise ValueError('pools may hold up to {} values'.format(MAX_VALUES))
+            if node.kind == 'zipf' and node.args[1] > MAX_VALUES:
+                raise ValueError('Zipf fields may have up to {} values'.format(MAX_VALUES))
+            if node.kind == 'date' and node.args[0] is not None and \
+                    (node.args[1].date() - node.args[0].date()).days >= MAX_VALUES:
+                raise ValueError('date ranges may span up to {} days'.format(MAX_VALUES))
+            if node.kind == 'array' and node.args[2] > MAX_ARRAY_ITEMS:
+                raise ValueError('arrays may have up to {} items'.format(MAX_ARRAY_ITEMS))
+            if node.kind == 'expr':
+                expression_limits(node.args[0], fields)
+        except ValueError as error:
+            raise ValueError('data_schema field {} is over the server limits: {}'.format(field_path, error))
+        if node.kind == 'object':
+            request_limits(node.args[0], field_path)
+        elif node.kind == 'array':
+            request_limits([node.args[0]], field_path)
+
+
+def has_pools(nodes: list):
+    """ Returning true if a parsed field or one of its nested fields picks from a value pool """
+    for node in nodes:
+        if node.pool is not None or node.kind == 'object' and has_pools(node.args[0]) or \
+                node.kind == 'array' and has_pools([node.args[0]]):
+            return True
+    return False
+
+
+def compile_utility(settings: dict):
+    """ Returning ConsoleUtility of the settings with its compiled schema, ValueError for invalid settings """
+    cli = ConsoleUtility(path='.', file_count=1, file_name='server', file_prefix='count',
+                         data_schema=settings['data_schema'], data_lines=0, clear_path='False', multiprocessing=1,
+                         engine=settings['engine'], seed=settings['seed'], base_time=settings['base_time'],
+                         serializer=settings['serializer'], output_format=settings['format'], progress_interval=0)
+    if not cli.check_args():
+        raise ValueError('Invalid engine or serializer')
+    try:
+        nodes = parse_schema(cli.data_schema)
+    except SchemaError as error:
+        raise ValueError('Invalid data_schema: {}'.format(error))
+    request_limits(nodes)
+    cli.schema_nodes = (cli.data_schema, nodes)
+    plan = cli.get_schema_plan()
+    if settings['seed'] is None:
+        for counter in plan.counters:
+            if isinstance(counter, UniqueSequence):
+                counter.set_salt(_salt)
+    return cli
+
+
+def keep_warm(key: str, cli):
+    """ Storing a compiled utility in the LRU cache """
+    _warm[key] = cli
+    if len(_warm) > WARM_SCHEMAS:
+        _warm.popitem(last=False)
+
+
+def warm_utility(key: str, settings: dict):
+    """ Returning ConsoleUtility of the settings with its compiled schema, from the LRU cache when it holds it """
+    if key in _warm:
+        _warm.move_to_end(key)
+        return _warm[key]
+    cli = compile_utility(settings)
+    keep_warm(key, cli)
+    return cli
+
+
+def generate_rows(key: str, settings: dict, start: int, rows: int, cli=None):
+    """ Returning UTF-8 encoded newline terminated rows of a range, run by the pool workers
+
+    Utilities compiled by the server are used as sent, others are compiled by the worker from the settings.
+    """
+    if cli is None:
+        cli = warm_utility(key, settings)
+    if settings['format'] == 'csv':
+        plan = cli.get_schema_plan()
+        return ''.join(formats.csv_block(formats.text_columns(plan, columns))
+                       for columns in cli.column_batches(rows, 0, start)).encode('utf-8')
+    return ''.join(block + '\n' for block in cli.line_blocks(rows, 0, start)).encode('utf-8')
+
+
+def task_ranges(first: int, rows: int, task_rows: int = TASK_ROWS):
+    """ Yielding (start, rows) ranges of the pool tasks of a response starting at row position first """
+    for start in range(first, first + rows, task_rows):
+        yield start, min(task_rows, first + rows - start)
+
+
+def response_head(status: int, headers: dict):
+    """ Returning encoded status line and headers of a response """
+    lines = ['HTTP/1.1 {} {}'.format(status, http.HTTPStatus(status).phrase)]
+    lines += ['{}: {}'.format(name, value) for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def read_request(reader):
+    """ Returning (method, path, headers, body) of the next request, None when the client closed the connection """
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        raise ValueError('Request body is larger than {} bytes'.format(MAX_BODY))
+    body = await reader.readexactly(length) if length else b''
+    return method, path.split('?')[0], headers, body
+
+
+class GenerationServer:
+    """ HTTP server streaming generated rows from a process pool """
+
+    def __init__(self, processes: int = None, queue_tasks: int = QUEUE_TASKS, max_streams: int = MAX_STREAMS,
+                 task_rows: int = TASK_ROWS):
+        self.processes = processes or os.cpu_count()
+        self.queue_tasks = queue_tasks
+        self.max_streams = max_streams
+        self.task_rows = task_rows
+        self.streams = 0
+        self.served = 0
+        # Next row position of unseeded requests
+        self.position = 0
+        self.executor = None
+        # Thread compiling schemas missing from the cache, apart from the default executor of the loop
+        self.compiler = None
+        self.server = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080):
+        """ Starting the process pool and listening, returning the asyncio server """
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.processes, initializer=_init_worker,
+                                                             initargs=(_salt,))
+        self.compiler = concurrent.futures.ThreadPoolExecutor(1)
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def close(self):
+        """ Closing the listening socket and the process pool """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+        if self.compiler is not None:
+            self.compiler.shutdown(cancel_futures=True)
+
+    async def handle(self, reader, writer):
+        """ Answering requests of a keep alive connection until the client closes it """
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError) as error:
+                    await self.send_json(writer, 400, {'error': str(error)}, False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if path == '/health' and method == 'GET':
+                    await self.send_json(writer, 200, {'status': 'ok', 'processes': self.processes,
+                                                       'streams': self.streams, 'served': self.served,
+                                                       'warm_schemas': len(_warm)}, keep_alive)
+                elif path == '/generate' and method == 'POST':
+                    keep_alive = await self.generate(writer, body) and keep_alive
+                elif path in ('/health', '/generate'):
+                    await self.send_json(writer, 405, {'error': 'Method not allowed'}, keep_alive)
+                else:
+                    await self.send_json(writer, 404, {'error': 'Not found'}, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def send_json(self, writer, status: int, body: dict, keep_alive: bool = True):
+        """ Writing a JSON response """
+        content = json.dumps(body).encode('utf-8')
+        writer.write(response_head(status, {'Content-Type': 'application/json', 'Content-Length': len(content),
+                                            'Connection': 'keep-alive' if keep_alive else 'close'}) + content)
+        await writer.drain()
+
+    async def generate(self, writer, body: bytes):
+        """ Streaming rows of a generate request, returning false when the connection can not be reused """
+        loop = asyncio.get_running_loop()
+        try:
+            settings, rows = request_settings(body)
+            key = settings_key(settings)
+            if key in _warm:
+                cli = warm_utility(key, settings)
+            else:
+                # Pools and precomputed ranges are compiled in a thread, the loop keeps serving other streams
+                cli = await loop.run_in_executor(self.compiler, compile_utility, settings)
+                keep_warm(key, cli)
+        except ValueError as error:
+            await self.send_json(writer, 400, {'error': str(error)})
+            return True
+        if self.streams >= self.max_streams:
+            await self.send_json(writer, 503, {'error': 'Server is busy'})
+            return True
+        self.streams += 1
+        # Workers compiling unseeded pools themselves would draw other values, they get the server's plan instead
+        sent = cli if settings['seed'] is None and has_pools(cli.schema_nodes[1]) else None
+        task_rows = self.task_rows
+        if settings['seed'] is not None:
+            # Seeded ranges start on chunk boundaries
+            task_rows = -(-task_rows // seeding.CHUNK_ROWS) * seeding.CHUNK_ROWS
+        first = 0
+        if settings['seed'] is None:
+            first, self.position = self.position, self.position + rows
+        ranges = task_ranges(first, rows, task_rows)
+        pending = collections.deque()
+        try:
+            writer.write(response_head(200, {'Content-Type': CONTENT_TYPES[settings['format']],
+                                             'Transfer-Encoding': 'chunked'}))
+            if settings['format'] == 'csv':
+                write_chunk(writer, formats.csv_block([[name] for name in cli.get_schema_plan().keys]).encode('utf-8'))
+            while True:
+                while len(pending) < self.queue_tasks:
+                    task = next(ranges, None)
+                    if task is None:
+                        break
+                    pending.append(loop.run_in_executor(self.executor, generate_rows, key, settings, *task, sent))
+                if not pending:
+                    break
+                write_chunk(writer, await pending.popleft())
+                # Waiting for the client to read keeps slow consumers from filling the memory
+                await writer.drain()
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            self.served += 1
+            return True
+        except ConnectionError:
+            logging.warning('Client closed the connection during a stream')
+            return False
+        except ValueError as error:
+            # The status line is already sent, the unterminated chunked body tells the client the stream failed
+            logging.error('Error: Stream failed: {}'.format(error))
+            return False
+        finally:
+            for future in pending:
+                future.cancel()
+            self.streams -= 1
+
+
+def write_chunk(writer, data: bytes):
+    """ Writing data as one chunk of a chunked response """
+    if data:
+        writer.write(b'%x\r\n' % len(data) + data + b'\r\n')
+
+
+async def serve(host: str, port: int, processes: int = None, queue_tasks: int = QUEUE_TASKS,
+                max_streams: int = MAX_STREAMS):
+    """ Running the generation server until it is interrupted """
+    generation_server = GenerationServer(processes, queue_tasks, max_streams)
+    server = await generation_server.start(host, port)
+    logging.info('Serving on {} with {} processes'.format(', '.join(str(sock.getsockname()) for sock in server.sockets),
+                                                          generation_server.processes))
+    try:
+        await server.serve_forever()
+    finally:
+        await generation_server.close()
+
+
+def main():
+    """ Set up argparse to handle server arguments """
+    parser = argparse.ArgumentParser(prog='Console Utility server',
+                                     description='HTTP server streaming generated test data.')
+    parser.add_argument('--host', help='Address to listen on', type=str, default='127.0.0.1')
+    parser.add_argument('--port', help='Port to listen on', type=int, default=8080)
+    parser.add_argument('--processes', help='Processes generating rows, defaults to the cpu count', type=int)
+    parser.add_argument('--queue_tasks', help='Row ranges of a response generated ahead of the client', type=int,
+                        default=QUEUE_TASKS)
+    parser.add_argument('--max_streams', help='Responses streamed at the same time', type=int, default=MAX_STREAMS)
+    logging.basicConfig(level=logging.INFO)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.processes, args.queue_tasks, args.max_streams))
+    except KeyboardInterrupt:
+        logging.info('Server stopped')
+
+
+if __name__ == '__main__':
+    main()
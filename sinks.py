@@ -0,0 +1,103 @@
+import bz2
+import gzip
+import io
+import lzma
+import sys
+import time
+
+""" Output sinks
+
+Opens the text file objects generated rows are written to. Compressed files
+are streamed through the compressor while rows are generated. Every file or
+part is a complete gzip member, bz2/xz stream or zstd frame, so parts written
+by parallel workers can simply be concatenated. StreamSink writes rows to
+stdout or a FIFO, where blocking writes give backpressure from the consumer.
+"""
+
+COMPRESSIONS = ['none', 'gzip', 'bz2', 'xz', 'zstd']
+
+EXTENSIONS = {'none': '', 'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz', 'zstd': '.zst'}
+
+DEFAULT_LEVELS = {'gzip': 6, 'bz2': 9, 'xz': 6, 'zstd': 3}
+
+LEVEL_RANGES = {'gzip': (0, 9), 'bz2': (1, 9), 'xz': (0, 9), 'zstd': (1, 22)}
+
+
+def compression_extension(compression: str):
+    """ Returning file extension added by the compression """
+    return EXTENSIONS[compression or 'none']
+
+
+def open_output(path: str, compression: str = 'none', level: int = None):
+    """ Opening UTF-8 text file object writing to path through the compressor, whatever the locale """
+    compression = compression or 'none'
+    if compression == 'none':
+        return open(path, 'w', encoding='utf-8')
+    if level is None:
+        level = DEFAULT_LEVELS[compression]
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', compresslevel=level, encoding='utf-8')
+    if compression == 'bz2':
+        return bz2.open(path, 'wt', compresslevel=level, encoding='utf-8')
+    if compression == 'xz':
+        return lzma.open(path, 'wt', preset=level, encoding='utf-8')
+    if compression == 'zstd':
+        import zstandard
+        writer = zstandard.ZstdCompressor(level=level).stream_writer(open(path, 'wb'))
+        return io.TextIOWrapper(writer, encoding='utf-8')
+    raise ValueError('Unknown compression {}'.format(compression))
+
+
+class StreamSink:
+    """ Binary stream to stdout ('-') or a FIFO/file path, flushed after every chunk """
+
+    def __init__(self, output: str, compression: str = 'none', level: int = None):
+        compression = compression or 'none'
+        self.output = output
+        self.base = sys.stdout.buffer if output == '-' else open(output, 'wb')
+        if level is None and compression != 'none':
+            level = DEFAULT_LEVELS[compression]
+        if compression == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=self.base, mode='wb', compresslevel=level)
+        elif compression == 'bz2':
+            self.stream = bz2.BZ2File(self.base, 'wb', compresslevel=level)
+        elif compression == 'xz':
+            self.stream = lzma.LZMAFile(self.base, 'wb', preset=level)
+        elif compression == 'zstd':
+            import zstandard
+            self.stream = zstandard.ZstdCompressor(level=level).stream_writer(self.base, closefd=False)
+        else:
+            self.stream = self.base
+
+    def write(self, chunk: bytes):
+        """ Writing a chunk and pushing it to the consumer, blocks while the consumer is behind """
+        self.stream.write(chunk)
+        self.stream.flush()
+        if self.stream is not self.base:
+            self.base.flush()
+
+    def close(self):
+        """ Finishing the compressed stream, stdout is flushed but left open """
+        try:
+            if self.stream is not self.base:
+                self.stream.close()
+            self.base.flush()
+        finally:
+            if self.output != '-':
+                self.base.close()
+
+
+class RateLimiter:
+    """ Limiting rows per second, sleeping until already written rows fit the rate """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.rows = 0
+
+    def wait(self, rows: int):
+        """ Waiting before writing next `rows` rows """
+        delay = self.start + self.rows / self.rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.rows += rows
@@ -0,0 +1,129 @@
+import itertools
+import json
+import re
+
+""" Size targeted files
+
+With --file_size or --total_size files are filled with rows until a byte
+target is reached instead of having data_lines rows. Every file is cut into
+segments of SEGMENT_BYTES, each filled from its own row stream with whole rows
+until the next row would pass the segment budget. Segments are independent,
+so they can be written by different workers and concatenated, and seeded
+output is the same for any number of processes. Targets count uncompressed
+bytes of the text written to the file.
+
+Rows of a segment are not known before it is written, but no row is shorter
+than the smallest text its fields can produce, so a segment holds at most
+budget // min_row_size + 1 rows. Every segment of the run gets that many
+row positions for its unique fields, following the positions of the segments
+and files before it, so unique values never repeat in the run and the range
+of a unique field is checked before anything is written.
+"""
+
+# Bytes of one independently generated segment of a size targeted file
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+              'KIB': 1024, 'MIB': 1024 ** 2, 'GIB': 1024 ** 3, 'TIB': 1024 ** 4}
+
+
+def parse_size(text):
+    """ Returning bytes of a size like 512MB, 1.5GiB or 1000 """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*', str(text))
+    if match is None or match.group(2).upper() not in SIZE_UNITS:
+        raise ValueError('Invalid size {!r}, expected a number with optional B, KB, MB, GB, TB, KiB, MiB, GiB or '
+                         'TiB unit'.format(text))
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def file_sizes(file_count: int, file_size: int = None, total_size: int = None):
+    """ Returning byte target of every file, files of file_size up to total_size or total_size split evenly """
+    if total_size is None:
+        return [file_size] * file_count
+    if file_size is None:
+        size, rest = divmod(total_size, max(file_count, 1))
+        return [size + 1] * rest + [size] * (max(file_count, 1) - rest)
+    count, rest = divmod(total_size, file_size)
+    return [file_size] * count + ([rest] if rest else [])
+
+
+def segments(size: int, segment_bytes: int = SEGMENT_BYTES):
+    """ Returning byte budgets of the segments of a file """
+    count, rest = divmod(size, segment_bytes)
+    return [segment_bytes] * count + ([rest] if rest else [])
+
+
+def text_size(text: str):
+    """ Returning UTF-8 encoded size of text """
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
+
+def fit_block(block: str, budget: int):
+    """ Returning (block, size, dropped) of the leading lines of a newline joined block fitting budget bytes
+
+    Every line counts with one newline byte, dropped is the number of lines that did not fit.
+    """
+    size = text_size(block) + 1
+    if size <= budget:
+        return block, size, 0
+    lines = block.split('\n')
+    size = 0
+    taken = 0
+    for line in lines:
+        length = text_size(line) + 1
+        if size + length > budget:
+            break
+        size += length
+        taken += 1
+    return '\n'.join(lines[:taken]), size, len(lines) - taken
+
+
+def value_size(value, output_format: str):
+    """ Returning bytes of a value in a jsonl or csv row, ensure_ascii escapes only make JSON text longer """
+    if output_format == 'csv':
+        return 0 if value is None else text_size(value if isinstance(value, str) else str(value))
+    return text_size(json.dumps(value, ensure_ascii=False))
+
+
+def min_value_size(field, output_format: str):
+    """ Returning bytes of the shortest value a plan field can write """
+    kind, args = field.kind, field.args
+    if kind == 'const':
+        size = value_size(args[0], output_format)
+    elif kind in ('choice', 'weighted'):
+        size = min(value_size(value, output_format) for value in args[0])
+    elif kind in ('randint', 'unique'):
+        low, high = args[0], args[1]
+        size = 1 if low <= 0 <= high else min(value_size(low, output_format), value_size(high, output_format))
+    elif kind == 'bool':
+        size = min(value_size(True, output_format), value_size(False, output_format))
+    elif kind == 'uuid':
+        size = value_size('0' * 36, output_format)
+    else:
+        # Any other JSON value takes a byte at least, CSV cells may be empty
+        size = 0 if output_format == 'csv' else 1
+    if field.null_rate:
+        size = min(size, value_size(None, output_format))
+    return size
+
+
+def min_row_size(plan, output_format: str):
+    """ Returning bytes of the shortest row of the plan with its newline, JSON keys without optional spaces """
+    values = sum(min_value_size(field, output_format) for field in plan)
+    separators = max(len(plan) - 1, 0)
+    if output_format == 'csv':
+        return values + separators + 1
+    keys = sum(value_size(key, output_format) + 1 for key in plan.keys)
+    return 2 + keys + values + separators + 1
+
+
+def segment_rows(budget: int, row_size: int):
+    """ Returning most rows a segment of budget bytes can hold """
+    return budget // row_size + 1
+
+
+def file_positions(sizes: list, segment_bytes: int, row_size: int):
+    """ Returning first row position of every file and the positions of the whole run, segments hold bounded rows """
+    bounds = [sum(segment_rows(budget, row_size) for budget in segments(size, segment_bytes)) for size in sizes]
+    starts = [0] + list(itertools.accumulate(bounds))
+    return starts[:-1], starts[-1]
@@ -0,0 +1,108 @@
+import copy
+import json
+import logging
+
+import metrics
+import pools
+from schema_compiler import ForeignKey, compile_schema
+
+""" Multi table datasets
+
+A tables file maps table names to their data_schema, data_lines and
+file_count. Every table is written as its own files named after the table.
+Fields like ref:customers.id take keys of another table, the referenced field
+must be int:unique. Unique fields of a table are unique across all its files
+and the key of every parent row is a keyed permutation of the row number, so
+a child table computes the keys it refers to instead of reading the parent
+files or keeping parent ids in memory. Tables do not depend on each other's
+output and can be generated in any order, self references included.
+"""
+
+TABLE_KEYS = ('data_schema', 'data_lines', 'file_count')
+
+
+def load_tables(path: str):
+    """ Loading tables file, returning dict of table name and settings """
+    with open(path, 'r') as file:
+        tables = json.load(file)
+    check_tables(tables)
+    return tables
+
+
+def check_tables(tables: dict):
+    """ Checking table names and settings, ValueError when they are invalid """
+    if not isinstance(tables, dict) or not tables:
+        raise ValueError('Tables file must map table names to their settings')
+    for name, table in tables.items():
+        if not isinstance(table, dict) or not isinstance(table.get('data_schema'), dict):
+            raise ValueError('Table {} must have a data_schema object'.format(name))
+        unknown = sorted(set(table) - set(TABLE_KEYS))
+        if unknown:
+            raise ValueError('Table {} has unknown settings: {}'.format(name, ', '.join(unknown)))
+        for key in ('data_lines', 'file_count'):
+            value = table.get(key, 1)
+            if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+                raise ValueError('Table {} {} must be a positive integer'.format(name, key))
+
+
+def table_rows(table: dict):
+    """ Returning number of rows of all files of a table """
+    return table.get('data_lines', 1) * table.get('file_count', 1)
+
+
+def compile_tables(tables: dict, seeded: bool = False, base_time: float = None, seed=None):
+    """ Compiling table schemas and binding their ref: fields to the unique key fields of the referenced tables """
+    plans = {name: compile_schema(table['data_schema'], seeded, base_time, seed) for name, table in tables.items()}
+    for name, plan in plans.items():
+        for foreign_key in plan.counters:
+            if not isinstance(foreign_key, ForeignKey):
+                continue
+            if foreign_key.table not in plans:
+                raise ValueError('ref field {} of table {} refers to unknown table {}'.format(
+                    foreign_key.key, name, foreign_key.table))
+            parent_plan = plans[foreign_key.table]
+            if foreign_key.field not in parent_plan.keys:
+                raise ValueError('ref field {} of table {} refers to unknown field {}.{}'.format(
+                    foreign_key.key, name, foreign_key.table, foreign_key.field))
+            parent = parent_plan.fields[parent_plan.keys.index(foreign_key.field)]
+            if parent.kind != 'unique':
+                raise ValueError('ref field {} of table {} must refer to an int:unique field, {}.{} is {}'.format(
+                    foreign_key.key, name, foreign_key.table, foreign_key.field, parent.kind))
+            parent_rows = table_rows(tables[foreign_key.table])
+            if parent.generate.size < parent_rows:
+                raise ValueError('Unique field {}.{} has fewer values than the {} rows of its table'.format(
+                    foreign_key.table, foreign_key.field, parent_rows))
+            foreign_key.bind(parent.generate, parent_rows, table_rows(tables[name]))
+    return plans
+
+
+def table_utility(cli, name: str, table: dict, plan=None):
+    """ Returning copy of ConsoleUtility generating the files of one table """
+    table_cli = copy.copy(cli)
+    table_cli.file_name = name
+    table_cli.table = name
+    table_cli.data_schema = table['data_schema']
+    table_cli.data_lines = table.get('data_lines', 1)
+    table_cli.file_count = table.get('file_count', 1)
+    table_cli.metrics = metrics.Metrics(interval=cli.progress_interval)
+    table_cli.manifest = None
+    table_cli.schema_plan = plan
+    table_cli.schema_plan_source = table['data_schema'] if plan is not None else None
+    return table_cli
+
+
+def clear_tables(cli, tables: dict):
+    """ Removing files of all tables from the output path, returning their count """
+    return sum(table_utility(cli, name, table).clear_path_and_files(cli.path) for name, table in tables.items())
+
+
+def run_tables(cli, tables: dict):
+    """ Generating the files of every table, returning run summaries by table name """
+    pools.set_cache_dir(cli.pool_cache)
+    plans = compile_tables(tables, cli.seed is not None, cli.base_time, cli.seed)
+    summaries = {}
+    for name, table in tables.items():
+        logging.info('Generating table {} with {} rows in {} files'.format(name, table_rows(table),
+                                                                         table.get('file_count', 1)))
+        summaries[name] = table_utility(cli, name, table, plans[name]).run()
+    return summaries
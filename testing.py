@@ -1,8 +1,26 @@
 import pytest
 from cli import ConsoleUtility
+from schema_compiler import compile_schema
+import bench
+import generator
+import delta
+import layout
+import manifest
+import metrics
+import pools
+import scheduler
+import server
+import serializers
+import sizing
+import sinks
+import tables
 from pathlib import Path
+import json
 import logging
 import os
+import random
+import time
+import uuid
 
 
 # Tests
@@ -11,11 +29,13 @@ import os
 @pytest.mark.parametrize("data_type, expected",
                          [("{\"date\": \"timestamp:\"}", True), ("{\"name\": \"str:'Anna'\"}", True),
                           ("{\"age\": \"int:rand(0,100)\"}", True), ("{\"id\": \"str:rand:\"}", True),
-                          ("{\"salary\": \"float:rand\"}", False),
-                          ("{\"experience\": \"list:['intern','junior','mid','senior']\"}", False),
-                          ("{\"None\": \"NoneType:\"}", False), ("{\"Plan to extend contract\": \"bool:\"}", False)])
+                          ("{\"salary\": \"float:rand\"}", True),
+                          ("{\"experience\": \"list:['intern','junior','mid','senior']\"}", True),
+                          ("{\"None\": \"NoneType:\"}", False), ("{\"Plan to extend contract\": \"bool:\"}", True),
+                          ("{\"salary\": \"float:rand(10, 1)x\"}", False),
+                          ("{\"id\": \"str:rand|nullable(0.1)\"}", True)])
 def test_data_types(data_type, expected):
-    new_Cli = ConsoleUtility(path='/Users/mjarzabkowski/PycharmProjects/PYTHON-BASIC/practice/data_generator_project',
+    new_Cli = ConsoleUtility(path='.',
                              file_count=5, file_name='data', file_prefix='count', data_schema=data_type, data_lines=10,
                              clear_path=True, multiprocessing=1)
     new_schema = new_Cli.convert_str_to_dict(data_type)
@@ -31,7 +51,7 @@ def test_data_types(data_type, expected):
     ("{\"CompanyId\": \"str:rand\",\"CompanyCode\": \"int:rand\",\"Employees\": \"['Miko1', 'Miko2', 'Miko3']\","
      "\"TotalSalaries\": \"int:rand\"}", dict)])
 def test_data_schemas(data_schema, expected, caplog):
-    new_Cli = ConsoleUtility(path='/Users/mjarzabkowski/PycharmProjects/PYTHON-BASIC/practice/data_generator_project',
+    new_Cli = ConsoleUtility(path='.',
                              file_count=5, file_name='data', file_prefix='count', data_schema=data_schema,
                              data_lines=10,
                              clear_path=True, multiprocessing=1)
@@ -50,7 +70,7 @@ def test_temp_file_fixture(tmpdir, tmppath):
     p.write(
         "{\"date\": \"timestamp:\",\"name\": \"str:rand\",\"type\": \"['client', 'partner', 'government']\","
         "\"age\": \"int:rand(1, 90)\"}")
-    new_Cli = ConsoleUtility(path='/Users/mjarzabkowski/PycharmProjects/PYTHON-BASIC/practice/data_generator_project',
+    new_Cli = ConsoleUtility(path=str(tmppath),
                              file_count=5, file_name='data', file_prefix='count', data_schema=p, data_lines=10,
                              clear_path=True, multiprocessing=1)
     data_schema = new_Cli.load_schema(p)
@@ -58,15 +78,18 @@ def test_temp_file_fixture(tmpdir, tmppath):
 
 
 # 4 Check clear path
-def test_clear_path(caplog):
+def test_clear_path(tmpdir, caplog):
     caplog.set_level(logging.INFO)
-    new_cli = ConsoleUtility(path='/Users/mjarzabkowski/PycharmProjects/PYTHON-BASIC/practice/data_generator_project',
+    tmpdir.join('data_1.jsonl').write('{}')
+    tmpdir.join('other.jsonl').write('{}')
+    new_cli = ConsoleUtility(path=str(tmpdir),
                              file_count=5, file_name='data', file_prefix='count',
                              data_schema="{\"date\": \"timestamp:\",\"name\": \"str:rand\",\"type\": \"['client', "
                                          "'partner', 'government']\",\"age\": \"int:rand(1, 90)\"}",
                              data_lines=10, clear_path=True, multiprocessing=1)
-    new_cli.clear_path_and_files(path='/Users/mjarzabkowski/PycharmProjects/PYTHON-BASIC/practice/data_generator_project')
+    new_cli.clear_path_and_files(path=str(tmpdir))
     assert 'Removed files that match filename' in caplog.text
+    assert os.listdir(str(tmpdir)) == ['other.jsonl']
 
 
 # 5 Check saving files to disk
@@ -79,7 +102,7 @@ def test_check_files(tmpdir, tmppath):
     p = tmpdir.mkdir("sub").join('temp_js.json')
     p.write("{\"date\": \"timestamp:\",\"name\": \"str:rand\",\"type\": \"['client', 'partner', 'government']\","
             "\"age\": \"int:rand(1, 90)\"}")
-    cli = ConsoleUtility(path='/Users/mjarzabkowski/PycharmProjects/PYTHON-BASIC/practice/data_generator_project',
+    cli = ConsoleUtility(path=str(tmppath),
                          file_count=5, file_name='data', file_prefix='count',
                          data_schema="{\"date\": \"timestamp:\",\"name\": \"str:rand\",\"type\": \"['client', "
                                      "'partner', 'government']\",\"age\": \"int:rand(1, 90)\"}",
@@ -88,7 +111,7 @@ def test_check_files(tmpdir, tmppath):
     cli.data_schema = data_schema
     cli.generate_jsonl_loop()
     _, _, files = next(os.walk(cli.path))
-    assert len(files) - 4 == cli.file_count  # XD zrobic zmienna liczaca ilosc plikow w folderze czy zmienic kod?
+    assert len(files) == cli.file_count
 
 
 # 6 Check number of files generated if multiprocessing > 1
@@ -101,7 +124,7 @@ def test_check_files_multiprocessing(tmpdir, tmppath):
     p = tmpdir.mkdir("sub").join('temp_js.json')
     p.write("{\"date\": \"timestamp:\",\"name\": \"str:rand\",\"type\": \"['client', 'partner', 'government']\","
             "\"age\": \"int:rand(1, 90)\"}")
-    cli = ConsoleUtility(path='/Users/mjarzabkowski/PycharmProjects/PYTHON-BASIC/practice/data_generator_project',
+    cli = ConsoleUtility(path=str(tmppath),
                          file_count=5, file_name='data', file_prefix='count',
                          data_schema="{\"date\": \"timestamp:\",\"name\": \"str:rand\",\"type\": \"['client', "
                                      "'partner', 'government']\",\"age\": \"int:rand(1, 90)\"}",
@@ -110,7 +133,7 @@ def test_check_files_multiprocessing(tmpdir, tmppath):
     cli.data_schema = data_schema
     cli.generate_jsonl_loop()
     _, _, files = next(os.walk(cli.path))
-    assert len(files)-4 == cli.file_count # to samo co u gory
+    assert len(files) == cli.file_count
 
 
 # 7 Own test - Parametrized test that takes data schema and checks if schema is dict and writes correct number of files
@@ -123,8 +146,8 @@ def test_check_files_multiprocessing(tmpdir, tmppath):
                                                    "'client', 'partner', 'government']\",\"age\": \"int:rand(1, "
                                                    "90)\"}",
                                                    dict)])
-def test_own(data_schema, expected):
-    cli = ConsoleUtility(path='/Users/mjarzabkowski/PycharmProjects/PYTHON-BASIC/practice/data_generator_project',
+def test_own(tmpdir, tmppath, data_schema, expected):
+    cli = ConsoleUtility(path=str(tmppath),
                          file_count=5, file_name='data', file_prefix='count',
                          data_schema="{\"date\": \"timestamp:\",\"name\": \"str:rand\",\"type\": \"['client', "
                                      "'partner', 'government']\",\"age\": \"int:rand(1, 90)\"}",
@@ -135,4 +158,834 @@ def test_own(data_schema, expected):
     cli.generate_jsonl_loop()
     _, _, files = next(os.walk(cli.path))
     assert type(cli.data_schema) is dict
-    assert len(files)-4 == cli.file_count # to samo
+    assert len(files) == cli.file_count
+
+
+# 8 Compiled schema plan keeps field order and parsed arguments
+def test_compile_schema():
+    plan = compile_schema({"date": "timestamp:", "name": "str:rand", "type": "str:['client', 'partner']",
+                           "age": "int:rand(1, 90)", "level": "int:[1, 2, 3]", "code": "int:7"})
+    assert plan.keys == ('date', 'name', 'type', 'age', 'level', 'code')
+    assert [field.kind for field in plan] == ['timestamp', 'uuid', 'choice', 'randint', 'choice', 'const']
+    assert plan.fields[2].args == (('client', 'partner'),)
+    assert plan.fields[3].args == (1, 90)
+    row = plan.row(random)
+    assert 1 <= row['age'] <= 90 and row['level'] in (1, 2, 3) and row['code'] == 7
+
+
+# 9 Compiled plan produces the same rows for the same seed
+def test_compiled_plan_seeded_output():
+    schema = {"type": "str:['client', 'partner', 'government']", "age": "int:rand(1, 200)", "name": "str:'Anna'"}
+    cli = ConsoleUtility(path='.', file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=10, clear_path='False', multiprocessing=1)
+    random.seed(42)
+    first = [cli.generate_jsonl_content(schema) for _ in range(50)]
+    random.seed(42)
+    second = [cli.generate_jsonl_content(schema) for _ in range(50)]
+    assert first == second
+    assert cli.get_schema_plan() is cli.get_schema_plan()
+
+
+# 10 NumPy engine writes valid JSON lines within the schema ranges
+def test_numpy_engine_block(tmpdir):
+    pytest.importorskip('numpy')
+    schema = {"date": "timestamp:", "name": "str:rand", "type": "str:['client', 'partner']",
+              "age": "int:rand(1, 90)", "code": "str:'X'"}
+    cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=1000, clear_path='False', multiprocessing=1, engine='numpy')
+    cli.generate_jsonl('1')
+    with open(os.path.join(str(tmpdir), 'data_1.jsonl')) as file:
+        lines = file.read().split('\n')
+    rows = [json.loads(line) for line in lines]
+    assert len(rows) == 1000
+    assert list(rows[0].keys()) == ['date', 'name', 'type', 'age', 'code']
+    assert all(1 <= row['age'] <= 90 and row['type'] in ('client', 'partner') and row['code'] == 'X' for row in rows)
+    assert all(uuid.UUID(row['name']).version == 4 for row in rows)
+
+
+# 11 Process pool scheduler writes every file once and merges row ranges
+@pytest.mark.parametrize("file_count, processes", [(3, 2), (1, 3)])
+def test_scheduler_run(tmpdir, file_count, processes):
+    schema = {"name": "str:rand", "age": "int:rand(1, 90)"}
+    cli = ConsoleUtility(path=str(tmpdir), file_count=file_count, file_name='data', file_prefix='count',
+                         data_schema=schema, data_lines=25, clear_path='False', multiprocessing=processes)
+    scheduler.run(cli, processes)
+    files = sorted(os.listdir(str(tmpdir)))
+    assert files == ['data_{}.jsonl'.format(i) for i in range(1, file_count + 1)]
+    for name in files:
+        with open(os.path.join(str(tmpdir), name)) as file:
+            rows = [json.loads(line) for line in file.read().split('\n')]
+        assert len(rows) == 25 and len(set(row['name'] for row in rows)) == 25
+
+
+# 12 Row ranges are split evenly without empty parts
+def test_scheduler_plan_tasks():
+    assert scheduler.plan_tasks(['1', '2'], 10, 2) == [(0, '1', None, 0, 10), (1, '2', None, 0, 10)]
+    assert scheduler.plan_tasks(['1'], 10, 4) == [(0, '1', 0, 0, 3), (0, '1', 1, 3, 3), (0, '1', 2, 6, 2),
+                                                  (0, '1', 3, 8, 2)]
+    assert scheduler.split_rows(2, 4) == [(0, 1), (1, 1)]
+    assert scheduler.split_rows(10, 2, align=4) == [(0, 8), (8, 2)]
+
+
+# 13 The same seed gives byte identical files for any number of processes
+@pytest.mark.parametrize("engine", ['python', 'numpy'])
+def test_seeded_output_is_reproducible(tmpdir, engine):
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+    schema = {"date": "timestamp:", "name": "str:rand", "type": "str:['client', 'partner']", "age": "int:rand(1, 90)"}
+    contents = []
+    for processes in (1, 3):
+        path = tmpdir.mkdir('{}_{}'.format(engine, processes))
+        cli = ConsoleUtility(path=str(path), file_count=2, file_name='data', file_prefix='uuid', data_schema=schema,
+                             data_lines=50, clear_path='False', multiprocessing=processes, engine=engine, seed=7)
+        cli.chunk_rows = 8
+        if processes == 1:
+            cli.generate_jsonl_loop()
+        else:
+            scheduler.run(cli, processes)
+        contents.append({name: path.join(name).read() for name in os.listdir(str(path))})
+    assert contents[0] == contents[1]
+    assert len(contents[0]) == 2
+    first_row = json.loads(list(contents[0].values())[0].split('\n')[0])
+    assert 1672531200.0 <= float(first_row['date']) <= 1672531200.0 + 86400
+
+
+# 14 Template formatter writes the same bytes as the stdlib JSON encoder
+def test_template_serializer_matches_json(tmpdir):
+    schema = {"date": "timestamp:", "name": "str:rand", "type": "str:['client', 'partner']",
+              "age": "int:rand(1, 90)", "code": "str:'100%'", "empty": "int:"}
+    contents = []
+    for serializer in ('json', 'template'):
+        cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name=serializer, file_prefix='count',
+                             data_schema=schema, data_lines=300, clear_path='False', multiprocessing=1, seed=11,
+                             serializer=serializer)
+        cli.generate_jsonl('1')
+        contents.append(tmpdir.join(serializer + '_1.jsonl').read())
+    assert contents[0] == contents[1]
+    assert len(contents[0].split('\n')) == 300
+
+
+# 15 Buffered writer joins lines into few large writes
+def test_buffered_line_writer():
+    class CountingFile:
+        def __init__(self):
+            self.writes = []
+
+        def write(self, data):
+            self.writes.append(data)
+
+    file = CountingFile()
+    writer = serializers.BufferedLineWriter(file, buffer_size=1000)
+    for batch in range(10):
+        writer.write_lines(['{"line": %d}' % (batch * 100 + i) for i in range(100)])
+    writer.flush()
+    assert ''.join(file.writes).split('\n') == ['{"line": %d}' % i for i in range(1000)]
+    assert len(file.writes) == 10
+
+
+# 16 Compressed parts written by parallel workers concatenate into one valid stream
+@pytest.mark.parametrize("compression, module", [('gzip', 'gzip'), ('bz2', 'bz2'), ('xz', 'lzma'),
+                                                 ('zstd', 'zstandard')])
+def test_compressed_output(tmpdir, compression, module):
+    codec = pytest.importorskip(module)
+    schema = {"name": "str:rand", "age": "int:rand(1, 90)"}
+    plain = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='plain', file_prefix='count',
+                           data_schema=schema, data_lines=40, clear_path='False', multiprocessing=1, seed=5)
+    plain.chunk_rows = 10
+    plain.generate_jsonl_loop()
+    packed = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='packed', file_prefix='count',
+                            data_schema=schema, data_lines=40, clear_path='False', multiprocessing=3, seed=5,
+                            compression=compression)
+    packed.chunk_rows = 10
+    scheduler.run(packed, 3)
+    path = packed.file_path('1')
+    assert path.endswith('.jsonl' + sinks.EXTENSIONS[compression])
+    with open(path, 'rb') as file:
+        if compression == 'zstd':
+            data = codec.ZstdDecompressor().stream_reader(file, read_across_frames=True).read()
+        else:
+            data = codec.decompress(file.read())
+    assert data.decode('utf-8') == tmpdir.join('plain_1.jsonl').read()
+
+    # Text is encoded as UTF-8 whatever the locale of the host
+    for name, text_compression in (('text.csv', 'none'), ('text.csv.packed', compression)):
+        with sinks.open_output(str(tmpdir.join(name)), text_compression) as file:
+            assert file.encoding == 'utf-8'
+            file.write('partnér,日本\n')
+    assert tmpdir.join('text.csv').read_binary() == 'partnér,日本\n'.encode('utf-8')
+
+
+# 17 CSV parts written in parallel keep a single header
+def test_csv_output_parts(tmpdir):
+    schema = {"name": "str:rand", "type": "str:['client', 'partner']", "age": "int:rand(1, 90)"}
+    contents = []
+    for processes in (1, 3):
+        cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data{}'.format(processes),
+                             file_prefix='count', data_schema=schema, data_lines=30, clear_path='False',
+                             multiprocessing=processes, seed=3, output_format='csv')
+        cli.chunk_rows = 10
+        scheduler.run(cli, processes) if processes > 1 else cli.generate_jsonl_loop()
+        contents.append(tmpdir.join('data{}_1.csv'.format(processes)).read())
+    assert contents[0] == contents[1]
+    lines = contents[0].split('\n')
+    assert lines[0] == 'name,type,age' and len(lines) == 32 and lines[-1] == ''
+
+
+# 18 Parquet and Arrow files are written with typed columns
+@pytest.mark.parametrize("output_format", ['parquet', 'arrow'])
+def test_columnar_output(tmpdir, output_format):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+    schema = {"date": "timestamp:", "name": "str:rand", "type": "str:['client', 'partner']", "age": "int:rand(1, 90)",
+              "empty": "int:"}
+    cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=100, clear_path='False', multiprocessing=1, output_format=output_format)
+    cli.generate_jsonl_loop()
+    path = cli.file_path('1')
+    table = pq.read_table(path) if output_format == 'parquet' else pa.ipc.open_file(path).read_all()
+    assert table.num_rows == 100
+    assert table.schema.field('date').type == pa.float64()
+    assert table.schema.field('age').type == pa.int64()
+    assert pa.types.is_dictionary(table.schema.field('type').type)
+    assert table.column('empty').null_count == 100
+
+
+# 19 Iterator API yields the same rows that are written to files
+def test_iter_rows_and_chunks(tmpdir):
+    schema = {"name": "str:rand", "type": "str:['client', 'partner']", "age": "int:rand(1, 90)"}
+    cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=20, clear_path='False', multiprocessing=1, seed=9)
+    cli.generate_jsonl('1')
+    lines = tmpdir.join('data_1.jsonl').read().split('\n')
+    assert [json.loads(line) for line in lines] == list(cli.iter_rows(20))
+    assert b''.join(cli.iter_chunks(20, batch_rows=7)).decode('utf-8') == '\n'.join(lines) + '\n'
+    unbounded = cli.iter_rows()
+    assert len([next(unbounded) for _ in range(100)]) == 100
+
+
+# 20 Streaming sink respects rows, rate and duration
+def test_stream_output(tmpdir):
+    schema = {"name": "str:rand", "age": "int:rand(1, 90)"}
+    path = str(tmpdir.join('stream.csv'))
+    cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=50, clear_path='False', multiprocessing=1, output_format='csv')
+    assert cli.stream(path, rows=50) == 50
+    lines = tmpdir.join('stream.csv').read().split('\n')
+    assert lines[0] == 'name,age' and len(lines) == 52
+    start = time.monotonic()
+    written = cli.stream(path, rate=100, duration=0.5)
+    assert 40 <= written <= 60
+    assert time.monotonic() - start < 1.5
+
+
+# 21 Benchmark suite reports throughput and detects regressions
+def test_bench_report():
+    report = bench.run_benchmarks(rows=200, workers=[1], engines=['python'], repeat=1, groups=['field', 'workers'])
+    names = [result['name'] for result in report['results']]
+    assert names == ['field/{}/python'.format(name) for name in bench.FIELD_TYPES] + ['workers/1/python']
+    assert all(result['rows_per_sec'] > 0 and result['bytes'] > 0 for result in report['results'])
+    slower = {'results': [dict(result, rows_per_sec=result['rows_per_sec'] * 2) for result in report['results']]}
+    assert len(bench.compare(report, slower, threshold=0.1)) == len(names)
+    assert bench.compare(report, report, threshold=0.1) == []
+
+
+# 22 Run metrics count rows, bytes and files of every worker
+def test_run_metrics(tmpdir):
+    schema = {"name": "str:rand", "age": "int:rand(1, 90)"}
+    metrics_file = str(tmpdir.join('metrics.json'))
+    cli = ConsoleUtility(path=str(tmpdir), file_count=3, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=40, clear_path='False', multiprocessing=1, metrics_file=metrics_file)
+    summary = cli.run()
+    assert (summary['rows'], summary['files'], summary['total_rows']) == (120, 3, 120)
+    assert summary['bytes'] == sum(os.path.getsize(str(tmpdir.join('data_{}.jsonl'.format(i)))) + 1
+                                   for i in range(1, 4))
+    assert set(summary['timings']) == {'generate', 'serialize', 'io'}
+    with open(metrics_file) as file:
+        assert json.load(file)['rows'] == 120
+
+    monitor = metrics.ProgressMonitor(total_rows=120, total_files=3, interval=0)
+    scheduler.run(cli, 2, monitor)
+    rows, _, files = monitor.totals()
+    assert (rows, files) == (120, 3)
+    assert all(worker['worker'].startswith('worker-') for worker in monitor.summary()['workers'])
+    assert 'Progress: 3/3 files' in monitor.line()
+
+
+# 23 Size targeted files are filled with whole rows up to the target, the same for any number of processes
+@pytest.mark.parametrize("output_format", ['jsonl', 'csv'])
+def test_size_targeted_files(tmpdir, output_format):
+    assert sizing.parse_size('512MB') == 512 * 1000 ** 2 and sizing.parse_size('1.5KiB') == 1536
+    assert sizing.file_sizes(2, None, 10) == [5, 5] and sizing.file_sizes(3, 4, 10) == [4, 4, 2]
+    schema = {"name": "str:rand", "age": "int:rand(1, 90)"}
+    contents = []
+    for processes in (1, 3):
+        path = tmpdir.mkdir('{}_{}'.format(output_format, processes))
+        cli = ConsoleUtility(path=str(path), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                             data_lines=1, clear_path='False', multiprocessing=processes, seed=5,
+                             output_format=output_format, file_size=20000, total_size=50000)
+        cli.segment_bytes = 6000
+        if processes == 1:
+            cli.generate_jsonl_loop()
+        else:
+            scheduler.run(cli, processes)
+        contents.append({name: path.join(name).read() for name in os.listdir(str(path))})
+    assert contents[0] == contents[1]
+    extension = '.' + output_format
+    assert sorted(contents[0]) == ['data_{}{}'.format(i, extension) for i in range(1, 4)]
+    for name, target in zip(sorted(contents[0]), [20000, 20000, 10000]):
+        text = contents[0][name]
+        # Every segment is short of its budget by less than one row
+        assert target - 4 * 60 < len(text) <= target
+        if output_format == 'jsonl':
+            assert all(json.loads(line)['age'] <= 90 for line in text.split('\n'))
+        else:
+            assert text.startswith('name,age\n') and text.count('name,age') == 1 and text.endswith('\n')
+    tasks = scheduler.plan_sized_tasks(['1', '2'], [100, 30], 3, segment_bytes=10)
+    assert [(task[0], task[2], sum(task[4])) for task in tasks] == [(0, 0, 40), (0, 1, 40), (1, None, 30),
+                                                                    (0, 2, 20)]
+
+
+# 24 Manifest runs record completed files and resumed runs only generate missing ones
+@pytest.mark.parametrize("processes", [1, 3])
+def test_manifest_resume(tmpdir, processes, caplog):
+    schema = {"name": "str:rand", "age": "int:rand(1, 90)"}
+
+    def make_cli(**options):
+        return ConsoleUtility(path=str(tmpdir), file_count=2, file_name='data', file_prefix='uuid',
+                              data_schema=schema, data_lines=30, clear_path='False', multiprocessing=processes,
+                              progress_interval=0, **options)
+
+    # Without check_args multiprocessing is not clamped, run() schedules the pool for processes > 1
+    make_cli(write_manifest=True).run()
+    manifest_file = str(tmpdir.join('data.manifest.jsonl'))
+    files = manifest.completed_files(manifest_file)
+    assert [entry['rows'] for entry in files] == [30, 30]
+    assert not [name for name in os.listdir(str(tmpdir)) if name.endswith('.tmp') or '.part' in name]
+    for entry in files:
+        assert entry['sha256'] == manifest.file_checksum(str(tmpdir.join(entry['file'])))
+        assert entry['bytes'] == os.path.getsize(str(tmpdir.join(entry['file'])))
+    kept = tmpdir.join(files[0]['file']).read()
+
+    # The run died while writing the second file
+    with open(manifest_file) as file:
+        lines = [line for line in file.read().split('\n') if line and files[1]['file'] not in line
+                 and 'complete' not in line]
+    with open(manifest_file, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    tmpdir.join(files[1]['file']).remove()
+    make_cli(resume=True).run()
+    assert tmpdir.join(files[0]['file']).read() == kept
+    assert len(tmpdir.join(files[1]['file']).read().split('\n')) == 30
+    assert [entry['file'] for entry in manifest.completed_files(manifest_file)] == [entry['file'] for entry in files]
+
+    # The run died in the middle of appending the record of the second file
+    with open(manifest_file) as file:
+        lines = [line for line in file.read().split('\n') if line and files[1]['file'] not in line
+                 and 'complete' not in line]
+    torn = json.dumps(files[1])[:20]
+    with open(manifest_file, 'w') as file:
+        file.write('\n'.join(lines) + '\n' + torn)
+    tmpdir.join(files[1]['file']).remove()
+    make_cli(resume=True).run()
+    with open(manifest_file) as file:
+        text = file.read()
+    assert text.endswith('\n') and all(json.loads(line) for line in text.split('\n')[:-1])
+    assert [entry['file'] for entry in manifest.completed_files(manifest_file)] == [entry['file'] for entry in files]
+    # A recorded file deleted since the run is generated again and not counted as complete
+    tmpdir.join(files[1]['file']).remove()
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        make_cli(resume=True).run()
+    assert any('1 files already complete' in record.getMessage() for record in caplog.records)
+    assert len(tmpdir.join(files[1]['file']).read().split('\n')) == 30
+    with open(manifest_file) as file:
+        text = file.read()
+    # A whole last record without its newline is kept
+    with open(manifest_file, 'w') as file:
+        file.write(text[:-1])
+    manifest.repair_tail(manifest_file)
+    with open(manifest_file) as file:
+        assert file.read() == text
+
+    with pytest.raises(ValueError):
+        ConsoleUtility(path=str(tmpdir), file_count=2, file_name='data', file_prefix='uuid', data_schema=schema,
+                       data_lines=31, clear_path='False', multiprocessing=1, resume=True).open_manifest()
+
+
+# 25 Partitioned and sharded layout writes one file per partition value and is cleared without listing the tree
+def test_partitioned_layout(tmpdir):
+    schema = {"name": "str:rand", "type": "str:['client', 'partner/x']", "age": "int:rand(1, 90)"}
+    contents = []
+    for processes in (1, 2):
+        path = tmpdir.mkdir('run_{}'.format(processes))
+        cli = ConsoleUtility(path=str(path), file_count=3, file_name='data', file_prefix='count', data_schema=schema,
+                             data_lines=40, clear_path='False', multiprocessing=processes, seed=3,
+                             progress_interval=0, write_manifest=True, partition_by='type', shards=16)
+        cli.run()
+        files = manifest.completed_files(str(path.join('data.manifest.jsonl')))
+        contents.append({entry['file']: path.join(entry['file']).read() for entry in files})
+        assert len(files) == 6 and sum(entry['rows'] for entry in files) == 120
+        assert {entry['partition'] for entry in files} == {'type=client', 'type=partner%2Fx'}
+    assert contents[0] == contents[1]
+    for name, text in contents[0].items():
+        partition, shard, file_name = name.split(os.sep)
+        assert shard == layout.shard_dir(file_name, 16)
+        assert all(set(json.loads(line)) == {'name', 'age'} for line in text.split('\n'))
+
+    cli = ConsoleUtility(path=str(tmpdir.join('run_1')), file_count=3, file_name='data', file_prefix='count',
+                         data_schema=schema, data_lines=40, clear_path='True', multiprocessing=1)
+    assert cli.clear_path_and_files(str(tmpdir.join('run_1'))) == 6
+    assert os.listdir(str(tmpdir.join('run_1'))) == []
+    tmpdir.join('run_2', 'data.manifest.jsonl').remove()
+    tmpdir.join('run_2', 'notes.txt').write('kept')
+    # Directories the layout does not create are not entered, even when their names look like shards
+    for directory in ('2024', 'cafe', '00', 'type=client/0a0', 'kind=x/00'):
+        tmpdir.join('run_2', directory, 'data.csv').write('kept', ensure=True)
+    assert layout.clear_files(str(tmpdir.join('run_2')), 'data') == 0
+    assert layout.clear_files(str(tmpdir.join('run_2')), 'data', 16, 'type') == 6
+    assert sorted(os.listdir(str(tmpdir.join('run_2')))) == ['00', '2024', 'cafe', 'kind=x', 'notes.txt', 'type=client']
+    assert os.listdir(str(tmpdir.join('run_2', 'type=client'))) == ['0a0']
+    with pytest.raises(ValueError):
+        ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                       data_lines=1, clear_path='False', multiprocessing=1, partition_by='name').partition_index()
+
+    # Nulls and empty strings share the default partition directory and its one writer
+    path = tmpdir.mkdir('nullable')
+    cli = ConsoleUtility(path=str(path), file_count=1, file_name='data', file_prefix='count',
+                         data_schema={"id": "int:rand(1, 9)", "type": "str:['', 'a']|nullable(0.3)"}, data_lines=200,
+                         clear_path='False', multiprocessing=1, seed=1, progress_interval=0, write_manifest=True,
+                         partition_by='type')
+    cli.run()
+    files = manifest.completed_files(str(path.join('data.manifest.jsonl')))
+    assert sorted(entry['partition'] for entry in files) == ['type=__HIVE_DEFAULT_PARTITION__', 'type=a']
+    assert sum(entry['rows'] for entry in files) == 200
+    assert not [name for name in os.listdir(str(path.join('type=a'))) if name.endswith('.tmp')]
+
+
+# 26 Float, bool, date, datetime, weighted, Zipf and nullable fields in both engines and all serializers
+@pytest.mark.parametrize("engine", ['python', 'numpy'])
+def test_rich_field_types(tmpdir, engine):
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+    schema = {"price": "float:rand(1.5, 2.5)", "score": "float:normal(0, 1)", "active": "bool:0.3",
+              "day": "date:rand(2023-01-01, 2023-01-31, %d/%m/%Y)",
+              "seen": "datetime:rand(2023-01-01T00:00:00, 2023-01-01T23:59:59)",
+              "type": "str:{'client': 0.7, 'partner': 0.3}|nullable(0.2)", "key": "int:zipf(1.5, 50)",
+              "level": "list:['intern', 'junior']", "age": "int:normal(40, 5)|nullable(0.1)", "bonus": "float:"}
+    cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=20000, clear_path='False', multiprocessing=1, engine=engine, seed=11)
+    cli.generate_jsonl_loop()
+    rows = [json.loads(line) for line in tmpdir.join('data_1.jsonl').read().split('\n')]
+    assert all(1.5 <= row['price'] <= 2.5 and isinstance(row['active'], bool) and row['bonus'] is None
+               for row in rows)
+    assert all(row['day'].endswith('/01/2023') and row['seen'].startswith('2023-01-01T') for row in rows)
+    assert all(row['type'] in ('client', 'partner', None) and 1 <= row['key'] <= 50 for row in rows)
+    assert abs(sum(row['active'] for row in rows) / len(rows) - 0.3) < 0.02
+    assert abs(sum(row['type'] is None for row in rows) / len(rows) - 0.2) < 0.02
+    assert abs(sum(row['type'] == 'client' for row in rows) / len(rows) - 0.56) < 0.02
+    assert sum(row['key'] == 1 for row in rows) > sum(row['key'] == 2 for row in rows) > sum(row['key'] == 3
+                                                                                           for row in rows)
+    assert abs(sum(row['age'] for row in rows if row['age'] is not None) / len(rows) / 0.9 - 40) < 0.5
+
+    plan = compile_schema(schema, seeded=True)
+    lines = []
+    for name in ('json', 'template'):
+        row_values, format_values = serializers.row_serializer(plan, name)
+        rng = random.Random(3)
+        lines.append([format_values(row_values(rng)) for _ in range(200)])
+    assert lines[0] == lines[1]
+    with pytest.raises(ValueError):
+        compile_schema({"price": "float:rand(1, 2)|nullable(2)"})
+
+
+# 27 Nested objects, arrays, expressions in dependency order and unique ids over split files
+@pytest.mark.parametrize("engine", ['python', 'numpy'])
+def test_nested_expression_unique_fields(tmpdir, engine):
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+    schema = {"id": "int:unique(1, 5000)", "price": "float:rand(1, 2)", "qty": "int:rand(1, 5)",
+              "label": "expr:user.name + '-' + str(total)", "total": "expr:round(price * qty, 2)",
+              "user": {"name": "str:['a', 'b']", "age": "int:rand(1, 9)", "tag": "expr:upper(name)"},
+              "tags": ["str:['x', 'y']", 0, 3], "items": [{"sku": "int:rand(1, 9)"}, 2]}
+    cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=5000, clear_path='False', multiprocessing=2, engine=engine, seed=5)
+    cli.chunk_rows = 1000
+    cli.generate_jsonl_loop()
+    rows = [json.loads(line) for line in tmpdir.join('data_1.jsonl').read().split('\n')]
+    assert sorted(row['id'] for row in rows) == list(range(1, 5001))
+    assert all(row['total'] == round(row['price'] * row['qty'], 2) for row in rows)
+    assert all(row['label'] == '{}-{}'.format(row['user']['name'], row['total']) for row in rows)
+    assert all(row['user']['tag'] == row['user']['name'].upper() and 0 <= len(row['tags']) <= 3 and
+               len(row['items']) == 2 for row in rows)
+
+    plan = compile_schema(schema, seeded=True)
+    assert [field.type for field in plan if field.kind == 'expr'] == ['str', 'float']
+    lines = []
+    for name in ('json', 'template'):
+        row_values, format_values = serializers.row_serializer(plan, name)
+        plan.seek(0)
+        rng = random.Random(3)
+        lines.append([format_values(row_values(rng)) for _ in range(100)])
+    assert lines[0] == lines[1]
+    for invalid in ({"a": "expr:b"}, {"a": "expr:b + 1", "b": "expr:a + 1"}, {"a": "expr:__import__('os')"},
+                    {"a": ["int:unique", 2]}):
+        with pytest.raises(ValueError):
+            compile_schema(invalid)
+
+
+# 28 Multi table datasets with foreign keys computed from the parent key space
+@pytest.mark.parametrize("engine", ['python', 'numpy'])
+def test_multi_table_foreign_keys(tmpdir, engine):
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+    table_settings = {
+        "customers": {"data_lines": 2000, "file_count": 2, "data_schema": {"id": "int:unique(1, 10000)"}},
+        "orders": {"data_lines": 3000, "file_count": 2, "data_schema": {"id": "int:unique",
+                                                                          "customer_id": "ref:customers.id:zipf(1.2)"}},
+        "items": {"data_lines": 12000, "data_schema": {"order_id": "ref:orders.id:each", "buyer": "ref:customers.id"}}}
+    cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count', data_schema={},
+                         data_lines=1, clear_path='False', multiprocessing=1, engine=engine, seed=9)
+    cli.chunk_rows = 1000
+    plans = tables.compile_tables(table_settings, seeded=True)
+    for name, table in table_settings.items():
+        table_cli = tables.table_utility(cli, name, table, plans[name])
+        scheduler.run(table_cli, 2) if name == 'orders' else table_cli.generate_jsonl_loop()
+
+    def load(name):
+        return [json.loads(line) for path in sorted(tmpdir.listdir()) if path.basename.startswith(name + '_')
+                for line in path.read().split('\n')]
+    customers, orders, items = load('customers'), load('orders'), load('items')
+    customer_ids = {row['id'] for row in customers}
+    order_ids = {row['id'] for row in orders}
+    assert len(customer_ids) == 4000 and len(order_ids) == 6000
+    assert all(row['customer_id'] in customer_ids for row in orders)
+    assert all(row['order_id'] in order_ids and row['buyer'] in customer_ids for row in items)
+    per_order = {}
+    for row in items:
+        per_order[row['order_id']] = per_order.get(row['order_id'], 0) + 1
+    assert set(per_order.values()) == {2} and len(per_order) == 6000
+    per_customer = sorted((sum(row['customer_id'] == key for row in orders) for key in {row['customer_id']
+                                                                                        for row in orders[:50]}))
+    assert per_customer[-1] > 100
+
+    with pytest.raises(ValueError):
+        tables.compile_tables({"a": {"data_schema": {"id": "int:rand(1, 5)"}},
+                               "b": {"data_schema": {"a_id": "ref:a.id"}}})
+    single = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count',
+                            data_schema={"a_id": "ref:a.id"}, data_lines=1, clear_path='False', multiprocessing=1)
+    with pytest.raises(ValueError):
+        single.get_schema_plan()
+
+
+# 29 Value pools generated once, sampled by index and cached on disk by schema and seed
+@pytest.mark.parametrize("engine", ['python', 'numpy'])
+def test_value_pools(tmpdir, engine):
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+    cache = tmpdir.mkdir('pools')
+    schema = {"name": "str:rand(pool=100)", "date": "timestamp:rand(pool=10)", "score": "float:normal(0, 1)|pool(20)"}
+    cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=3000, clear_path='False', multiprocessing=1, engine=engine, seed=2,
+                         pool_cache=str(cache))
+    cli.generate_jsonl_loop()
+    rows = [json.loads(line) for line in tmpdir.join('data_1.jsonl').read().split('\n')]
+    plan = cli.get_schema_plan()
+    assert [field.kind for field in plan] == ['choice'] * 3
+    assert {row['name'] for row in rows} <= set(plan.fields[0].args[0]) and len({row['name'] for row in rows}) > 90
+    assert len({row['date'] for row in rows}) <= 10 and len({row['score'] for row in rows}) <= 20
+    assert len(cache.listdir()) == 3
+
+    # Seeded pools are read back from the disk cache instead of being generated again
+    pools.clear_memory()
+    path = sorted(cache.listdir(), key=lambda item: len(item.read()))[0]
+    path.write(json.dumps(['cached']))
+    assert 'cached' in [field.args[0][0] for field in compile_schema(schema, seed=2)]
+    assert compile_schema(schema, seed=3).fields[0].args[0] != plan.fields[0].args[0]
+    with pytest.raises(ValueError):
+        compile_schema({"name": "str:'constant'|pool(10)"})
+    pools.set_cache_dir(None)
+    pools.clear_memory()
+
+
+# 30 Delta runs change existing keys of a seeded run and insert new ones, chained through their manifests
+def test_delta_runs(tmpdir):
+    schema = {"id": "int:unique", "name": "str:rand", "age": "int:rand(1, 90)"}
+    cli = ConsoleUtility(path=str(tmpdir), file_count=2, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=1000, clear_path='False', multiprocessing=1, seed=4, write_manifest=True)
+    cli.run()
+    rows = {}
+    for index in (1, 2):
+        for line in tmpdir.join('data_{}.jsonl'.format(index)).read().split('\n'):
+            row = json.loads(line)
+            rows[row['id']] = row
+    assert len(rows) == 2000
+
+    manifest_file = str(tmpdir.join('data.manifest.jsonl'))
+    for step in (1, 2):
+        delta_cli = ConsoleUtility(path='.', file_count=1, file_name='other', file_prefix='count', data_schema={},
+                                   data_lines=1, clear_path='False', multiprocessing=1)
+        record = delta.run_delta(delta_cli, manifest_file, inserts=0.01, updates=0.05, deletes=0.02)
+        assert record['step'] == step and record['updates'] == round(len(rows) * 0.05)
+        operations = {}
+        for line in tmpdir.join('data_delta{}.jsonl'.format(step)).read().split('\n'):
+            row = json.loads(line)
+            operation = row.pop('op')
+            operations[operation] = operations.get(operation, 0) + 1
+            assert (row['id'] in rows) == (operation != 'insert')
+            if operation == 'delete':
+                assert row['name'] is None
+                del rows[row['id']]
+            else:
+                rows[row['id']] = row
+        assert operations == {'insert': record['inserts'], 'update': record['updates'], 'delete': record['deletes']}
+        manifest_file = str(tmpdir.join('data_delta{}.manifest.jsonl'.format(step)))
+    assert len(rows) == 2000 + 20 - 40 + 20 - 40
+
+    unseeded = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='plain', file_prefix='count',
+                              data_schema=schema, data_lines=10, clear_path='False', multiprocessing=1,
+                              write_manifest=True)
+    unseeded.run()
+    with pytest.raises(ValueError):
+        delta.run_delta(unseeded, str(tmpdir.join('plain.manifest.jsonl')), updates=0.1)
+
+
+# 31 Generation server streams chunked rows of warm schemas from a process pool on localhost
+def test_generation_server(tmpdir):
+    import asyncio
+    import urllib.error
+    import urllib.request
+
+    schema = {"id": "int:unique", "name": "str:rand", "age": "int:rand(1, 90)"}
+
+    def fetch(url, body=None):
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        try:
+            with urllib.request.urlopen(url, data) as response:
+                return response.status, response.headers.get('Transfer-Encoding'), response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, None, error.read()
+
+    async def scenario():
+        generation_server = server.GenerationServer(processes=1, task_rows=4)
+        listening = await generation_server.start('127.0.0.1', 0)
+        url = 'http://127.0.0.1:{}'.format(listening.sockets[0].getsockname()[1])
+        loop = asyncio.get_running_loop()
+        requests = [('/generate', {'data_schema': schema, 'rows': 300, 'seed': 5}),
+                    ('/generate', {'data_schema': schema, 'rows': 300, 'seed': 5}),
+                    ('/generate', {'data_schema': schema, 'rows': 10, 'format': 'csv'}),
+                    ('/generate', {'data_schema': schema, 'rows': 10, 'format': 'csv'}),
+                    ('/generate', {'data_schema': {"id": "int:rand(x)"}, 'rows': 10}),
+                    ('/generate', {'data_schema': schema}),
+                    ('/missing', None),
+                    ('/health', None),
+                    ('/generate', {'data_schema': {"name": "str:rand(pool=5)"}, 'rows': 20})]
+        # Requests over the limits are rejected before anything is compiled
+        limited = [{"name": "str:rand(pool=10000000)"}, {"a": "int:rand(1, 9)", "b": "expr:9**9**9"},
+                   {"a": "str:rand", "b": "expr:a * 100000000"}, {"tags": ["int:rand(1, 5)", 1, 100000]},
+                   {"key": "int:zipf(1.2, 10000000)"}]
+        requests += [('/generate', {'data_schema': schema, 'rows': 1}) for schema in limited]
+        try:
+            results = await asyncio.gather(*[loop.run_in_executor(None, fetch, url + path, body)
+                                             for path, body in requests])
+            # Unseeded pools are drawn by the server once, the workers pick from its values
+            pooled = next(cli for cli in server._warm.values() if list(cli.data_schema) == ['name'])
+            return results, list(pooled.get_schema_plan())[0].args[0]
+        finally:
+            await generation_server.close()
+
+    results, pool = asyncio.run(scenario())
+    (status, encoding, body), second, csv_result, other_csv, invalid, missing_rows, missing, health = results[:8]
+    pooled = [json.loads(line)['name'] for line in results[8][2].decode('utf-8').split('\n')[:-1]]
+    assert len(pooled) == 20 and set(pooled) <= set(pool)
+    for status_code, _, error in results[9:]:
+        assert status_code == 400 and 'server limits' in json.loads(error)['error']
+    assert status == 200 and encoding == 'chunked' and body == second[2]
+    cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=300, clear_path='False', multiprocessing=1, seed=5)
+    cli.generate_jsonl_loop()
+    assert body.decode('utf-8') == tmpdir.join('data_1.jsonl').read() + '\n'
+    lines = csv_result[2].decode('utf-8').split('\n') + other_csv[2].decode('utf-8').split('\n')
+    # Both headers and trailing newlines add one distinct value each to the 20 ids
+    assert lines[0] == 'id,name,age' and len(lines) == 24
+    assert len({line.split(',')[0] for line in lines}) == 22
+    assert invalid[0] == 400 and 'data_schema' in json.loads(invalid[2])['error']
+    assert missing_rows[0] == 400 and missing[0] == 404
+    assert health[0] == 200 and json.loads(health[2])['status'] == 'ok'
+
+
+# 32 Library API generating into lists, paths and file objects, cli importable outside the repository
+def test_library_api(tmpdir):
+    import io
+    import subprocess
+    import sys
+
+    schema = {"id": "int:unique", "name": "str:rand", "age": "int:rand(1, 90)"}
+    rows = generator.generate(schema, 20, seed=1)
+    assert len(rows) == 20 and set(rows[0]) == {'id', 'name', 'age'}
+    assert generator.generate(schema, 20, str(tmpdir.join('rows.jsonl')), seed=1) == 20
+    assert [json.loads(line) for line in tmpdir.join('rows.jsonl').read().strip().split('\n')] == rows
+    buffer = io.BytesIO()
+    generator.generate(schema, 5, buffer, output_format='csv', compression='none')
+    assert buffer.getvalue().decode('utf-8').split('\n')[0] == 'id,name,age'
+    with pytest.raises(ValueError):
+        generator.generate(schema, 5, io.BytesIO(), output_format='parquet')
+
+    # Paths get the bytes of cli.py files of the same seed, and no partial file when generation fails
+    for output_format in ('jsonl', 'csv'):
+        path = tmpdir.mkdir('cli_' + output_format)
+        ConsoleUtility(path=str(path), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                       data_lines=20, clear_path='False', multiprocessing=1, seed=1,
+                       output_format=output_format).generate_jsonl_loop()
+        target = tmpdir.join('library.' + output_format)
+        generator.generate(schema, 20, str(target), output_format=output_format, seed=1)
+        assert target.read_binary() == path.join('data_1.' + output_format).read_binary()
+    with pytest.raises(ValueError):
+        generator.generate({"id": "int:unique(1, 5)"}, 10, str(tmpdir.join('failed.jsonl')), seed=1)
+    assert not [name for name in os.listdir(str(tmpdir)) if name.startswith('failed')]
+
+    # Importing the cli from another directory neither reads default.ini nor imports optional dependencies
+    root = os.path.dirname(os.path.abspath(generator.__file__))
+    script = ('import sys; sys.path.insert(0, {!r}); import cli; import generator as generator_module; '
+              'print(cli.load_defaults()["file_name"], cli.ConsoleUtility is generator_module.ConsoleUtility, '
+              'sorted(set(sys.modules) & {{"numpy", "pyarrow", "zstandard", "orjson", "cProfile"}}))').format(root)
+    output = subprocess.run([sys.executable, '-c', script], cwd=str(tmpdir), capture_output=True, text=True, check=True)
+    assert output.stdout.split() == ['file', 'True', '[]']
+
+
+# 33 Schema parser reports every malformed field with its column and compiles the validated nodes
+def test_schema_parser(caplog):
+    import schema_parser
+
+    schema = {"id": "int:unique", "age": "int:rand(x)", "kind": "NoneType:", "user": {"score": "bool:3"},
+              "total": "expr:missing + 1", "type": "['client', 'partner']", "day": "date:rand(2023-01-31, 2023-01-01)"}
+    with pytest.raises(schema_parser.SchemaError) as error:
+        schema_parser.parse_schema(schema)
+    problems = {problem.path: problem.position for problem in error.value.problems}
+    assert problems == {'age': 4, 'kind': 0, 'user.score': 5, 'total': None, 'day': 22}
+    assert schema_parser.point_problem(error.value.problems[0]) == 'int:rand(x)\n    ^'
+
+    # Every key is checked and validation logs the problems instead of exiting
+    cli = ConsoleUtility(path='.', file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=10, clear_path='False', multiprocessing=1)
+    with caplog.at_level(logging.ERROR):
+        assert cli.validate_schema(schema) is False
+    assert sum('Invalid schema' in record.getMessage() for record in caplog.records) == 5
+    with pytest.raises(ValueError):
+        cli.convert_str_to_dict('{"id": ')
+
+    # Values of timestamps are ignored with a warning, as by the original validation
+    valid = {"id": "int:unique", "type": "['client', 'partner']", "code": "int:['1', '2']", "name": "str:rand:",
+             "date": "timestamp:now", "user": {"seen": "timestamp:rand(1, 2)|nullable(0.5)"}}
+    cli = ConsoleUtility(path='.', file_count=1, file_name='data', file_prefix='count', data_schema=valid,
+                         data_lines=10, clear_path='False', multiprocessing=1, seed=1)
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        assert cli.validate_schema(valid) is True
+    assert [record.getMessage() for record in caplog.records] == [
+        "Error: Timestamp does not support any values and it will be ignored 'date':'timestamp:now'",
+        "Error: Timestamp does not support any values and it will be ignored 'user.seen':'timestamp:rand(1, 2)'"]
+    plan = cli.get_schema_plan()
+    assert [(field.key, field.type, field.kind) for field in plan] == [
+        ('id', 'int', 'unique'), ('type', 'str', 'choice'), ('code', 'int', 'choice'), ('name', 'str', 'uuid'),
+        ('date', 'timestamp', 'timestamp'), ('user', 'object', 'object')]
+    assert plan.fields[2].args == ((1, 2),)
+    assert float(plan.row(random.Random(1))['date']) > 0
+
+
+# 34 Fixed width files preallocated and written in place through memory maps, with a row offset index
+def test_fixed_width(tmpdir):
+    import fixed_width
+
+    schema = {"id": "int:unique(1, 100000)", "name": "str:rand", "type": "str:['client', 'partnér']",
+              "age": "int:rand(1, 90)|nullable(0.2)", "score": "float:normal(0, 1)", "active": "bool:0.3"}
+    contents = []
+    for processes in (1, 3):
+        path = tmpdir.mkdir('fixed{}'.format(processes))
+        cli = ConsoleUtility(path=str(path), file_count=2, file_name='data', file_prefix='count', data_schema=schema,
+                             data_lines=50, clear_path='False', multiprocessing=processes, seed=7,
+                             output_format='fixed')
+        assert cli.check_args()
+        # Files split into ranges of 10 rows are written by several processes into the same preallocated file
+        cli.chunk_rows = 10
+        scheduler.run(cli, processes) if processes > 1 else cli.generate_jsonl_loop()
+        assert sorted(os.listdir(str(path))) == ['data_1.dat', 'data_1.dat.idx', 'data_2.dat', 'data_2.dat.idx']
+        contents.append([path.join(name).read_binary() for name in ('data_1.dat', 'data_2.dat')])
+    assert contents[0] == contents[1]
+
+    index = json.loads(tmpdir.join('fixed3', 'data_1.dat.idx').read())
+    width = index['record_width']
+    assert [field['width'] for field in index['fields']] == [6, 36, 8, 2, 24, 5]
+    assert width == 82 and index['rows'] == 50 and index['offsets'] == [[0, 0]]
+    data = contents[1][0]
+    assert len(data) == 50 * width and all(len(line) == width - 1 for line in data.split(b'\n')[:-1])
+    # Row 20 is read at its offset, fields at their offsets in the record
+    record = data[20 * width:21 * width]
+    assert record.endswith(b'\n') and record[42:50].decode('utf-8').strip() in ('client', 'partnér')
+    ids = [int(data[row * width:row * width + 6]) for row in range(50)]
+    assert len(set(ids)) == 50
+
+    # Foreign keys are as wide as the keys of the parent sequence
+    table_settings = {"customers": {"data_lines": 40, "data_schema": {"id": "int:unique(1, 5000)"}},
+                      "orders": {"data_lines": 60, "data_schema": {"id": "int:unique(1, 100)",
+                                                                    "customer_id": "ref:customers.id"}}}
+    path = tmpdir.mkdir('tables')
+    cli = ConsoleUtility(path=str(path), file_count=1, file_name='data', file_prefix='count', data_schema={},
+                         data_lines=1, clear_path='False', multiprocessing=1, seed=7, output_format='fixed')
+    plans = tables.compile_tables(table_settings, seeded=True)
+    for name, table in table_settings.items():
+        tables.table_utility(cli, name, table, plans[name]).generate_jsonl_loop()
+    index = json.loads(path.join('orders_1.dat.idx').read())
+    assert [field['width'] for field in index['fields']] == [3, 4] and index['record_width'] == 8
+    customer_ids = {int(line) for line in path.join('customers_1.dat').read().split('\n')[:-1]}
+    orders = path.join('orders_1.dat').read().split('\n')[:-1]
+    assert len(orders) == 60 and all(int(line[3:]) in customer_ids for line in orders)
+
+    plan = compile_schema({"a": "int:rand(1, 5)", "b": "expr:a * 2"})
+    with pytest.raises(ValueError):
+        fixed_width.record_layout(plan)
+    cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                         data_lines=5, clear_path='False', multiprocessing=1, output_format='fixed',
+                         compression='gzip')
+    assert not cli.check_args()
+
+
+# 35 Unique fields of size targeted files take distinct values over every file and segment of the run
+def test_sized_unique_fields(tmpdir):
+    schema = {"id": "int:unique(1, 152)", "name": "str:rand"}
+    contents = []
+    for processes in (1, 3):
+        path = tmpdir.mkdir('sized{}'.format(processes))
+        cli = ConsoleUtility(path=str(path), file_count=1, file_name='data', file_prefix='count', data_schema=schema,
+                             data_lines=1, clear_path='False', multiprocessing=processes, seed=3,
+                             file_size=3000, total_size=8000)
+        cli.segment_bytes = 1000
+        # Rows of at least 55 bytes with their uuid names, 19 per segment of 1000 bytes and 8 segments in the run
+        assert cli.sized_positions() == ([0, 57, 114], 55)
+        scheduler.run(cli, processes) if processes > 1 else cli.generate_jsonl_loop()
+        contents.append([path.join('data_{}.jsonl'.format(i)).read() for i in range(1, 4)])
+    assert contents[0] == contents[1]
+    ids = [json.loads(line)['id'] for text in contents[0] for line in text.split('\n')]
+    assert len(ids) > 100 and len(set(ids)) == len(ids) and all(1 <= value <= 152 for value in ids)
+    cli = ConsoleUtility(path=str(tmpdir), file_count=1, file_name='data', file_prefix='count',
+                         data_schema={"id": "int:unique(1, 151)", "name": "str:rand"}, data_lines=1,
+                         clear_path='False', multiprocessing=1, seed=3, file_size=3000, total_size=8000)
+    cli.segment_bytes = 1000
+    with pytest.raises(ValueError):
+        cli.run()
+    assert not [name for name in os.listdir(str(tmpdir)) if name.endswith('.jsonl')]
+
+
+# 36 Random prefixes are distinct, runs with more files than random prefixes are rejected instead of hanging
+def test_random_prefix_limit(tmpdir):
+    def make_cli(file_count, **options):
+        return ConsoleUtility(path=str(tmpdir), file_count=file_count, file_name='data', file_prefix='random',
+                              data_schema={"id": "int:unique"}, data_lines=1, clear_path='False', multiprocessing=1,
+                              seed=4, **options)
+
+    prefixes = make_cli(1000).file_prefixes()
+    assert len(set(prefixes)) == 1000 and all(0 <= int(prefix) <= 100000 for prefix in prefixes)
+    assert make_cli(generator.RANDOM_PREFIXES).check_args()
+    assert not make_cli(generator.RANDOM_PREFIXES + 1).check_args()
+    assert not make_cli(1, file_size=1, total_size=generator.RANDOM_PREFIXES + 1).check_args()
+    with pytest.raises(ValueError):
+        make_cli(generator.RANDOM_PREFIXES + 1).file_prefixes()